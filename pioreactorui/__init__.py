@@ -6,6 +6,7 @@ import sqlite3
 import tempfile
 import typing as t
 from base64 import b64decode
+from contextlib import contextmanager
 from datetime import datetime
 from datetime import timezone
 from logging import handlers
@@ -24,6 +25,7 @@ from pioreactor.whoami import am_I_leader
 from pioreactor.whoami import get_unit_name
 
 from .config import env
+from .config import is_testing_env
 from .version import __version__
 
 VERSION = __version__
@@ -56,6 +58,37 @@ client.username_pw_set(
     pioreactor_config.get("mqtt", "password", fallback="raspberry"),
 )
 
+# topic -> qos, re-subscribed on every (re)connect
+_subscriptions: dict[str, int] = {}
+
+# called after every (re)connect, once subscriptions are sent.
+_connect_callbacks: list[t.Callable[[], None]] = []
+
+
+def _on_connect(client, userdata, flags, reason_code, properties) -> None:
+    for topic, qos in _subscriptions.items():
+        client.subscribe(topic, qos)
+
+    for callback in _connect_callbacks:
+        callback()
+
+
+client.on_connect = _on_connect
+
+
+def add_connect_callback(callback: t.Callable[[], None]) -> None:
+    """Calls callback() after every (re)connect. Messages published while disconnected are missed."""
+    if callback not in _connect_callbacks:
+        _connect_callbacks.append(callback)
+
+
+def add_subscription(topic: str, callback: t.Callable, qos: int = 0) -> None:
+    """Calls callback(client, userdata, message) for messages on topic (wildcards allowed)."""
+    client.message_callback_add(topic, callback)
+    _subscriptions[topic] = qos
+    if client.is_connected():
+        client.subscribe(topic, qos)
+
 
 def decode_base64(string: str) -> str:
     return b64decode(string).decode("utf-8")
@@ -64,10 +97,12 @@ def decode_base64(string: str) -> str:
 def create_app():
     from .unit_api import unit_api
     from .api import api
+    from .compression import compress_response
 
     app = Flask(NAME)
 
     app.register_blueprint(unit_api)
+    app.after_request(compress_response)
 
     if am_I_leader():
         app.register_blueprint(api)
@@ -80,6 +115,24 @@ def create_app():
         logger.debug("Starting MQTT client")
         client.loop_start()
 
+        from .chart_cache import start_invalidating_on_new_readings
+
+        start_invalidating_on_new_readings()
+
+        from .recent_readings import start_buffering_recent_readings
+
+        start_buffering_recent_readings()
+
+        from .live_updates import start_notifying_on_new_rows
+
+        start_notifying_on_new_rows()
+
+        if not is_testing_env():
+            # create and verify the indexes for our hot queries in the background.
+            from .tasks import migrate_app_db
+
+            migrate_app_db()
+
     @app.teardown_appcontext
     def close_connection(exception) -> None:
         db = getattr(g, "_app_database", None)
@@ -179,6 +232,53 @@ def query_app_db(
     return (rv[0] if rv else None) if one else rv
 
 
+def iter_app_db(query: str, args=(), batch_size: int = 1000) -> t.Iterator[dict[str, t.Any]]:
+    """
+    Like query_app_db, but returns an iterator over the rows that fetches batch_size at a time, instead
+    of all of them. The query is executed immediately, so errors are raised here.
+    """
+    assert am_I_leader()
+    cur = _get_app_db_connection().execute(query, args)
+
+    def rows() -> t.Iterator[dict[str, t.Any]]:
+        try:
+            while batch := cur.fetchmany(batch_size):
+                yield from batch
+        finally:
+            cur.close()
+
+    return rows()
+
+
+@contextmanager
+def read_app_db_snapshot() -> t.Iterator[None]:
+    """App db queries within this block all read the same snapshot of the database."""
+    con = _get_app_db_connection()
+    if con.in_transaction:
+        yield
+        return
+
+    con.execute("BEGIN")
+    try:
+        yield
+    finally:
+        # nothing was written
+        con.rollback()
+
+
+# the app of app_db_context's contexts, created once rather than per task run.
+_background_app = Flask(NAME)
+
+
+@contextmanager
+def app_db_context(con: sqlite3.Connection) -> t.Iterator[None]:
+    """For code outside of a request (ex: huey tasks): query_app_db and friends use con within this block."""
+    con.row_factory = _make_dicts
+    with _background_app.app_context():
+        g._app_database = con
+        yield
+
+
 def query_temp_local_metadata_db(
     query: str, args=(), one: bool = False
 ) -> dict[str, t.Any] | list[dict[str, t.Any]] | None:
@@ -7,7 +7,9 @@ import re
 import sqlite3
 import tempfile
 from pathlib import Path
+from time import time
 from typing import Any
+from zlib import crc32
 
 from flask import abort
 from flask import Blueprint
@@ -15,12 +17,15 @@ from flask import current_app
 from flask import jsonify
 from flask import request
 from flask import Response
+from flask import stream_with_context
 from flask.typing import ResponseReturnValue
 from huey.api import Result
 from huey.exceptions import HueyException
 from msgspec import DecodeError
 from msgspec import ValidationError
+from msgspec.msgpack import encode as msgpack_encode
 from msgspec.yaml import decode as yaml_decode
+from paho.mqtt.client import MQTTMessageInfo
 from pioreactor.config import get_leader_hostname
 from pioreactor.experiment_profiles.profile_struct import Profile
 from pioreactor.pubsub import get_from
@@ -34,6 +39,7 @@ from werkzeug.utils import secure_filename
 
 from . import client
 from . import HOSTNAME
+from . import iter_app_db
 from . import modify_app_db
 from . import msg_to_JSON
 from . import publish_to_error_log
@@ -42,12 +48,66 @@ from . import publish_to_log
 from . import query_app_db
 from . import structs
 from . import tasks
+from .chart_cache import cached_query_time_series
+from .charts import get_chart_descriptors
+from .charts import get_charts_validator
+from .charts import get_materialized
+from .charts import get_materialized_charts
+from .charts import query_charts
+from .charts import select_charts
+from .charts import transform_charts
+from .compression import precompress
 from .config import cache
 from .config import env
 from .config import is_testing_env
+from .live_updates import decode_event_id
+from .live_updates import get_current_cursors
+from .live_updates import MAX_TAIL_SECONDS
+from .live_updates import stream_new_rows
+from .live_updates import tail_logs
+from .live_updates import TAIL_SECONDS
+from .live_updates import tail_slots
+from .log_archive import read_log_archive
+from .log_search import MAX_PAGE_SIZE as MAX_LOG_SEARCH_PAGE_SIZE
+from .log_search import search_logs_sql
+from .log_search import to_fts_query
+from .queries import get_min_level_num
+from .queries import hours_ago
+from .queries import LAST_LOG
+from .queries import logs_args
+from .queries import logs_have_level_num
+from .queries import LOGS_LOOKBACK_HOURS
+from .queries import logs_page_args
+from .queries import logs_page_sql
+from .queries import logs_sql
+from .queries import LOGS_VALIDATOR_SQL
+from .queries import MAX_LOGS_PAGE_SIZE
+from .queries import media_rates_args
+from .queries import MEDIA_RATES_SQL
+from .queries import parse_timestamp
+from .queries import resolve_window
+from .rollups import ROLLUP_SOURCES
+from .schema import get_time_series_table
+from .time_series import BUILTIN_TIME_SERIES
+from .time_series import decode_page_token
+from .time_series import encode_page_token
+from .time_series import get_cursor
+from .time_series import get_validator
+from .time_series import MAX_PAGE_SIZE
+from .time_series import query_overlay
+from .time_series import query_time_series_page
+from .time_series import stream_time_series
+from .time_series import to_columnar
+from .time_series import to_json
 from .utils import create_task_response
+from .utils import is_cached_by_client
 from .utils import is_valid_unix_filename
+from .utils import json_array_chunks
+from .utils import not_modified
 from .utils import scrub_to_valid
+from .utils import set_etag
+from .y_transformations import compile_y_transformation
+from .y_transformations import transform_result
 
 
 api = Blueprint("api", __name__, url_prefix="/api")
@@ -329,257 +389,658 @@ def shutdown_units() -> ResponseReturnValue:
 ## Logs
 
 
-@api.route("/experiments/<experiment>/logs", methods=["GET"])
-def get_logs(experiment: str) -> ResponseReturnValue:
-    """Shows event logs from all units"""
+def get_logs_validator(experiment: str) -> str:
+    """
+    Changes when a log of the experiment (or of $experiment) is added, and every minute as old logs leave the
+    window. Logs' timestamps come from the workers' clocks, so a max timestamp could miss a new log.
+    """
+    r = query_app_db(LOGS_VALIDATOR_SQL, (experiment,), one=True)
+    assert isinstance(r, dict)
+    return f"logs-{experiment}-{r['cursor']}-{int(time() // 60)}"
 
-    def get_level_string(min_level: str) -> str:
-        levels = {
-            "DEBUG": ["ERROR", "WARNING", "NOTICE", "INFO", "DEBUG"],
-            "INFO": ["ERROR", "NOTICE", "INFO", "WARNING"],
-            "WARNING": ["ERROR", "WARNING"],
-            "ERROR": ["ERROR"],
-        }
 
-        selected_levels = levels.get(min_level, levels["INFO"])
-        return " or ".join(f'level == "{level}"' for level in selected_levels)
+def get_logs_page(experiment: str, task: str, pioreactor_unit: str | None = None) -> Response:
+    """
+    A page of logs, newest first: {"logs": [...], "next": ...}. Pass "next" back as `before` for the page of
+    older logs, it's None on the last page. Query parameters:
+      - page_size: default 50, at most MAX_LOGS_PAGE_SIZE.
+      - before: the previous page's "next".
+      - lookback: hours, default 24. Logs are never older than the experiment.
+      - min_level, and units (repeated, or comma separated).
+    Archived logs are read too, see log_archive.py.
+    """
+    args = request.args
+    min_level = args.get("min_level", "INFO")
+
+    try:
+        page_size = min(max(args.get("page_size", 50, type=int), 1), MAX_LOGS_PAGE_SIZE)
+        lookback = float(args.get("lookback", LOGS_LOOKBACK_HOURS))
+        before = decode_page_token(args["before"]) if "before" in args else LAST_LOG
+    except ValueError as e:
+        publish_to_error_log(str(e), task)
+        return Response(status=400)
+
+    units = tuple(get_list_arg("units")) if pioreactor_unit is None else ()
+    etag = get_logs_validator(experiment)
+    if is_cached_by_client(etag):
+        return not_modified(etag)
+
+    try:
+        archived = read_log_archive(experiment, hours_ago(lookback))
+        logs = query_app_db(
+            logs_page_sql(pioreactor_unit is not None, len(units), logs_have_level_num(), archived),
+            logs_page_args(
+                experiment, min_level, lookback, before, page_size, pioreactor_unit, units, archived
+            ),
+        )
+        assert isinstance(logs, list)
+    except Exception as e:
+        publish_to_error_log(str(e), task)
+        return Response(status=500)
+
+    next_page = (
+        encode_page_token(logs[-1]["timestamp"], logs[-1]["rowid"])
+        if len(logs) == page_size
+        else None
+    )
+    for log in logs:
+        del log["rowid"]
+    return set_etag(jsonify({"logs": logs, "next": next_page}), etag)
+
+
+@api.route("/experiments/<experiment>/logs", methods=["GET"])
+def get_logs(experiment: str) -> ResponseReturnValue:
+    """
+    Shows event logs from all units, archived ones too, see log_archive.py. With page_size or before, returns
+    pages, see get_logs_page.
+    """
+    if "page_size" in request.args or "before" in request.args:
+        return get_logs_page(experiment, "get_logs")
 
     min_level = request.args.get("min_level", "INFO")
 
+    etag = get_logs_validator(experiment)
+    if is_cached_by_client(etag):
+        return not_modified(etag)
+
     try:
+        archived = read_log_archive(experiment, hours_ago(LOGS_LOOKBACK_HOURS))
         recent_logs = query_app_db(
-            f"""SELECT l.timestamp, level, l.pioreactor_unit, message, task
-                FROM logs AS l
-                WHERE (l.experiment=? OR l.experiment='$experiment')
-                    AND ({get_level_string(min_level)})
-                    AND l.timestamp >= MAX( strftime('%Y-%m-%dT%H:%M:%S', datetime('now', '-24 hours')), (SELECT created_at FROM experiments where experiment=?) )
-                ORDER BY l.timestamp DESC LIMIT 50;""",
-            (experiment, experiment),
+            logs_sql(for_unit=False, has_level_num=logs_have_level_num(), archived=archived),
+            logs_args(experiment, min_level, archived=archived),
         )
 
     except Exception as e:
         publish_to_error_log(str(e), "get_logs")
         return Response(status=500)
 
-    return jsonify(recent_logs)
+    return set_etag(jsonify(recent_logs), etag)
 
 
-@api.route("/experiments/<experiment>/logs", methods=["POST"])
-def publish_new_log(experiment: str) -> ResponseReturnValue:
-    body = request.get_json()
-    topic = f"pioreactor/{body['pioreactor_unit']}/{experiment}/logs/ui/info"
-    client.publish(
+def publish_user_log(experiment: str, log: structs.NewLog, qos: int = 0) -> MQTTMessageInfo:
+    topic = f"pioreactor/{log.pioreactor_unit}/{experiment}/logs/ui/info"
+    return client.publish(
         topic,
-        msg_to_JSON(body["message"], body["source"] or "user", "info", timestamp=body["timestamp"]),
+        msg_to_JSON(log.message, log.source or "user", "info", timestamp=log.timestamp),
+        qos=qos,
     )
+
+
+@api.route("/experiments/<experiment>/logs", methods=["POST"])
+def publish_new_log(experiment: str) -> ResponseReturnValue:
+    try:
+        log = current_app.get_json(request.data, type=structs.NewLog)
+    except (ValidationError, DecodeError) as e:
+        publish_to_error_log(str(e), "publish_new_log")
+        return Response(status=400)
+
+    publish_user_log(experiment, log)
+    return Response(status=202)
+
+
+# most logs in one request to publish_new_logs.
+MAX_NEW_LOGS = 10_000
+
+
+@api.route("/experiments/<experiment>/logs/batch", methods=["POST"])
+def publish_new_logs(experiment: str) -> ResponseReturnValue:
+    """
+    Publishes an array of logs, each like the body of publish_new_log, in order. They're queued in the MQTT
+    client and sent in one burst. With ?wait=1, responds once the last log is acknowledged by the broker
+    (and so all before it were sent), else immediately.
+    """
+    try:
+        logs = current_app.get_json(request.data, type=list[structs.NewLog])
+    except (ValidationError, DecodeError) as e:
+        publish_to_error_log(str(e), "publish_new_logs")
+        return Response(status=400)
+
+    if len(logs) > MAX_NEW_LOGS:
+        publish_to_error_log(
+            f"Too many logs, at most {MAX_NEW_LOGS} per request.", "publish_new_logs"
+        )
+        return Response(status=413)
+    elif not logs:
+        return Response(status=202)
+
+    wait = request.args.get("wait", "0") == "1"
+    for log in logs[:-1]:
+        publish_user_log(experiment, log)
+    msg = publish_user_log(experiment, logs[-1], qos=1 if wait else 0)
+
+    if wait:
+        try:
+            msg.wait_for_publish(timeout=5.0)
+        except Exception as e:
+            publish_to_error_log(str(e), "publish_new_logs")
+            return Response(status=500)
+        if not msg.is_published():
+            publish_to_error_log("Timed out waiting for the broker.", "publish_new_logs")
+            return Response(status=504)
+
     return Response(status=202)
 
 
 @api.route("/workers/<pioreactor_unit>/experiments/<experiment>/logs", methods=["GET"])
 def get_logs_for_unit_and_experiment(experiment: str, pioreactor_unit: str) -> ResponseReturnValue:
-    """Shows event logs for a specific worker within an experiment"""
-
-    def get_level_string(min_level: str) -> str:
-        levels = {
-            "DEBUG": ["ERROR", "WARNING", "NOTICE", "INFO", "DEBUG"],
-            "INFO": ["ERROR", "NOTICE", "INFO", "WARNING"],
-            "WARNING": ["ERROR", "WARNING"],
-            "ERROR": ["ERROR"],
-        }
-        selected_levels = levels.get(min_level, levels["INFO"])
-        return " or ".join(f'level == "{level}"' for level in selected_levels)
+    """Shows event logs for a specific worker within an experiment. With page_size or before, returns pages, see get_logs_page."""
+    if "page_size" in request.args or "before" in request.args:
+        return get_logs_page(experiment, "get_logs_for_unit_and_experiment", pioreactor_unit)
 
     min_level = request.args.get("min_level", "INFO")
 
+    etag = get_logs_validator(experiment)
+    if is_cached_by_client(etag):
+        return not_modified(etag)
+
     try:
+        archived = read_log_archive(experiment, hours_ago(LOGS_LOOKBACK_HOURS))
         recent_logs = query_app_db(
-            f"""SELECT l.timestamp, level, l.pioreactor_unit, message, task
-                FROM logs AS l
-                WHERE (l.experiment=? OR l.experiment='$experiment')
-                    AND l.pioreactor_unit=?
-                    AND ({get_level_string(min_level)})
-                    AND l.timestamp >= MAX( strftime('%Y-%m-%dT%H:%M:%S', datetime('now', '-24 hours')), (SELECT created_at FROM experiments where experiment=?) )
-                ORDER BY l.timestamp DESC LIMIT 50;""",
-            (experiment, pioreactor_unit, experiment),
+            logs_sql(for_unit=True, has_level_num=logs_have_level_num(), archived=archived),
+            logs_args(experiment, min_level, pioreactor_unit, archived),
         )
 
     except Exception as e:
         publish_to_error_log(str(e), "get_logs_for_unit_and_experiment")
         return Response(status=500)
 
-    return jsonify(recent_logs)
+    return set_etag(jsonify(recent_logs), etag)
 
 
-## Time series data
-
+@api.route("/experiments/<experiment>/logs/tail", methods=["GET"])
+@api.route("/workers/<pioreactor_unit>/experiments/<experiment>/logs/tail", methods=["GET"])
+def tail_logs_of_experiment(
+    experiment: str, pioreactor_unit: str | None = None
+) -> ResponseReturnValue:
+    """
+    Long poll for new logs: waits until there are logs after `after`, or timeout, see live_updates.tail_logs.
+    Returns {"logs": [...], "after": ...}, oldest first. Pass "after" back in the next request. Query parameters:
+      - after: default is the latest log, so only logs from now on are returned.
+      - timeout: seconds, default live_updates.TAIL_SECONDS, at most live_updates.MAX_TAIL_SECONDS.
+      - min_level, and units (repeated, or comma separated).
 
-@api.route("/experiments/<experiment>/time_series/growth_rates", methods=["GET"])
-def get_growth_rates(experiment: str) -> ResponseReturnValue:
-    """Gets growth rates for all units"""
+    Returns 503, with Retry-After, if there are already live_updates.tail_slots tails.
+    """
     args = request.args
-    filter_mod_n = float(args.get("filter_mod_N", 100.0))
-    lookback = float(args.get("lookback", 4.0))
+    min_level = args.get("min_level", "INFO")
+    units = (pioreactor_unit,) if pioreactor_unit is not None else tuple(get_list_arg("units"))
 
     try:
-        growth_rates = query_app_db(
-            """
-            SELECT
-                json_object('series', json_group_array(unit), 'data', json_group_array(json(data))) as result
-            FROM (
-                SELECT pioreactor_unit as unit,
-                       json_group_array(json_object('x', timestamp, 'y', round(rate, 5))) as data
-                FROM growth_rates
-                WHERE experiment=? AND
-                      ((ROWID * 0.61803398875) - cast(ROWID * 0.61803398875 as int) < 1.0/?) AND
-                      timestamp > strftime('%Y-%m-%dT%H:%M:%S', datetime('now',?))
-                GROUP BY 1
-                );
-            """,
-            (experiment, filter_mod_n, f"-{lookback} hours"),
-            one=True,
-        )
-        assert isinstance(growth_rates, dict)
-
-    except Exception as e:
-        publish_to_error_log(str(e), "get_growth_rates")
+        after = int(args["after"]) if "after" in args else get_cursor("logs")
+        timeout = min(max(float(args.get("timeout", TAIL_SECONDS)), 0.0), MAX_TAIL_SECONDS)
+    except ValueError as e:
+        publish_to_error_log(str(e), "tail_logs_of_experiment")
         return Response(status=400)
 
-    return growth_rates["result"]
+    with tail_slots.take() as taken:
+        if not taken:
+            return Response(status=503, headers={"Retry-After": str(int(TAIL_SECONDS))})
 
+        try:
+            logs, after = tail_logs(experiment, after, timeout, min_level, units)
+        except Exception as e:
+            publish_to_error_log(str(e), "tail_logs_of_experiment")
+            return Response(status=500)
 
-@api.route("/experiments/<experiment>/time_series/temperature_readings", methods=["GET"])
-def get_temperature_readings(experiment: str) -> ResponseReturnValue:
-    """Gets temperature readings for all units"""
+    response = jsonify({"logs": logs, "after": after})
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@api.route("/logs/search", methods=["GET"])
+def search_logs() -> ResponseReturnValue:
+    """
+    Full-text search of logs' messages and tasks, ex: /api/logs/search?q=pump fail*. See log_search.py.
+    Query parameters:
+      - q: words that must all appear. Words ending with * are prefixes.
+      - experiment, units (repeated, or comma separated), min_level (default INFO).
+      - start and end (ISO 8601), default is all logs, archived ones too (see log_archive.py).
+      - sort: "rank" (best matches first, default) or "recent".
+      - page (from 0) and page_size (at most log_search.MAX_PAGE_SIZE).
+    Returns {"logs": [...], "next_page": ...}, where next_page is None on the last page.
+    """
     args = request.args
-    filter_mod_n = float(args.get("filter_mod_N", 100.0))
-    lookback = float(args.get("lookback", 4.0))
+    experiment = args.get("experiment")
+    units = tuple(get_list_arg("units"))
+    min_level_num = get_min_level_num(args.get("min_level", "INFO"))
+    by_rank = args.get("sort", "rank") == "rank"
 
     try:
-        temperature_readings = query_app_db(
-            """
-            SELECT json_object('series', json_group_array(unit), 'data', json_group_array(json(data))) as result
-            FROM (
-                SELECT
-                    pioreactor_unit as unit,
-                    json_group_array(json_object('x', timestamp, 'y', round(temperature_c, 2))) as data
-                FROM temperature_readings
-                WHERE experiment=? AND
-                    ((ROWID * 0.61803398875) - cast(ROWID * 0.61803398875 as int) < 1.0/?) AND
-                    timestamp > strftime('%Y-%m-%dT%H:%M:%S', datetime('now',?))
-                GROUP BY 1
-                );
-            """,
-            (experiment, filter_mod_n, f"-{lookback} hours"),
-            one=True,
+        query = to_fts_query(args.get("q", ""))
+        page = max(args.get("page", 0, type=int), 0)
+        page_size = min(max(args.get("page_size", 50, type=int), 1), MAX_LOG_SEARCH_PAGE_SIZE)
+        start = parse_timestamp(args["start"]) if "start" in args else None
+        end = parse_timestamp(args["end"]) if "end" in args else None
+    except ValueError as e:
+        publish_to_error_log(str(e), "search_logs")
+        return Response(status=400)
+
+    # all logs, unless start is given
+    window = resolve_window(float("inf"), start, end)
+    match_args = (
+        query,
+        *((experiment,) if experiment is not None else ()),
+        *units,
+        min_level_num,
+        *window,
+    )
+
+    try:
+        archived = read_log_archive(experiment, window[0])
+        logs = query_app_db(
+            search_logs_sql(
+                experiment is not None, len(units), by_rank, logs_have_level_num(), archived
+            ),
+            (*match_args * (2 if archived else 1), page_size, page * page_size),
         )
-        assert isinstance(temperature_readings, dict)
+        assert isinstance(logs, list)
+    except sqlite3.OperationalError as e:
+        # the search index is created in the background when the app starts, see migrations.py
+        publish_to_error_log(str(e), "search_logs")
+        return Response(status=503)
 
-    except Exception as e:
-        publish_to_error_log(str(e), "get_temperature_readings")
-        return Response(status=400)
+    return jsonify({"logs": logs, "next_page": page + 1 if len(logs) == page_size else None})
 
-    return temperature_readings["result"]
 
+## Time series data
 
-@api.route("/experiments/<experiment>/time_series/od_readings_filtered", methods=["GET"])
-def get_od_readings_filtered(experiment: str) -> ResponseReturnValue:
-    """Gets normalized od for all units"""
+
+TIME_SERIES_MIMETYPES = ["application/json", "application/x-msgpack"]
+
+
+def wants_msgpack() -> bool:
+    return request.accept_mimetypes.best_match(TIME_SERIES_MIMETYPES) == "application/x-msgpack"
+
+
+def time_series_response(result: dict[str, Any]) -> Response:
+    """Columnar msgpack if the client asks for it with `Accept: application/x-msgpack`, else JSON."""
+    if wants_msgpack():
+        return Response(
+            response=msgpack_encode(to_columnar(result)),
+            status=200,
+            mimetype="application/x-msgpack",
+            headers={"Vary": "Accept"},
+        )
+    else:
+        return Response(
+            response=current_app.json.dumps(to_json(result)),
+            status=200,
+            mimetype="application/json",
+            headers={"Vary": "Accept"},
+        )
+
+
+def parse_bool(value: str) -> bool:
+    return value in ("1", "true")
+
+
+def get_list_arg(name: str) -> list[str]:
+    """The values of a query parameter that is repeated, or comma separated, or both."""
+    return [value for values in request.args.getlist(name) for value in values.split(",") if value]
+
+
+# windows longer than this are streamed as chunked JSON, unless the client sets stream=0 or stream=1.
+# Built-in time series aren't, as their long windows are read from the (small) rollups.
+STREAM_MIN_LOOKBACK_HOURS = 24.0
+
+
+def get_time_series(
+    experiment: str,
+    data_source: str,
+    column: str,
+    task: str,
+    decimals: int = 7,
+    series_by_channel: bool = False,
+) -> ResponseReturnValue:
+    """
+    Query parameters:
+      - lookback: hours, default 4. Or, for a specific window, start and end (ISO 8601, end is optional).
+      - target_points or filter_mod_N: how much to downsample each series.
+      - since: only rows after a previous response's cursor.
+      - page_size and after: pages of the raw rows, see query_time_series_page.
+      - stream: 1 to stream chunked JSON.
+      - y_transformation: applied to the values, ex: (y) => 24 * y. See y_transformations.py.
+      - units and channels: only these units' and channels' series (repeated, or comma separated).
+    """
     args = request.args
-    filter_mod_n = float(args.get("filter_mod_N", 100.0))
-    lookback = float(args.get("lookback", 4.0))
+    target_points = args.get("target_points", type=int)
+    filter_mod_n = args.get("filter_mod_N", type=float)
+    since = args.get("since", type=int)
+    page_size = args.get("page_size", type=int)
+    after = args.get("after")
 
     try:
-        filtered_od_readings = query_app_db(
-            """
-            SELECT
-                json_object('series', json_group_array(unit), 'data', json_group_array(json(data))) as result
-            FROM (
-                SELECT
-                    pioreactor_unit as unit,
-                    json_group_array(json_object('x', timestamp, 'y', round(normalized_od_reading, 7))) as data
-                FROM od_readings_filtered
-                WHERE experiment=? AND
-                    ((ROWID * 0.61803398875) - cast(ROWID * 0.61803398875 as int) < 1.0/?) AND
-                    timestamp > strftime('%Y-%m-%dT%H:%M:%S', datetime('now',?))
-                GROUP BY 1
-                );
-            """,
-            (experiment, filter_mod_n, f"-{lookback} hours"),
-            one=True,
+        lookback = float(args.get("lookback", 4.0))
+        start = parse_timestamp(args["start"]) if "start" in args else None
+        end = parse_timestamp(args["end"]) if "end" in args else None
+        y_transformation = args.get("y_transformation")
+        transformation = (
+            compile_y_transformation(y_transformation) if y_transformation is not None else None
+        )
+        # sorted, so equivalent filters share a cache entry.
+        units = tuple(sorted(set(get_list_arg("units"))))
+        channels = tuple(sorted({int(channel) for channel in get_list_arg("channels")}))
+        if channels and not series_by_channel:
+            raise ValueError(f"{data_source} has no channels.")
+    except ValueError as e:
+        publish_to_error_log(str(e), task)
+        return Response(status=400)
+
+    if start is not None:
+        lookback = ((end or current_utc_datetime()) - start).total_seconds() / 60 / 60
+
+    if "stream" in args:
+        stream = parse_bool(args["stream"])
+    else:
+        stream = lookback > STREAM_MIN_LOOKBACK_HOURS and data_source not in ROLLUP_SOURCES
+    # transformations are applied to whole results.
+    stream = stream and transformation is None
+
+    encoding = "msgpack" if wants_msgpack() else "json"
+    if y_transformation is not None:
+        encoding += f"-{crc32(y_transformation.encode())}"
+
+    # charts' time series are materialized in the background, see charts.materialize_charts. The UI sends a
+    # filter_mod_N that changes as the experiment ages, so it only picks between the chart's downsampled
+    # (filter_mod_N > 1, with the default target_points) and raw (filter_mod_N = 1) time series.
+    if set(args) <= {"lookback", "filter_mod_N"}:
+        materialized = get_materialized(
+            experiment,
+            data_source=data_source,
+            column=column,
+            lookback=lookback,
+            decimals=decimals,
+            series_by_channel=series_by_channel,
+            downsample=filter_mod_n != 1,
+        )
+        if materialized is not None:
+            validator, result = materialized
+            etag = f"{validator}-{encoding}"
+            if is_cached_by_client(etag):
+                return not_modified(etag)
+            return set_etag(time_series_response(result), etag)
+
+    try:
+        etag = f"{get_validator(data_source, lookback, target_points)}-{encoding}"
+        if is_cached_by_client(etag):
+            return not_modified(etag)
+
+        if page_size is not None or after is not None:
+            result = query_time_series_page(
+                data_source,
+                column,
+                experiment,
+                lookback,
+                page_size=page_size or MAX_PAGE_SIZE,
+                after=after,
+                decimals=decimals,
+                series_by_channel=series_by_channel,
+                start=start,
+                end=end,
+                units=units,
+                channels=channels,
+            )
+            if transformation is not None:
+                result = transform_result(result, transformation, decimals)
+            return set_etag(time_series_response(result), etag)
+
+        if stream and not wants_msgpack():
+            chunks = stream_time_series(
+                data_source,
+                column,
+                experiment,
+                lookback,
+                target_points=target_points,
+                filter_mod_n=filter_mod_n,
+                since=since,
+                decimals=decimals,
+                series_by_channel=series_by_channel,
+                start=start,
+                end=end,
+                units=units,
+                channels=channels,
+            )
+            response = Response(
+                stream_with_context(chunks),
+                status=200,
+                mimetype="application/json",
+                headers={"Vary": "Accept"},
+            )
+            return set_etag(response, etag)
+
+        result = cached_query_time_series(
+            data_source,
+            column,
+            experiment,
+            lookback,
+            target_points=target_points,
+            filter_mod_n=filter_mod_n,
+            since=since,
+            decimals=decimals,
+            series_by_channel=series_by_channel,
+            start=start,
+            end=end,
+            units=units,
+            channels=channels,
         )
-        assert isinstance(filtered_od_readings, dict)
+        if transformation is not None:
+            result = transform_result(result, transformation, decimals)
 
     except Exception as e:
-        publish_to_error_log(str(e), "get_od_readings_filtered")
+        publish_to_error_log(str(e), task)
         return Response(status=400)
 
-    return filtered_od_readings["result"]
+    return set_etag(time_series_response(result), etag)
+
+
+@api.route("/experiments/<experiment>/time_series/growth_rates", methods=["GET"])
+def get_growth_rates(experiment: str) -> ResponseReturnValue:
+    """Gets growth rates for all units"""
+    return get_time_series(experiment, "growth_rates", "rate", "get_growth_rates", decimals=5)
+
+
+@api.route("/experiments/<experiment>/time_series/temperature_readings", methods=["GET"])
+def get_temperature_readings(experiment: str) -> ResponseReturnValue:
+    """Gets temperature readings for all units"""
+    return get_time_series(
+        experiment, "temperature_readings", "temperature_c", "get_temperature_readings", decimals=2
+    )
+
+
+@api.route("/experiments/<experiment>/time_series/od_readings_filtered", methods=["GET"])
+def get_od_readings_filtered(experiment: str) -> ResponseReturnValue:
+    """Gets normalized od for all units"""
+    return get_time_series(
+        experiment, "od_readings_filtered", "normalized_od_reading", "get_od_readings_filtered"
+    )
 
 
 @api.route("/experiments/<experiment>/time_series/od_readings", methods=["GET"])
 def get_od_readings(experiment: str) -> ResponseReturnValue:
     """Gets raw od for all units"""
+    return get_time_series(
+        experiment, "od_readings", "od_reading", "get_od_readings", series_by_channel=True
+    )
+
+
+@api.route("/experiments/<experiment>/time_series/<data_source>/<column>", methods=["GET"])
+def get_fallback_time_series(data_source: str, experiment: str, column: str) -> ResponseReturnValue:
+    try:
+        # names are formatted into the SQL, so they must be the app db's.
+        table = get_time_series_table(scrub_to_valid(data_source), scrub_to_valid(column))
+    except ValueError as e:
+        publish_to_error_log(str(e), "get_fallback_time_series")
+        return Response(status=400)
+
+    return get_time_series(
+        experiment,
+        table.data_source,
+        table.column,
+        "get_fallback_time_series",
+        series_by_channel=table.series_by_channel,
+    )
+
+
+@api.route("/overlays/time_series/<data_source>", methods=["GET"])
+@api.route("/overlays/time_series/<data_source>/<column>", methods=["GET"])
+def get_time_series_overlay(data_source: str, column: str | None = None) -> ResponseReturnValue:
+    """
+    The time series of many experiments, aligned to the time since each one started, ex:
+    /api/overlays/time_series/growth_rates?experiments=exp1,exp2. Query parameters:
+      - experiments: repeated, or comma separated.
+      - hours: only the first hours of each experiment, default is all of it.
+      - target_points: points per series, over the longest series.
+      - units and channels: only these units' and channels' series.
+
+    Each point's x is the hours since its experiment's created_at.
+    """
     args = request.args
-    filter_mod_n = float(args.get("filter_mod_N", 100.0))
-    lookback = float(args.get("lookback", 4.0))
+    if column is None:
+        try:
+            column, decimals, series_by_channel = BUILTIN_TIME_SERIES[data_source]
+        except KeyError:
+            return Response(status=404)
+    else:
+        try:
+            table = get_time_series_table(scrub_to_valid(data_source), scrub_to_valid(column))
+        except ValueError as e:
+            publish_to_error_log(str(e), "get_time_series_overlay")
+            return Response(status=400)
+        data_source, column = table.data_source, table.column
+        decimals, series_by_channel = 7, table.series_by_channel
 
     try:
-        raw_od_readings = query_app_db(
-            """
-            SELECT
-                json_object('series', json_group_array(unit), 'data', json_group_array(json(data))) as result
-            FROM (
-                SELECT pioreactor_unit || '-' || channel as unit, json_group_array(json_object('x', timestamp, 'y', round(od_reading, 7))) as data
-                FROM od_readings
-                WHERE experiment=? AND
-                    ((ROWID * 0.61803398875) - cast(ROWID * 0.61803398875 as int) < 1.0/?) AND
-                    timestamp > strftime('%Y-%m-%dT%H:%M:%S', datetime('now', ?))
-                GROUP BY 1
-                );
-            """,
-            (experiment, filter_mod_n, f"-{lookback} hours"),
-            one=True,
+        channels = tuple(sorted({int(channel) for channel in get_list_arg("channels")}))
+        if channels and not series_by_channel:
+            raise ValueError(f"{data_source} has no channels.")
+
+        result = query_overlay(
+            data_source,
+            column,
+            tuple(dict.fromkeys(get_list_arg("experiments"))),
+            hours=args.get("hours", type=float),
+            target_points=args.get("target_points", type=int),
+            decimals=decimals,
+            series_by_channel=series_by_channel,
+            units=tuple(sorted(set(get_list_arg("units")))),
+            channels=channels,
         )
-        assert isinstance(raw_od_readings, dict)
-
-    except Exception as e:
-        publish_to_error_log(str(e), "get_od_readings")
+    except ValueError as e:
+        publish_to_error_log(str(e), "get_time_series_overlay")
         return Response(status=400)
 
-    return raw_od_readings["result"]
+    return jsonify(
+        result | {"data": [[{"x": x, "y": y} for (x, y) in points] for points in result["data"]]}
+    )
 
 
-@api.route("/experiments/<experiment>/time_series/<data_source>/<column>", methods=["GET"])
-def get_fallback_time_series(data_source: str, experiment: str, column: str) -> ResponseReturnValue:
+@api.route("/experiments/<experiment>/charts", methods=["GET"])
+def get_charts(experiment: str) -> ResponseReturnValue:
+    """
+    The time series of many charts in one response, from one snapshot of the database. Charts are
+    chosen with `chart_key` (repeated, or comma separated), default is the charts enabled in [ui.overview.charts].
+    With transform=1, each chart's y_transformation is applied, see charts.transform_charts.
+    """
     args = request.args
-    filter_mod_n = float(args.get("filter_mod_N", 100.0))
-    lookback = float(args.get("lookback", 4.0))
+    chart_keys = get_list_arg("chart_key")
+    target_points = args.get("target_points", type=int)
+    transform = parse_bool(args["transform"]) if "transform" in args else False
 
     try:
-        data_source = scrub_to_valid(data_source)
-        column = scrub_to_valid(column)
-        r = query_app_db(
-         """
-            SELECT
-                json_object('series', json_group_array(unit), 'data', json_group_array(json(data))) as result
-            FROM (
-                SELECT pioreactor_unit || '-' || channel as unit, json_group_array(json_object('x', timestamp, 'y', round({column}, 7))) as data
-                FROM {data_source}
-                WHERE experiment=? AND
-                    ((ROWID * 0.61803398875) - cast(ROWID * 0.61803398875 as int) < 1.0/?) AND
-                    timestamp > strftime('%Y-%m-%dT%H:%M:%S', datetime('now', ?))
-                GROUP BY 1
-                );
-            """,
-            (experiment, filter_mod_n, f"-{lookback} hours"),
-            one=True,
+        charts = select_charts(chart_keys)
+    except KeyError as e:
+        publish_to_error_log(str(e), "get_charts")
+        return Response(status=404)
+
+    encoding = "msgpack" if wants_msgpack() else "json"
+    if transform:
+        encoding += "-transformed"
+
+    try:
+        # charts' default time series are materialized in the background, see charts.materialize_charts.
+        materialized = (
+            get_materialized_charts(experiment, charts) if target_points is None else None
         )
-        assert isinstance(r, dict)
 
+        if materialized is not None:
+            validator, results = materialized
+            etag = f"{validator}-{encoding}"
+            if is_cached_by_client(etag):
+                return not_modified(etag)
+        else:
+            etag = f"{get_charts_validator(charts, target_points)}-{encoding}"
+            if is_cached_by_client(etag):
+                return not_modified(etag)
+            results = query_charts(experiment, charts, target_points)
+
+        if transform:
+            results = transform_charts(charts, results)
     except Exception as e:
-        publish_to_error_log(str(e), "get_fallback_time_series")
+        publish_to_error_log(str(e), "get_charts")
+        return Response(status=400)
+
+    if wants_msgpack():
+        response = Response(
+            response=msgpack_encode({"charts": {k: to_columnar(r) for k, r in results.items()}}),
+            status=200,
+            mimetype="application/x-msgpack",
+            headers={"Vary": "Accept"},
+        )
+    else:
+        response = Response(
+            response=current_app.json.dumps(
+                {"charts": {k: to_json(r) for k, r in results.items()}}
+            ),
+            status=200,
+            mimetype="application/json",
+            headers={"Vary": "Accept"},
+        )
+    return set_etag(response, etag)
+
+
+@api.route("/experiments/<experiment>/stream", methods=["GET"])
+def stream_experiment(experiment: str) -> ResponseReturnValue:
+    """
+    Server-Sent Events of new od_readings, od_readings_filtered, growth_rates, temperature_readings and logs
+    rows of the experiment, see live_updates.py. Resumes after the Last-Event-ID header (or the last_event_id
+    query parameter), else starts from now. Logs are filtered by min_level, like the logs endpoints.
+    """
+    event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    min_level = request.args.get("min_level", "INFO")
+
+    try:
+        cursors = decode_event_id(event_id) if event_id else get_current_cursors()
+    except ValueError as e:
+        publish_to_error_log(str(e), "stream_experiment")
         return Response(status=400)
-    return r["result"]
+
+    return Response(
+        stream_with_context(stream_new_rows(experiment, cursors, min_level)),
+        status=200,
+        mimetype="text/event-stream",
+        # ask proxies that honor it (ex: nginx) not to buffer the events. For lighttpd, see live_updates.py.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @api.route("/experiments/<experiment>/media_rates", methods=["GET"])
@@ -591,22 +1052,7 @@ def get_media_rates(experiment: str) -> ResponseReturnValue:
     ## this one confusing
 
     try:
-        rows = query_app_db(
-            """
-            SELECT
-                d.pioreactor_unit,
-                SUM(CASE WHEN event='add_media' THEN volume_change_ml ELSE 0 END) / 3 AS mediaRate,
-                SUM(CASE WHEN event='add_alt_media' THEN volume_change_ml ELSE 0 END) / 3 AS altMediaRate
-            FROM dosing_events AS d
-            WHERE
-                datetime(d.timestamp) >= datetime('now', '-3 hours') AND
-                event IN ('add_alt_media', 'add_media') AND
-                source_of_event LIKE 'dosing_automation%' AND
-                experiment = ?
-            GROUP BY d.pioreactor_unit;
-            """,
-            (experiment,),
-        )
+        rows = query_app_db(MEDIA_RATES_SQL, media_rates_args(experiment))
         assert isinstance(rows, list)
         json_result: dict[str, dict[str, float]] = {}
         aggregate: dict[str, float] = {"altMediaRate": 0.0, "mediaRate": 0.0}
@@ -894,23 +1340,8 @@ def get_job_contrib() -> ResponseReturnValue:
 @api.route("/contrib/charts", methods=["GET"])
 def get_charts_contrib() -> ResponseReturnValue:
     try:
-        chart_path_default = Path(env["WWW"]) / "contrib" / "charts"
-        chart_path_plugins = Path(env["DOT_PIOREACTOR"]) / "plugins" / "ui" / "contrib" / "charts"
-        files = sorted(chart_path_default.glob("*.y*ml")) + sorted(
-            chart_path_plugins.glob("*.y*ml")
-        )
-
-        # we dedup based on chart 'chart_key'.
-        parsed_yaml = {}
-        for file in files:
-            try:
-                decoded_yaml = yaml_decode(file.read_bytes(), type=structs.ChartDescriptor)
-                parsed_yaml[decoded_yaml.chart_key] = decoded_yaml
-            except (ValidationError, DecodeError) as e:
-                publish_to_error_log(f"Yaml error in {Path(file).name}: {e}", "get_charts_contrib")
-
         return Response(
-            response=current_app.json.dumps(list(parsed_yaml.values())),
+            response=current_app.json.dumps(list(get_chart_descriptors().values())),
             status=200,
             mimetype="application/json",
             headers={"Cache-Control": "public,max-age=10"},
@@ -970,15 +1401,19 @@ def preview_exportable_datasets(target_dataset) -> ResponseReturnValue:
         (Path(env["DOT_PIOREACTOR"]) / "plugins" / "exportable_datasets").glob("*.y*ml")
     )
 
-    n_rows = request.args.get("n_rows", 5)
+    n_rows = request.args.get("n_rows", 5, type=int)
 
     for file in builtins + plugins:
         try:
             dataset = yaml_decode(file.read_bytes(), type=Dataset)
             if dataset.dataset_name == target_dataset:
-                query = f"SELECT * FROM ({dataset.table or dataset.query}) LIMIT {n_rows};"
-                result = query_app_db(query)
-                return jsonify(result)
+                query = f"SELECT * FROM ({dataset.table or dataset.query}) LIMIT ?;"
+                rows = iter_app_db(query, (n_rows,))
+                return Response(
+                    stream_with_context(json_array_chunks(rows)),
+                    status=200,
+                    mimetype="application/json",
+                )
         except (ValidationError, DecodeError):
             pass
     return Response(status=404)
@@ -1031,6 +1466,7 @@ def export_datasets() -> ResponseReturnValue:
 
 @api.route("/experiments", methods=["GET"])
 @cache.memoize(expire=60, tag="experiments")
+@precompress
 def get_experiments() -> ResponseReturnValue:
     try:
         response = jsonify(
@@ -1110,6 +1546,13 @@ def delete_experiment(experiment: str) -> ResponseReturnValue:
     row_count = modify_app_db("DELETE FROM experiments WHERE experiment=?;", (experiment,))
     broadcast_post_across_cluster(f"/unit_api/jobs/stop/experiment/{experiment}")
 
+    try:
+        # rollups aren't tied to experiments by a foreign key
+        modify_app_db("DELETE FROM time_series_rollups WHERE experiment=?;", (experiment,))
+    except sqlite3.OperationalError:
+        # rollups haven't been created yet
+        pass
+
     if row_count > 0:
         return Response(status=200)
     else:
@@ -1119,6 +1562,7 @@ def delete_experiment(experiment: str) -> ResponseReturnValue:
 
 @api.route("/experiments/latest", methods=["GET"])
 @cache.memoize(expire=30, tag="experiments")
+@precompress
 def get_latest_experiment() -> ResponseReturnValue:
     try:
         return Response(
@@ -1295,6 +1739,7 @@ def get_experiment(experiment: str) -> ResponseReturnValue:
 
 @api.route("/configs/<filename>", methods=["GET"])
 @cache.memoize(expire=30, tag="config")
+@precompress
 def get_config(filename: str) -> ResponseReturnValue:
     """get a specific config.ini file in the .pioreactor folder"""
 
@@ -1324,6 +1769,7 @@ def get_config(filename: str) -> ResponseReturnValue:
 
 @api.route("/configs", methods=["GET"])
 @cache.memoize(expire=60, tag="config")
+@precompress
 def get_configs() -> ResponseReturnValue:
     """get a list of all config.ini files in the .pioreactor folder, _and_ are part of the inventory _or_ are leader"""
 
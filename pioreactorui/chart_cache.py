@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# chart_cache.py
+"""
+In-process cache of time series results, invalidated by new readings arriving over MQTT.
+
+Many viewers poll the same chart URLs. Instead of re-running the aggregation per poll, the result is kept
+until a new reading for that (experiment, data_source) is published, so the cost is at most one query per
+new-data event rather than one per viewer per poll.
+"""
+from __future__ import annotations
+
+import threading
+import typing as t
+from collections import OrderedDict
+
+from paho.mqtt.client import MQTTMessage
+
+from . import add_subscription
+from . import client
+from .time_series import get_cursor
+from .time_series import query_time_series
+
+# data_source -> MQTT topics (after pioreactor/<unit>/<experiment>/) that signal a new row.
+INVALIDATING_TOPICS: dict[str, list[str]] = {
+    "od_readings": ["od_reading/+"],
+    "od_readings_filtered": ["growth_rate_calculating/od_filtered"],
+    "growth_rates": ["growth_rate_calculating/growth_rate"],
+    "temperature_readings": ["temperature_automation/temperature"],
+}
+
+MAX_ENTRIES = 64
+
+Key = tuple[t.Hashable, ...]
+
+
+class _KeyLock:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # requests holding or waiting for the lock. It's dropped when the last one is done.
+        self.n_waiters = 0
+
+
+class _Entry(t.NamedTuple):
+    experiment: str
+    data_source: str
+    # the (experiment, data_source) version it was computed at, see ChartCache.invalidate.
+    version: int
+    # the newest ROWID of data_source it reflects, its result's cursor.
+    cursor: int
+    result: t.Any
+
+
+class ChartCache:
+    """
+    Results of time series queries. A result stays valid until a reading of its (experiment, data_source) is
+    published over MQTT, and then until that reading is in the app db: readings are published before
+    mqtt_to_db inserts them, so an entry is only recomputed once data_source's newest ROWID has moved past its
+    cursor. Results must have a "cursor", like query_time_series's.
+    """
+
+    def __init__(
+        self, max_entries: int = MAX_ENTRIES, get_cursor: t.Callable[[str], int] = get_cursor
+    ) -> None:
+        self.max_entries = max_entries
+        self._get_cursor = get_cursor
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Key, _Entry] = OrderedDict()
+        # (experiment, data_source) -> number of invalidations
+        self._versions: dict[tuple[str, str], int] = {}
+        self._key_locks: dict[Key, _KeyLock] = {}
+
+    def _get(self, key: Key) -> t.Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            is_current = entry.version == self._versions.get(
+                (entry.experiment, entry.data_source), 0
+            )
+
+        # a new reading was published since, is it in the app db yet?
+        if not is_current and self._get_cursor(entry.data_source) != entry.cursor:
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return entry.result
+
+    def _set(self, key: Key, entry: _Entry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(
+        self, experiment: str, data_source: str, key: Key, compute: t.Callable[[], t.Any]
+    ) -> t.Any:
+        """
+        Returns the cached result for key, else computes and caches it. Concurrent misses on the same key
+        wait for a single computation.
+        """
+        result = self._get(key)
+        if result is not None:
+            return result
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, _KeyLock())
+            key_lock.n_waiters += 1
+
+        try:
+            with key_lock.lock:
+                # someone else may have computed it while we waited
+                result = self._get(key)
+                if result is not None:
+                    return result
+
+                with self._lock:
+                    # before computing, so readings published meanwhile are checked for.
+                    version = self._versions.get((experiment, data_source), 0)
+                result = compute()
+                self._set(key, _Entry(experiment, data_source, version, result["cursor"], result))
+                return result
+        finally:
+            with self._lock:
+                key_lock.n_waiters -= 1
+                if key_lock.n_waiters == 0:
+                    del self._key_locks[key]
+
+    def invalidate(self, experiment: str, data_source: str) -> None:
+        with self._lock:
+            self._versions[(experiment, data_source)] = (
+                self._versions.get((experiment, data_source), 0) + 1
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+chart_cache = ChartCache()
+
+
+def is_cacheable(data_source: str) -> bool:
+    # without MQTT, we wouldn't hear about new readings.
+    return data_source in INVALIDATING_TOPICS and client.is_connected()
+
+
+def cached_query_time_series(
+    data_source: str, column: str, experiment: str, lookback: float, **kwargs: t.Any
+) -> dict[str, t.Any]:
+    """
+    query_time_series, served from the cache when the data_source is invalidated over MQTT. Incremental
+    requests (since) aren't cached: each has its own cursor, so they'd only evict full windows.
+    """
+    if not is_cacheable(data_source) or kwargs.get("since") is not None:
+        return query_time_series(data_source, column, experiment, lookback, **kwargs)
+
+    key = (data_source, column, experiment, lookback, tuple(sorted(kwargs.items())))
+    return chart_cache.get_or_compute(
+        experiment,
+        data_source,
+        key,
+        lambda: query_time_series(data_source, column, experiment, lookback, **kwargs),
+    )
+
+
+def start_invalidating_on_new_readings() -> None:
+    for data_source, topics in INVALIDATING_TOPICS.items():
+
+        def invalidate(_client, userdata, message: MQTTMessage, data_source=data_source) -> None:
+            # pioreactor/<unit>/<experiment>/...
+            experiment = message.topic.split("/")[2]
+            chart_cache.invalidate(experiment, data_source)
+
+        for topic in topics:
+            add_subscription(f"pioreactor/+/+/{topic}", invalidate)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+# charts.py
+from __future__ import annotations
+
+import re
+import sqlite3
+import typing as t
+from pathlib import Path
+
+from msgspec import DecodeError
+from msgspec import ValidationError
+from msgspec.yaml import decode as yaml_decode
+from pioreactor.config import config
+
+from . import logger
+from . import publish_to_error_log
+from . import query_app_db
+from . import read_app_db_snapshot
+from . import structs
+from .config import cache
+from .config import env
+from .schema import get_time_series_table
+from .time_series import BUILTIN_TIME_SERIES
+from .time_series import get_validator
+from .time_series import query_time_series
+from .utils import scrub_to_valid
+from .y_transformations import compile_y_transformation
+from .y_transformations import transform_result
+
+# lookback used when a chart's lookback can't be resolved, same as the time series endpoints.
+DEFAULT_LOOKBACK_HOURS = 4.0
+
+# ex: parseFloat(config['ui.overview.settings']['raw_od_lookback_hours'])
+CONFIG_LOOKBACK_PATTERN = re.compile(r"parseFloat\(\s*config\['([^']+)'\]\['([^']+)'\]\s*\)")
+
+
+def get_chart_descriptors() -> dict[str, structs.ChartDescriptor]:
+    """Built-in and plugin charts, by chart_key. Plugins can replace a built-in chart by reusing its chart_key."""
+    chart_path_default = Path(env["WWW"]) / "contrib" / "charts"
+    chart_path_plugins = Path(env["DOT_PIOREACTOR"]) / "plugins" / "ui" / "contrib" / "charts"
+    files = sorted(chart_path_default.glob("*.y*ml")) + sorted(chart_path_plugins.glob("*.y*ml"))
+
+    # we dedup based on chart 'chart_key'.
+    charts = {}
+    for file in files:
+        try:
+            chart = yaml_decode(file.read_bytes(), type=structs.ChartDescriptor)
+            charts[chart.chart_key] = chart
+        except (ValidationError, DecodeError) as e:
+            publish_to_error_log(f"Yaml error in {Path(file).name}: {e}", "get_chart_descriptors")
+    return charts
+
+
+def get_enabled_chart_keys() -> list[str]:
+    if "ui.overview.charts" not in config:
+        return []
+    return [key for key, value in config["ui.overview.charts"].items() if value == "1"]
+
+
+def resolve_lookback(chart: structs.ChartDescriptor) -> float:
+    """A chart's lookback, in hours. It can be a number, or read from the config like the frontend does."""
+    if isinstance(chart.lookback, (int, float)):
+        return float(chart.lookback)
+
+    try:
+        return float(chart.lookback)
+    except ValueError:
+        pass
+
+    match = CONFIG_LOOKBACK_PATTERN.fullmatch(chart.lookback.strip())
+    if match is not None and config.has_option(*match.groups()):
+        try:
+            return float(config.get(*match.groups()))
+        except ValueError:
+            pass
+    return DEFAULT_LOOKBACK_HOURS
+
+
+def get_chart_query(chart: structs.ChartDescriptor) -> dict[str, t.Any]:
+    """The arguments of query_time_series for a chart, other than experiment and target_points."""
+    data_source = scrub_to_valid(chart.data_source)
+    if chart.data_source_column is not None:
+        column = scrub_to_valid(chart.data_source_column)
+        decimals = 7
+    elif data_source in BUILTIN_TIME_SERIES:
+        column, decimals, _ = BUILTIN_TIME_SERIES[data_source]
+    else:
+        raise ValueError(f"Chart {chart.chart_key} has no data_source_column.")
+
+    table = get_time_series_table(data_source, column)
+    return dict(
+        data_source=data_source,
+        column=column,
+        lookback=resolve_lookback(chart),
+        decimals=decimals,
+        series_by_channel=table.series_by_channel,
+        downsample=chart.down_sample,
+    )
+
+
+def query_chart(
+    chart: structs.ChartDescriptor, experiment: str, target_points: int | None = None
+) -> dict[str, t.Any]:
+    """The time series of a chart, as query_time_series returns it."""
+    return query_time_series(
+        experiment=experiment, target_points=target_points, **get_chart_query(chart)
+    )
+
+
+def select_charts(chart_keys: list[str]) -> list[structs.ChartDescriptor]:
+    """The charts with chart_keys, default is the charts enabled in [ui.overview.charts]. Unknown chart_keys raise KeyError."""
+    charts = get_chart_descriptors()
+    if not chart_keys:
+        return [charts[key] for key in get_enabled_chart_keys() if key in charts]
+
+    missing = [key for key in chart_keys if key not in charts]
+    if missing:
+        raise KeyError(f"Unknown charts: {missing}")
+    return [charts[key] for key in chart_keys]
+
+
+def get_charts_validator(
+    charts: list[structs.ChartDescriptor], target_points: int | None = None
+) -> str:
+    return "-".join(
+        get_validator(scrub_to_valid(chart.data_source), resolve_lookback(chart), target_points)
+        for chart in charts
+    )
+
+
+def query_charts(
+    experiment: str, charts: list[structs.ChartDescriptor], target_points: int | None = None
+) -> dict[str, dict[str, t.Any]]:
+    """
+    The time series of many charts, by chart_key, read from a single snapshot of the database so they're
+    consistent with each other.
+    """
+    with read_app_db_snapshot():
+        return {chart.chart_key: query_chart(chart, experiment, target_points) for chart in charts}
+
+
+def transform_charts(
+    charts: list[structs.ChartDescriptor], results: dict[str, dict[str, t.Any]]
+) -> dict[str, dict[str, t.Any]]:
+    """
+    Applies each chart's y_transformation to its result, see y_transformations.py. Results get "transformed",
+    which is False for y_transformations that can't be evaluated on the server; clients apply those.
+    """
+    transformed = {}
+    for chart in charts:
+        result = results[chart.chart_key]
+        try:
+            transformation = compile_y_transformation(chart.y_transformation or "(y) => y")
+        except ValueError as e:
+            logger.debug(f"Unable to evaluate y_transformation of {chart.chart_key}: {e}")
+            transformed[chart.chart_key] = result | {"transformed": False}
+            continue
+
+        decimals = get_chart_query(chart)["decimals"]
+        transformed[chart.chart_key] = transform_result(result, transformation, decimals) | {
+            "transformed": True
+        }
+    return transformed
+
+
+## materialized charts
+# The huey task materialize_charts precomputes the time series of every chart, as the UI requests them, for
+# the active experiments, so requests for them don't run the aggregation on a server worker. They can be up to
+# about a minute behind the database, which live charts cover with their MQTT updates.
+
+# materialized time series expire if they stop being refreshed, ex: huey isn't running.
+MATERIALIZED_EXPIRE_SECONDS = 3 * 60
+
+
+def get_active_experiments() -> list[str]:
+    """The latest experiment, and experiments with workers assigned to them."""
+    rows = query_app_db(
+        """
+        SELECT experiment FROM latest_experiment
+        UNION
+        SELECT DISTINCT experiment FROM experiment_worker_assignments
+        """
+    )
+    assert isinstance(rows, list)
+    return [row["experiment"] for row in rows]
+
+
+def _materialized_key(experiment: str, query: dict[str, t.Any]) -> tuple[t.Any, ...]:
+    return ("materialized_time_series", experiment, *(query[k] for k in sorted(query)))
+
+
+def get_materialized(experiment: str, **query: t.Any) -> tuple[str, dict[str, t.Any]] | None:
+    """
+    (validator, result) of query_time_series(experiment=experiment, **query) with the default target_points,
+    if it was materialized. query has the keys of get_chart_query.
+    """
+    return cache.get(_materialized_key(experiment, query))
+
+
+def get_materialized_charts(
+    experiment: str, charts: list[structs.ChartDescriptor]
+) -> tuple[str, dict[str, dict[str, t.Any]]] | None:
+    """Like (get_charts_validator, query_charts) with the default target_points, if all the charts were materialized."""
+    validators, results = [], {}
+    for chart in charts:
+        materialized = get_materialized(experiment, **get_chart_query(chart))
+        if materialized is None:
+            return None
+        validators.append(materialized[0])
+        results[chart.chart_key] = materialized[1]
+    return "-".join(validators), results
+
+
+def materialize_charts() -> int:
+    """
+    Materializes the charts of the active experiments. Returns the number of time series materialized, time
+    series whose validator didn't change are kept as they are.
+    """
+    # charts can share a time series
+    queries = {}
+    for chart in get_chart_descriptors().values():
+        try:
+            query = get_chart_query(chart)
+        except ValueError:
+            continue
+        queries[_materialized_key("", query)] = query
+
+    n = 0
+    for experiment in get_active_experiments():
+        for query in queries.values():
+            key = _materialized_key(experiment, query)
+            with read_app_db_snapshot():
+                try:
+                    validator = get_validator(query["data_source"], query["lookback"])
+                    materialized = cache.get(key)
+                    if materialized is not None and materialized[0] == validator:
+                        # nothing changed since the last run
+                        cache.touch(key, expire=MATERIALIZED_EXPIRE_SECONDS)
+                        continue
+                    result = query_time_series(experiment=experiment, **query)
+                except sqlite3.OperationalError as e:
+                    # ex: a plugin's table was dropped since get_chart_query
+                    logger.debug(f"Unable to materialize {query['data_source']}: {e}")
+                    continue
+
+            cache.set(
+                key,
+                (validator, result),
+                expire=MATERIALIZED_EXPIRE_SECONDS,
+                tag="materialized_time_series",
+            )
+            n += 1
+    return n
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# compression.py
+"""
+Compression of response bodies, negotiated with the client's Accept-Encoding: zstd (if the zstandard package
+is installed) or gzip. Small bodies, and streamed ones (chunked JSON, Server-Sent Events), are sent as is.
+
+Responses memoized in the diskcache are compressed once, when they are cached, see precompress.
+"""
+from __future__ import annotations
+
+import gzip
+import typing as t
+from functools import wraps
+
+from flask import make_response
+from flask import request
+from flask import Response
+
+try:
+    import zstandard  # type: ignore[import-not-found]
+except ImportError:
+    zstandard = None
+
+# bodies smaller than this fit in a few packets anyways.
+MIN_SIZE = 1024
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "application/yaml",
+    "application/x-msgpack",
+    "text/csv",
+    "text/html",
+    "text/plain",
+    "text/yaml",
+}
+
+# in order of preference, if the client accepts both equally.
+ENCODINGS: tuple[str, ...] = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+# cheap enough for a Raspberry Pi to compress every response.
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+# precompressed bodies are compressed once per cache entry, so use a smaller, slower encoding.
+PRECOMPRESS_GZIP_LEVEL = 9
+PRECOMPRESS_ZSTD_LEVEL = 10
+
+
+def compress(body: bytes, encoding: str, precompress: bool = False) -> bytes:
+    if encoding == "gzip":
+        # mtime=0, so the same body always compresses to the same bytes.
+        level = PRECOMPRESS_GZIP_LEVEL if precompress else GZIP_LEVEL
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    elif encoding == "zstd" and zstandard is not None:
+        level = PRECOMPRESS_ZSTD_LEVEL if precompress else ZSTD_LEVEL
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    raise ValueError(f"Unsupported encoding {encoding}")
+
+
+def is_compressible(response: Response) -> bool:
+    return (
+        response.status_code == 200
+        and not response.is_streamed
+        and not response.direct_passthrough
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in COMPRESSIBLE_MIMETYPES
+        and (response.content_length or 0) >= MIN_SIZE
+    )
+
+
+def precompress(view: t.Callable[..., t.Any]) -> t.Callable[..., Response]:
+    """
+    Compresses the view's response in every encoding, so that it's memoized along with its compressed bodies.
+    Place it under @cache.memoize.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs) -> Response:
+        response = make_response(view(*args, **kwargs))
+        if is_compressible(response):
+            body = response.get_data()
+            response.precompressed = {  # type: ignore
+                encoding: compress(body, encoding, precompress=True) for encoding in ENCODINGS
+            }
+        return response
+
+    return wrapper
+
+
+def compress_response(response: Response) -> Response:
+    """An after_request hook."""
+    if not is_compressible(response):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+
+    precompressed = getattr(response, "precompressed", {})
+    if encoding in precompressed:
+        body = precompressed[encoding]
+    else:
+        body = compress(response.get_data(), encoding)
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+
+    # a strong ETag is for these exact bytes.
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# downsampling.py
+from __future__ import annotations
+
+import typing as t
+
+
+def lttb(xs: t.Sequence[float], ys: t.Sequence[float], threshold: int) -> list[int]:
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of the points to keep, in order.
+
+    The first and last points are always kept. For each bucket in between, we keep the point that forms
+    the largest triangle with the previously kept point and the average of the next bucket. Unlike
+    uniform sampling, this preserves peaks and dips (ex: dosing events) in the series.
+
+    https://skemman.is/bitstream/1946/15343/3/SS_MSthesis.pdf
+    """
+    n = len(xs)
+    if threshold >= n:
+        return list(range(n))
+    elif threshold <= 0:
+        return []
+    elif threshold == 1:
+        return [n - 1]
+    elif threshold == 2:
+        return [0, n - 1]
+
+    bucket_size = (n - 2) / (threshold - 2)
+
+    sampled = [0]
+    a = 0
+
+    for i in range(threshold - 2):
+        # average point of the next bucket
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / next_count
+        avg_y = sum(ys[next_start:next_end]) / next_count
+
+        # point in the current bucket with the largest triangle area
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        ax, ay = xs[a], ys[a]
+        max_area = -1.0
+        max_index = start
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                max_index = j
+
+        sampled.append(max_index)
+        a = max_index
+
+    sampled.append(n - 1)
+    return sampled
+
+
+P = t.TypeVar("P")
+
+
+def lttb_iter(
+    points: t.Iterable[P], n: int, threshold: int, xy: t.Callable[[P], tuple[float, float]]
+) -> t.Iterator[P]:
+    """
+    Same as lttb, but over a stream of n points, yielding the points to keep. Only two buckets are held
+    in memory at a time, so the number of points in the stream doesn't matter. xy(point) returns (x, y).
+
+    If the stream ends before n points, the last point seen is still kept.
+    """
+    if threshold >= n:
+        yield from points
+        return
+    elif threshold <= 0:
+        return
+
+    it = iter(points)
+    first = next(it, None)
+    if first is None:
+        return
+    elif threshold <= 2:
+        if threshold == 2:
+            yield first
+        last = first
+        for last in it:
+            pass
+        yield last
+        return
+
+    bucket_size = (n - 2) / (threshold - 2)
+
+    def take(k: int) -> list[P]:
+        return [p for _, p in zip(range(k), it)]
+
+    yield first
+    a = first
+    current = take(int(bucket_size))
+
+    for i in range(threshold - 2):
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_bucket = take(next_end - next_start)
+        if not current or not next_bucket:
+            # the stream ended early
+            break
+
+        avg_x = sum(xy(p)[0] for p in next_bucket) / len(next_bucket)
+        avg_y = sum(xy(p)[1] for p in next_bucket) / len(next_bucket)
+
+        ax, ay = xy(a)
+        max_area = -1.0
+        for p in current:
+            x, y = xy(p)
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                a = p
+
+        yield a
+        current = next_bucket
+
+    if current:
+        yield current[-1]
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+# live_updates.py
+"""
+New rows of an experiment's time series and logs, pushed as Server-Sent Events.
+
+A stream is woken by the MQTT messages that precede new rows (see chart_cache.INVALIDATING_TOPICS), and
+reads the rows after its cursor, a seek on ROWID. Without MQTT, it polls. Each event's id is the
+cursor after it, so a browser's EventSource resumes where it left off with the Last-Event-ID header.
+
+Logs can also be tailed with long polls, see tail_logs: a request waits for logs after the last one it has
+seen, and returns as soon as there are some.
+
+Streams and tails each hold one of the FastCGI server's threads while they're open, so their number is capped,
+see stream_slots and tail_slots. Behind lighttpd, events are only sent as they're written with
+server.stream-response-body = 2 in lighttpd.conf, else lighttpd buffers the whole response body.
+"""
+from __future__ import annotations
+
+import threading
+import typing as t
+from contextlib import contextmanager
+from datetime import datetime
+from time import monotonic
+from time import sleep
+
+from msgspec.json import encode as dumps
+from paho.mqtt.client import MQTTMessage
+from pioreactor.config import config
+
+from . import add_subscription
+from . import query_app_db
+from .chart_cache import INVALIDATING_TOPICS
+from .queries import get_min_level_num
+from .queries import logs_have_level_num
+from .queries import new_logs_sql
+from .time_series import BUILTIN_TIME_SERIES
+from .time_series import get_cursor
+from .time_series import query_time_series
+from .time_series import to_json
+
+# the order of the cursors in an event id
+STREAMED_TABLES = (
+    "od_readings",
+    "od_readings_filtered",
+    "growth_rates",
+    "temperature_readings",
+    "logs",
+)
+
+# longest wait for new rows, if no MQTT message arrives. A keep-alive comment is sent after each.
+POLL_SECONDS = 5.0
+
+# rows are inserted by mqtt_to_db shortly after their MQTT message, and messages come in bursts.
+BATCH_SECONDS = 1.0
+
+# streams are closed after this long, and EventSource reconnects with Last-Event-ID. This frees the
+# server's thread, and picks up a new connection to the app db.
+MAX_STREAM_SECONDS = 2 * 60.0
+
+RECONNECT_MILLISECONDS = 1000
+
+# when all stream slots are taken, EventSource is told to reconnect after this long.
+BUSY_RECONNECT_MILLISECONDS = 30_000
+
+# default wait of a log tail request. Clients can ask for up to MAX_TAIL_SECONDS.
+TAIL_SECONDS = 15.0
+
+# longest wait of a log tail request. Less than the timeouts of the proxies in front of the server.
+MAX_TAIL_SECONDS = 55.0
+
+# a log's MQTT message arrives a moment before mqtt_to_db inserts its row.
+TAIL_INSERT_SECONDS = 0.25
+
+Cursors = dict[str, int]
+
+
+class NewRowsNotifier:
+    """Wakes streams of an experiment when an MQTT message signals a new row."""
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._versions: dict[str, int] = {}
+
+    def version(self, experiment: str) -> int:
+        with self._condition:
+            # kept, so notify_all wakes this experiment's waiters.
+            return self._versions.setdefault(experiment, 0)
+
+    def notify(self, experiment: str) -> None:
+        with self._condition:
+            self._versions[experiment] = self._versions.get(experiment, 0) + 1
+            self._condition.notify_all()
+
+    def notify_all(self) -> None:
+        with self._condition:
+            for experiment in self._versions:
+                self._versions[experiment] += 1
+            self._condition.notify_all()
+
+    def wait(self, experiment: str, version: int, timeout: float) -> int:
+        """Waits until the experiment's version isn't `version`, or timeout. Returns the latest version."""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._versions.get(experiment, 0) != version, timeout=timeout
+            )
+            return self._versions.get(experiment, 0)
+
+
+class Slots:
+    """At most n holders at once. Requests beyond that are turned away rather than queued."""
+
+    def __init__(self, n: int) -> None:
+        self.n = n
+        self._semaphore = threading.BoundedSemaphore(n)
+
+    @contextmanager
+    def take(self) -> t.Iterator[bool]:
+        """Yields whether a slot was taken, it's freed on exit."""
+        taken = self._semaphore.acquire(blocking=False)
+        try:
+            yield taken
+        finally:
+            if taken:
+                self._semaphore.release()
+
+
+stream_slots = Slots(config.getint("ui", "max_live_streams", fallback=8))
+tail_slots = Slots(config.getint("ui", "max_log_tails", fallback=8))
+
+notifier = NewRowsNotifier()
+
+# only woken by logs, for tail_logs.
+logs_notifier = NewRowsNotifier()
+
+
+def start_notifying_on_new_rows() -> None:
+    def notify(_client, userdata, message: MQTTMessage) -> None:
+        # pioreactor/<unit>/<experiment>/...
+        notifier.notify(message.topic.split("/")[2])
+
+    def notify_log(_client, userdata, message: MQTTMessage) -> None:
+        experiment = message.topic.split("/")[2]
+        for n in (notifier, logs_notifier):
+            # logs of $experiment are shown in every experiment.
+            if experiment == "$experiment":
+                n.notify_all()
+            else:
+                n.notify(experiment)
+
+    for data_source in STREAMED_TABLES:
+        for topic in INVALIDATING_TOPICS.get(data_source, []):
+            add_subscription(f"pioreactor/+/+/{topic}", notify)
+    add_subscription("pioreactor/+/+/logs/#", notify_log)
+
+
+def encode_event_id(cursors: Cursors) -> str:
+    return "-".join(str(cursors[table]) for table in STREAMED_TABLES)
+
+
+def decode_event_id(event_id: str) -> Cursors:
+    try:
+        rowids = [int(rowid) for rowid in event_id.split("-")]
+    except ValueError as e:
+        raise ValueError(f"Invalid event id {event_id}") from e
+
+    if len(rowids) != len(STREAMED_TABLES):
+        raise ValueError(f"Invalid event id {event_id}")
+    return dict(zip(STREAMED_TABLES, rowids))
+
+
+def get_current_cursors() -> Cursors:
+    return {table: get_cursor(table) for table in STREAMED_TABLES}
+
+
+def sse_event(event: str, data: t.Any, event_id: str) -> bytes:
+    # data is JSON, which has no newlines.
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (event_id.encode(), event.encode(), dumps(data))
+
+
+def _new_events(experiment: str, cursors: Cursors, min_level: str) -> t.Iterator[tuple[str, t.Any]]:
+    """(event, data) of rows after cursors, which are advanced as events are produced."""
+    for data_source in STREAMED_TABLES:
+        if data_source == "logs":
+            continue
+
+        column, decimals, series_by_channel = BUILTIN_TIME_SERIES[data_source]
+        result = query_time_series(
+            data_source,
+            column,
+            experiment,
+            0.0,
+            decimals=decimals,
+            series_by_channel=series_by_channel,
+            since=cursors[data_source],
+            downsample=False,
+            start=datetime.min,
+        )
+        cursors[data_source] = result["cursor"]
+        if result["series"]:
+            yield data_source, to_json(result)
+
+    cursor = get_cursor("logs")
+    logs = query_app_db(
+        new_logs_sql(logs_have_level_num()),
+        (cursors["logs"], cursor, experiment, get_min_level_num(min_level)),
+    )
+    assert isinstance(logs, list)
+    cursors["logs"] = cursor
+    if logs:
+        yield "logs", logs
+
+
+def stream_new_rows(
+    experiment: str, cursors: Cursors, min_level: str = "INFO"
+) -> t.Iterator[bytes]:
+    """
+    Server-Sent Events of rows added after cursors: events od_readings, od_readings_filtered, growth_rates and
+    temperature_readings (same data as the time series endpoints) and logs (same data as the logs endpoint).
+    Consume the iterator within the app context.
+
+    If all stream_slots are taken, the stream closes at once and EventSource reconnects later. A 503 would
+    make EventSource give up.
+    """
+    with stream_slots.take() as taken:
+        if not taken:
+            yield b"retry: %d\n\n" % BUSY_RECONNECT_MILLISECONDS
+            return
+        yield from _stream_new_rows(experiment, cursors, min_level)
+
+
+def _stream_new_rows(experiment: str, cursors: Cursors, min_level: str) -> t.Iterator[bytes]:
+    yield b"retry: %d\n\n" % RECONNECT_MILLISECONDS
+
+    started_at = monotonic()
+    version = notifier.version(experiment)
+    while True:
+        for event, data in _new_events(experiment, cursors, min_level):
+            yield sse_event(event, data, encode_event_id(cursors))
+
+        remaining = MAX_STREAM_SECONDS - (monotonic() - started_at)
+        if remaining <= 0:
+            return
+
+        if notifier.wait(experiment, version, min(POLL_SECONDS, remaining)) == version:
+            yield b": keep-alive\n\n"
+        else:
+            # let mqtt_to_db insert the rows, and the rest of the burst arrive.
+            sleep(BATCH_SECONDS)
+            version = notifier.version(experiment)
+
+
+def tail_logs(
+    experiment: str,
+    after: int,
+    timeout: float,
+    min_level: str = "INFO",
+    units: tuple[str, ...] = (),
+) -> tuple[list[dict[str, t.Any]], int]:
+    """
+    Logs of the experiment added after the ROWID `after`, waiting up to timeout seconds for some. Returns
+    them (the same data as the logs endpoint) and the cursor to pass as `after` next time.
+
+    The wait is woken by the logs' MQTT messages, so there's one query per batch of new logs. Without MQTT,
+    it polls every POLL_SECONDS. Call it within the app context.
+    """
+    deadline = monotonic() + timeout
+    sql = new_logs_sql(logs_have_level_num(), len(units))
+    version = logs_notifier.version(experiment)
+    while True:
+        cursor = get_cursor("logs")
+        if cursor > after:
+            logs = query_app_db(
+                sql, (after, cursor, experiment, *units, get_min_level_num(min_level))
+            )
+            assert isinstance(logs, list)
+            after = cursor
+            if logs:
+                return logs, after
+
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return [], after
+
+        latest_version = logs_notifier.wait(experiment, version, min(POLL_SECONDS, remaining))
+        if latest_version != version:
+            sleep(min(TAIL_INSERT_SECONDS, max(deadline - monotonic(), 0.0)))
+            version = latest_version
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+# log_archive.py
+"""
+Retention of the logs table: old logs are moved, in batches, into an archive database next to the app db,
+so the logs table (and its indexes) stay small. The logs endpoints and log search read the archive too, when
+their window reaches archived logs, see read_log_archive. The archive has its own search index, its logs_fts.
+
+A log is archived once it's older than [ui] logs_retention_days (0, the default, archives nothing), or, if its
+experiment has no workers assigned anymore, once it's out of the default logs window. Archived logs keep their
+ROWID (as log_id), so (timestamp, ROWID) cursors are unique across both databases.
+
+Dataset exports (`pio export`, and export_datasets) read only the app db's logs table, so they don't include
+archived logs. Archived logs can be read from the archive database's logs table.
+"""
+from __future__ import annotations
+
+import sqlite3
+from pathlib import Path
+
+from pioreactor.config import config
+
+from . import logger
+from . import query_app_db
+from .queries import hours_ago
+from .queries import level_num_sql
+from .queries import LOGS_LOOKBACK_HOURS
+from .rollups import table_exists
+from .utils import plain_cursor
+
+# the archive's schema name, when attached to an app db connection.
+ARCHIVE_SCHEMA = "logs_archive"
+
+# max number of logs moved per transaction, so we don't hold the write lock for long.
+BATCH_SIZE = 10_000
+
+# shorter retentions would archive logs of the default logs window.
+MIN_RETENTION_DAYS = LOGS_LOOKBACK_HOURS / 24
+
+CREATE_LOG_ARCHIVE = f"""
+CREATE TABLE IF NOT EXISTS {ARCHIVE_SCHEMA}.logs (
+    log_id           INTEGER PRIMARY KEY, -- its ROWID in the app db
+    experiment       TEXT NOT NULL,
+    pioreactor_unit  TEXT NOT NULL,
+    timestamp        TEXT NOT NULL,
+    message          TEXT NOT NULL,
+    source           TEXT NOT NULL,
+    level            TEXT,
+    task             TEXT
+);
+
+CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.logs_experiment_timestamp_ix ON logs (experiment, timestamp);
+
+-- in the app db, so the endpoints know when to attach the archive.
+CREATE TABLE IF NOT EXISTS main.logs_archive_state (
+    experiment      TEXT PRIMARY KEY,
+    archived_until  TEXT NOT NULL -- the newest timestamp archived
+) WITHOUT ROWID;
+
+CREATE TEMP TABLE IF NOT EXISTS archived_log_ids (log_id INTEGER PRIMARY KEY);
+"""
+
+# like log_search.CREATE_LOG_SEARCH. Archived logs are only ever inserted.
+CREATE_LOG_ARCHIVE_SEARCH = f"""
+CREATE VIRTUAL TABLE {ARCHIVE_SCHEMA}.logs_fts USING fts5(message, task, content='logs', content_rowid='log_id');
+
+CREATE TRIGGER {ARCHIVE_SCHEMA}.logs_fts_insert AFTER INSERT ON logs
+BEGIN
+    INSERT INTO logs_fts (rowid, message, task) VALUES (new.log_id, new.message, new.task);
+END;
+"""
+
+
+def get_retention_days() -> float:
+    # archived logs aren't in dataset exports, see the module's docstring.
+    return config.getfloat("ui", "logs_retention_days", fallback=0.0)
+
+
+def get_archive_path() -> str:
+    database = Path(config.get("storage", "database"))
+    return config.get(
+        "ui",
+        "logs_archive_database",
+        fallback=str(database.with_name("pioreactor_logs_archive.sqlite")),
+    )
+
+
+def attach_log_archive(con: sqlite3.Connection) -> None:
+    cur = plain_cursor(con)
+    cur.execute("SELECT count(1) FROM pragma_database_list WHERE name=?", (ARCHIVE_SCHEMA,))
+    if cur.fetchone()[0] == 0:
+        cur.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (get_archive_path(),))
+
+
+def get_table_columns(con: sqlite3.Connection, schema: str, table: str) -> set[str]:
+    cur = plain_cursor(con)
+    cur.execute("SELECT name FROM pragma_table_xinfo(?, ?)", (table, schema))
+    return {row[0] for row in cur.fetchall()}
+
+
+def create_log_archive(con: sqlite3.Connection) -> None:
+    """
+    Creates the archive's tables. The archive must be attached. Its logs get level_num if the app db's have
+    it, see migrations.ensure_log_level_column, as the logs queries filter both the same way.
+    """
+    con.executescript(CREATE_LOG_ARCHIVE)
+    has_level_num = "level_num" in get_table_columns(con, "main", "logs")
+    if has_level_num and "level_num" not in get_table_columns(con, ARCHIVE_SCHEMA, "logs"):
+        con.execute(
+            f"ALTER TABLE {ARCHIVE_SCHEMA}.logs ADD COLUMN level_num INTEGER GENERATED ALWAYS AS {level_num_sql()} VIRTUAL"
+        )
+        con.commit()
+
+
+def create_log_archive_search(con: sqlite3.Connection) -> None:
+    """
+    Creates the archive's search index, and indexes the logs archived before it. Idempotent. The archive must
+    be attached.
+    """
+    cur = plain_cursor(con)
+    cur.execute(f"SELECT count(1) FROM {ARCHIVE_SCHEMA}.sqlite_master WHERE name='logs_fts'")
+    if cur.fetchone()[0] > 0:
+        return
+
+    try:
+        con.executescript(
+            f"""
+            BEGIN;
+            {CREATE_LOG_ARCHIVE_SEARCH}
+            INSERT INTO {ARCHIVE_SCHEMA}.logs_fts (logs_fts) VALUES ('rebuild');
+            COMMIT;
+            """
+        )
+    except Exception as e:
+        con.rollback()
+        raise e
+
+
+def archive_experiment_logs(con: sqlite3.Connection, experiment: str, before: str) -> int:
+    """Moves the experiment's logs older than before into the archive. Returns the number of logs moved."""
+    cur = plain_cursor(con)
+    n_rows = 0
+    while True:
+        try:
+            cur.execute("DELETE FROM temp.archived_log_ids")
+            # the newest log is kept, so its ROWID (the max) isn't reused by a new log.
+            cur.execute(
+                """
+                INSERT INTO temp.archived_log_ids (log_id)
+                SELECT ROWID FROM logs
+                WHERE experiment=? AND timestamp < ? AND ROWID < (SELECT max(ROWID) FROM logs)
+                ORDER BY timestamp
+                LIMIT ?
+                """,
+                (experiment, before, BATCH_SIZE),
+            )
+            n_batch = cur.rowcount
+            if n_batch == 0:
+                con.rollback()
+                return n_rows
+
+            # OR IGNORE: in WAL mode, a crash can commit the archive's side of a batch but not the app db's.
+            # Ignored logs aren't indexed again by logs_fts_insert.
+            cur.execute(
+                f"""
+                INSERT OR IGNORE INTO {ARCHIVE_SCHEMA}.logs (log_id, experiment, pioreactor_unit, timestamp, message, source, level, task)
+                SELECT ROWID, experiment, pioreactor_unit, timestamp, message, source, level, task
+                FROM logs WHERE ROWID IN (SELECT log_id FROM temp.archived_log_ids)
+                """
+            )
+            cur.execute(
+                """
+                INSERT INTO logs_archive_state (experiment, archived_until)
+                SELECT ?, max(timestamp) FROM logs WHERE ROWID IN (SELECT log_id FROM temp.archived_log_ids)
+                ON CONFLICT (experiment) DO UPDATE SET
+                    archived_until = max(archived_until, excluded.archived_until)
+                """,
+                (experiment,),
+            )
+            # the app db's search index is updated by logs_fts_delete, see log_search.py.
+            cur.execute(
+                "DELETE FROM logs WHERE ROWID IN (SELECT log_id FROM temp.archived_log_ids)"
+            )
+            con.commit()
+        except Exception as e:
+            con.rollback()
+            raise e
+
+        n_rows += n_batch
+
+
+def vacuum_freed_pages(con: sqlite3.Connection) -> None:
+    """
+    Returns the pages freed by archiving to the filesystem, if the app db uses incremental auto_vacuum.
+    Otherwise they're reused by new rows.
+    """
+    cur = plain_cursor(con)
+    cur.execute("PRAGMA auto_vacuum")
+    if cur.fetchone()[0] == 2:  # incremental
+        cur.execute("PRAGMA incremental_vacuum")
+        cur.fetchall()
+
+
+def archive_logs(con: sqlite3.Connection) -> int:
+    """Archives logs past their retention, see the module's docstring. Returns the number of logs moved."""
+    retention_days = get_retention_days()
+    if retention_days <= 0 or not table_exists(con, "logs"):
+        return 0
+
+    attach_log_archive(con)
+    create_log_archive(con)
+    try:
+        create_log_archive_search(con)
+    except sqlite3.OperationalError as e:
+        # ex: SQLite without FTS5. Logs are still archived, but not searchable.
+        logger.warning(f"Unable to create the log archive's search index: {e}")
+
+    cur = plain_cursor(con)
+    cur.execute("SELECT DISTINCT experiment FROM logs")
+    experiments = [row[0] for row in cur.fetchall()]
+
+    active_experiments: set[str] = set()
+    if table_exists(con, "experiment_worker_assignments"):
+        cur.execute("SELECT DISTINCT experiment FROM experiment_worker_assignments")
+        active_experiments = {row[0] for row in cur.fetchall()}
+
+    cutoff = hours_ago(max(retention_days, MIN_RETENTION_DAYS) * 24)
+    finished_cutoff = hours_ago(LOGS_LOOKBACK_HOURS)
+
+    n_rows = 0
+    for experiment in experiments:
+        # $experiment's logs are shown in every experiment.
+        is_finished = experiment not in active_experiments and experiment != "$experiment"
+        n_rows += archive_experiment_logs(
+            con, experiment, finished_cutoff if is_finished else cutoff
+        )
+
+    if n_rows > 0:
+        vacuum_freed_pages(con)
+    return n_rows
+
+
+def read_log_archive(experiment: str | None, since: str) -> bool:
+    """
+    True if logs of experiment (or of $experiment, or of any experiment if None) at or after since are
+    archived. Then the archive is attached to the request's app db connection, for the archived=True queries.
+    """
+    experiment_filter = "WHERE experiment IN (?, '$experiment')" if experiment is not None else ""
+    try:
+        r = query_app_db(
+            f"SELECT max(archived_until) as archived_until FROM logs_archive_state {experiment_filter}",
+            (experiment,) if experiment is not None else (),
+            one=True,
+        )
+    except sqlite3.OperationalError:
+        # nothing was ever archived
+        return False
+
+    assert isinstance(r, dict)
+    if r["archived_until"] is None or r["archived_until"] < since:
+        return False
+
+    attached = query_app_db(
+        "SELECT count(1) as n FROM pragma_database_list WHERE name=?", (ARCHIVE_SCHEMA,), one=True
+    )
+    assert isinstance(attached, dict)
+    if attached["n"] == 0:
+        query_app_db(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (get_archive_path(),))
+    return True
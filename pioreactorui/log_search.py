@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# log_search.py
+"""
+Full-text search of logs' message and task, with an FTS5 index.
+
+logs_fts is an external content FTS5 table: it indexes logs without storing another copy of the messages.
+Triggers on logs keep it in sync with the rows mqtt_to_db inserts. Logs that existed before the index
+was created are indexed in batches by backfill_log_search, see migrations.py, so a large logs table doesn't
+hold the write lock for long.
+"""
+from __future__ import annotations
+
+import sqlite3
+
+from .queries import level_filter_sql
+from .utils import plain_cursor
+
+# max number of logs indexed per transaction of the backfill.
+BATCH_SIZE = 50_000
+
+# most results in one page of a search.
+MAX_PAGE_SIZE = 200
+
+# logs are indexed by the triggers if inserted after the index was created (> indexed_from_rowid), and
+# by the backfill otherwise (<= backfilled_until). Rows in between aren't indexed yet.
+IS_INDEXED = """(
+    {row}.ROWID > (SELECT indexed_from_rowid FROM log_search_state) OR
+    {row}.ROWID <= (SELECT backfilled_until FROM log_search_state)
+)"""
+
+CREATE_LOG_SEARCH = f"""
+CREATE TABLE IF NOT EXISTS log_search_state (
+    id                  INTEGER PRIMARY KEY CHECK (id = 0),
+    indexed_from_rowid  INTEGER NOT NULL,
+    backfilled_until    INTEGER NOT NULL
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(message, task, content='logs', content_rowid='ROWID');
+
+CREATE TRIGGER IF NOT EXISTS logs_fts_insert AFTER INSERT ON logs
+WHEN {IS_INDEXED.format(row="new")}
+BEGIN
+    INSERT INTO logs_fts (rowid, message, task) VALUES (new.ROWID, new.message, new.task);
+END;
+
+CREATE TRIGGER IF NOT EXISTS logs_fts_delete AFTER DELETE ON logs
+WHEN {IS_INDEXED.format(row="old")}
+BEGIN
+    INSERT INTO logs_fts (logs_fts, rowid, message, task) VALUES ('delete', old.ROWID, old.message, old.task);
+END;
+
+CREATE TRIGGER IF NOT EXISTS logs_fts_update AFTER UPDATE OF message, task ON logs
+WHEN {IS_INDEXED.format(row="old")}
+BEGIN
+    INSERT INTO logs_fts (logs_fts, rowid, message, task) VALUES ('delete', old.ROWID, old.message, old.task);
+    INSERT INTO logs_fts (rowid, message, task) VALUES (new.ROWID, new.message, new.task);
+END;
+"""
+
+
+def create_log_search(con: sqlite3.Connection) -> None:
+    """Creates the index and its triggers, in one transaction so no log is missed. Idempotent."""
+    try:
+        con.executescript(
+            f"""
+            BEGIN;
+            {CREATE_LOG_SEARCH}
+            INSERT OR IGNORE INTO log_search_state (id, indexed_from_rowid, backfilled_until)
+            SELECT 0, coalesce(max(ROWID), 0), 0 FROM logs;
+            COMMIT;
+            """
+        )
+    except Exception as e:
+        con.rollback()
+        raise e
+
+
+def backfill_log_search(con: sqlite3.Connection) -> int:
+    """Indexes the logs that existed before the index was created. Returns the number of logs indexed."""
+    cur = plain_cursor(con)
+    cur.execute("SELECT indexed_from_rowid, backfilled_until FROM log_search_state")
+    indexed_from_rowid, backfilled_until = cur.fetchone()
+
+    n_rows = 0
+    while backfilled_until < indexed_from_rowid:
+        upper_rowid = min(backfilled_until + BATCH_SIZE, indexed_from_rowid)
+        try:
+            cur.execute(
+                """
+                INSERT INTO logs_fts (rowid, message, task)
+                SELECT ROWID, message, task FROM logs WHERE ROWID > ? AND ROWID <= ?
+                """,
+                (backfilled_until, upper_rowid),
+            )
+            n_rows += cur.rowcount
+            cur.execute("UPDATE log_search_state SET backfilled_until=?", (upper_rowid,))
+            con.commit()
+        except Exception as e:
+            con.rollback()
+            raise e
+        backfilled_until = upper_rowid
+
+    return n_rows
+
+
+def to_fts_query(search: str) -> str:
+    """
+    An FTS5 query of a user's search, ex: `pump fail*`, which matches logs with all of the words. Words
+    ending with * are prefixes. Words are quoted, so FTS5 syntax (ex: AND, NEAR, column:) is searched as text.
+    """
+    terms = []
+    for word in search.split():
+        prefix = "*" if word.endswith("*") else ""
+        word = word.rstrip("*")
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + prefix)
+
+    if not terms:
+        raise ValueError("Nothing to search for.")
+    return " ".join(terms)
+
+
+def search_logs_sql(
+    has_experiment: bool,
+    n_units: int,
+    by_rank: bool,
+    has_level_num: bool = True,
+    archived: bool = False,
+) -> str:
+    """
+    Logs matching an FTS5 query, best matches (bm25) first if by_rank, else newest first. Parameters are
+    (query, [experiment], *units, min level num, start, end), twice if archived, then (page size, offset).
+
+    The FTS index is read first (CROSS JOIN), and the filters are checked on each match's row. If archived,
+    the log archive's index (see log_archive.py) is searched too. Its bm25 ranks are computed over the
+    archived logs only, so they're close to, but not exactly comparable with, the app db's.
+    """
+    experiment_filter = "AND l.experiment=?" if has_experiment else ""
+    unit_filter = f"AND l.pioreactor_unit IN ({', '.join('?' * n_units)})" if n_units else ""
+
+    def matches(schema: str, rowid: str) -> str:
+        return f"""
+        SELECT l.timestamp, l.level, l.pioreactor_unit, l.experiment, l.message, l.task{", f.rank" if archived else ""}
+        FROM {schema}.logs_fts AS f
+        CROSS JOIN {schema}.logs AS l ON l.{rowid} = f.rowid
+        WHERE f.logs_fts MATCH ?
+            {experiment_filter}
+            {unit_filter}
+            AND {level_filter_sql(has_level_num)}
+            AND l.timestamp >= ? AND l.timestamp < ?"""
+
+    if not archived:
+        return f"""{matches("main", "ROWID")}
+        ORDER BY {"f.rank" if by_rank else "l.timestamp DESC"}
+        LIMIT ? OFFSET ?"""
+    return f"""
+        SELECT timestamp, level, pioreactor_unit, experiment, message, task FROM (
+            {matches("main", "ROWID")}
+            UNION ALL
+            {matches("logs_archive", "log_id")}
+        )
+        ORDER BY {"rank" if by_rank else "timestamp DESC"}
+        LIMIT ? OFFSET ?"""
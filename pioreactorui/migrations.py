@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+# migrations.py
+"""
+Schema objects the UI owns in the app database (indexes for its hot query shapes, rollup tables, the log
+search index), and a check of the query plans of those hot queries so we catch full table scans after
+schema changes.
+
+Runs in the background when the leader's app starts (see create_app), or from the command line:
+
+    python3 -m pioreactorui.migrations [--explain-only]
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import sqlite3
+import typing as t
+
+from msgspec import Struct
+from pioreactor.config import config
+from pioreactor.utils.timing import current_utc_timestamp
+
+from . import logger
+from .log_archive import attach_log_archive
+from .log_archive import create_log_archive
+from .log_archive import create_log_archive_search
+from .log_search import backfill_log_search
+from .log_search import create_log_search
+from .queries import level_num_sql
+from .queries import logs_page_sql
+from .queries import logs_sql
+from .queries import LOGS_VALIDATOR_SQL
+from .queries import MEDIA_RATES_SQL
+from .rollups import create_rollup_tables
+from .rollups import ROLLUP_SOURCES
+from .rollups import table_exists
+from .time_series import latest_rows_sql
+from .time_series import overlay_rows_sql
+from .time_series import page_rows_sql
+from .time_series import raw_counts_sql
+from .time_series import raw_rows_sql
+from .time_series import rollup_rows_sql
+from .utils import plain_cursor
+
+
+class IndexSpec(Struct, frozen=True):  # type: ignore
+    name: str
+    table: str
+    columns: tuple[str, ...]
+
+
+INDEXES: tuple[IndexSpec, ...] = (
+    # time series windows. These cover the columns the time series endpoints read, so no table lookups are needed.
+    IndexSpec(
+        "od_readings_experiment_timestamp_ix",
+        "od_readings",
+        ("experiment", "timestamp", "pioreactor_unit", "channel", "od_reading"),
+    ),
+    IndexSpec(
+        "od_readings_filtered_experiment_timestamp_ix",
+        "od_readings_filtered",
+        ("experiment", "timestamp", "pioreactor_unit", "normalized_od_reading"),
+    ),
+    IndexSpec(
+        "growth_rates_experiment_timestamp_ix",
+        "growth_rates",
+        ("experiment", "timestamp", "pioreactor_unit", "rate"),
+    ),
+    IndexSpec(
+        "temperature_readings_experiment_timestamp_ix",
+        "temperature_readings",
+        ("experiment", "timestamp", "pioreactor_unit", "temperature_c"),
+    ),
+    # logs
+    IndexSpec("logs_experiment_timestamp_ix", "logs", ("experiment", "timestamp")),
+    # the newest log of an experiment, for ETags. ROWID is the index's last column.
+    IndexSpec("logs_experiment_ix", "logs", ("experiment",)),
+    # min_level filters, see ensure_log_level_column.
+    IndexSpec(
+        "logs_experiment_level_timestamp_ix", "logs", ("experiment", "level_num", "timestamp")
+    ),
+    IndexSpec(
+        "logs_experiment_unit_timestamp_ix", "logs", ("experiment", "pioreactor_unit", "timestamp")
+    ),
+    # media rates
+    IndexSpec(
+        "dosing_events_experiment_timestamp_ix", "dosing_events", ("experiment", "timestamp")
+    ),
+)
+
+
+def _hot_queries() -> dict[str, str]:
+    queries: dict[str, str] = {}
+
+    for data_source, (column, series_by_channel) in ROLLUP_SOURCES.items():
+        queries[f"time_series_{data_source}"] = raw_rows_sql(
+            data_source, column, 7, series_by_channel, incremental=False
+        )
+        queries[f"time_series_{data_source}_since"] = raw_rows_sql(
+            data_source, column, 7, series_by_channel, incremental=True
+        )
+        queries[f"time_series_{data_source}_counts"] = raw_counts_sql(
+            data_source, column, series_by_channel, incremental=False
+        )
+        queries[f"time_series_{data_source}_page"] = page_rows_sql(
+            data_source, column, 7, series_by_channel
+        )
+        queries[f"time_series_{data_source}_latest"] = latest_rows_sql(
+            data_source, series_by_channel
+        )
+        queries[f"time_series_{data_source}_overlay"] = overlay_rows_sql(
+            data_source, column, 7, series_by_channel, n_experiments=3, bounded=True
+        )
+        queries[f"time_series_{data_source}_units"] = raw_rows_sql(
+            data_source,
+            column,
+            7,
+            series_by_channel,
+            incremental=False,
+            n_units=2,
+            n_channels=2 if series_by_channel else 0,
+        )
+    queries["time_series_rollups"] = rollup_rows_sql(7)
+    queries["time_series_rollups_units"] = rollup_rows_sql(7, n_units=2, n_channels=2)
+
+    queries["logs"] = logs_sql(for_unit=False)
+    queries["logs_for_unit"] = logs_sql(for_unit=True)
+    queries["logs_page"] = logs_page_sql(for_unit=False)
+    queries["logs_page_for_unit"] = logs_page_sql(for_unit=True)
+    queries["logs_validator"] = LOGS_VALIDATOR_SQL
+    queries["media_rates"] = MEDIA_RATES_SQL
+
+    return queries
+
+
+CREATE_QUERY_PLANS_TABLE = """
+CREATE TABLE IF NOT EXISTS query_plans (
+    name             TEXT PRIMARY KEY,
+    plan             TEXT NOT NULL,
+    has_full_scan    INTEGER NOT NULL,
+    recorded_at      TEXT NOT NULL
+);
+"""
+
+
+def get_table_columns(con: sqlite3.Connection, table: str) -> set[str]:
+    cur = plain_cursor(con)
+    # table_xinfo, as table_info doesn't list generated columns.
+    cur.execute("SELECT name FROM pragma_table_xinfo(?)", (table,))
+    return {row[0] for row in cur.fetchall()}
+
+
+def get_index_columns(con: sqlite3.Connection, index_name: str) -> tuple[str, ...]:
+    cur = plain_cursor(con)
+    cur.execute("SELECT name FROM pragma_index_info(?) ORDER BY seqno", (index_name,))
+    return tuple(row[0] for row in cur.fetchall())
+
+
+def ensure_log_level_column(con: sqlite3.Connection) -> bool:
+    """
+    Adds logs.level_num, the severity of level (see queries.LOG_LEVEL_NUMS), so min_level filters are a
+    range on an index. It's a virtual generated column: computed when read or indexed, not stored in rows,
+    and mqtt_to_db's inserts don't change. Returns True if it was added.
+    """
+    if not table_exists(con, "logs"):
+        return False
+
+    cur = plain_cursor(con)
+    cur.execute("SELECT count(1) FROM pragma_table_xinfo('logs') WHERE name='level_num'")
+    if cur.fetchone()[0] > 0:
+        return False
+
+    logger.info("Adding column level_num to logs.")
+    try:
+        con.execute(
+            f"ALTER TABLE logs ADD COLUMN level_num INTEGER GENERATED ALWAYS AS {level_num_sql()} VIRTUAL"
+        )
+    except sqlite3.OperationalError as e:
+        # ex: SQLite without generated columns (< 3.31). min_level filters use the inline CASE instead.
+        logger.warning(f"Unable to add column level_num to logs: {e}")
+        return False
+    con.commit()
+    return True
+
+
+def ensure_indexes(con: sqlite3.Connection) -> list[str]:
+    """Creates missing indexes, and rebuilds ones whose columns differ. Returns the names of indexes created."""
+    created = []
+    for index in INDEXES:
+        if not table_exists(con, index.table):
+            continue
+        elif not set(index.columns) <= get_table_columns(con, index.table):
+            # ex: logs.level_num, if ensure_log_level_column couldn't add it.
+            continue
+
+        existing_columns = get_index_columns(con, index.name)
+        if existing_columns == index.columns:
+            continue
+        elif existing_columns:
+            logger.info(
+                f"Index {index.name} is on {existing_columns}, rebuilding on {index.columns}."
+            )
+            con.execute(f"DROP INDEX {index.name}")
+
+        logger.info(f"Creating index {index.name} on {index.table} {index.columns}.")
+        con.execute(f"CREATE INDEX {index.name} ON {index.table} ({', '.join(index.columns)})")
+        con.commit()
+        created.append(index.name)
+    return created
+
+
+def analyze(con: sqlite3.Connection) -> None:
+    # sample each index rather than reading it all, this is a Raspberry Pi.
+    con.execute("PRAGMA analysis_limit=1000")
+    con.execute("ANALYZE")
+    con.commit()
+
+
+def is_full_scan(detail: str) -> bool:
+    # ex: "SCAN od_readings", but not "SCAN od_readings USING INDEX ...", "SCAN CONSTANT ROW", or the scan
+    # of a subquery's (already limited) rows, "SCAN (subquery-1)"
+    return (
+        detail.startswith("SCAN ")
+        and "USING" not in detail
+        and "CONSTANT ROW" not in detail
+        and not detail.startswith("SCAN (subquery")
+    )
+
+
+# a row per experiment or worker, so scanning them is cheap.
+LOOKUP_TABLES = frozenset({"experiments", "workers", "experiment_worker_assignments"})
+
+# on a small app db, SQLite can prefer scanning a table to using its index, and the plan changes as the table
+# grows. Scans of tables smaller than this are recorded, but not warned about.
+SMALL_TABLE_ROWS = 10_000
+
+# ex: "FROM logs AS l", "JOIN experiments e"
+TABLE_ALIAS_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+([\w.]+)\s+(?:AS\s+)?(\w+)", re.IGNORECASE)
+
+
+def get_scanned_tables(query: str, plan: list[str]) -> list[str]:
+    """The tables, other than LOOKUP_TABLES, that plan fully scans."""
+    tables = {alias: table for table, alias in TABLE_ALIAS_PATTERN.findall(query)}
+    scanned = [detail.split()[1] for detail in plan if is_full_scan(detail)]
+    return [
+        tables.get(name, name) for name in scanned if tables.get(name, name) not in LOOKUP_TABLES
+    ]
+
+
+def get_table_rows(con: sqlite3.Connection) -> dict[str, int]:
+    """Number of rows of each table, as of the last ANALYZE. Empty tables aren't in it."""
+    cur = plain_cursor(con)
+    try:
+        cur.execute("SELECT tbl, max(CAST(stat AS INTEGER)) FROM sqlite_stat1 GROUP BY tbl")
+    except sqlite3.OperationalError:
+        # never analyzed
+        return {}
+    return dict(cur.fetchall())
+
+
+def explain_hot_queries(con: sqlite3.Connection) -> dict[str, list[str]]:
+    """EXPLAIN QUERY PLAN each hot query. Queries whose tables don't exist are skipped."""
+    cur = plain_cursor(con)
+    plans = {}
+    for name, query in _hot_queries().items():
+        n_parameters = query.count("?")
+        try:
+            cur.execute(f"EXPLAIN QUERY PLAN {query}", ("",) * n_parameters)
+        except sqlite3.OperationalError:
+            continue
+        plans[name] = [row[3] for row in cur.fetchall()]
+    return plans
+
+
+def record_query_plans(con: sqlite3.Connection, plans: dict[str, list[str]]) -> list[str]:
+    """
+    Saves plans to the query_plans table. Returns the names of queries with a full scan of a table of at
+    least SMALL_TABLE_ROWS rows, which are warned about.
+    """
+    con.executescript(CREATE_QUERY_PLANS_TABLE)
+    queries = _hot_queries()
+    table_rows = get_table_rows(con)
+    timestamp = current_utc_timestamp()
+    full_scans = []
+    for name, plan in plans.items():
+        scanned_tables = get_scanned_tables(queries[name], plan)
+        has_full_scan = len(scanned_tables) > 0
+        if any(table_rows.get(table, 0) >= SMALL_TABLE_ROWS for table in scanned_tables):
+            full_scans.append(name)
+            logger.warning(f"Query {name} has a full table scan: {plan}")
+        con.execute(
+            """
+            INSERT INTO query_plans (name, plan, has_full_scan, recorded_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET plan=excluded.plan, has_full_scan=excluded.has_full_scan, recorded_at=excluded.recorded_at
+            """,
+            (name, "\n".join(plan), int(has_full_scan), timestamp),
+        )
+    con.commit()
+    return full_scans
+
+
+def migrate_log_search(con: sqlite3.Connection) -> int:
+    """
+    Creates the log search index, and indexes older logs. Returns the number of logs backfilled. The log
+    archive's index too, if logs were archived, see log_archive.py.
+    """
+    if not table_exists(con, "logs"):
+        return 0
+
+    try:
+        create_log_search(con)
+        if table_exists(con, "logs_archive_state"):
+            attach_log_archive(con)
+            create_log_archive(con)
+            create_log_archive_search(con)
+    except sqlite3.OperationalError as e:
+        # ex: SQLite without FTS5
+        logger.warning(f"Unable to create the log search index: {e}")
+        return 0
+    return backfill_log_search(con)
+
+
+def migrate(con: sqlite3.Connection) -> dict[str, t.Any]:
+    create_rollup_tables(con)
+    ensure_log_level_column(con)
+    created = ensure_indexes(con)
+    backfilled_logs = migrate_log_search(con)
+    analyze(con)
+    full_scans = record_query_plans(con, explain_hot_queries(con))
+    return {
+        "created_indexes": created,
+        "backfilled_logs": backfilled_logs,
+        "full_scans": full_scans,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Create and verify the UI's app database indexes.")
+    parser.add_argument(
+        "--explain-only", action="store_true", help="only print the plans of the hot queries"
+    )
+    args = parser.parse_args()
+
+    con = sqlite3.connect(config.get("storage", "database"), timeout=10.0)
+    try:
+        if args.explain_only:
+            queries = _hot_queries()
+            for name, plan in explain_hot_queries(con).items():
+                marker = "FULL SCAN " if get_scanned_tables(queries[name], plan) else ""
+                print(f"{marker}{name}: {'; '.join(plan)}")
+        else:
+            print(migrate(con))
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
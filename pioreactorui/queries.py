@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# queries.py
+"""
+Time windows and SQL of the UI's frequent app db queries, shared by the endpoints and by migrations.py,
+which checks their query plans.
+
+Window cutoffs are computed once in Python, in the app db's timestamp format, and bound as parameters.
+The timestamp column is never wrapped in a function (ex: datetime(timestamp)), so a window is a range
+seek on an index rather than a scan.
+"""
+from __future__ import annotations
+
+import typing as t
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+from pioreactor.utils.timing import current_utc_datetime
+
+from .schema import get_table_columns
+
+# end of a window without an end. Timestamps are compared as text.
+END_OF_TIME = "9999-12-31T23:59:59.999"
+
+# a window is [start, end), as timestamps in the app db's format.
+Window = tuple[str, str]
+
+
+def to_db_timestamp(dt: datetime) -> str:
+    """
+    ex: 2023-10-01T13:00:00.000. The app db's timestamps end with Z, so compared as text, a row at exactly
+    this time is >= it, and not < it.
+    """
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat(timespec="milliseconds")
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ISO 8601, ex: 2023-10-01T13:00:00Z. Timestamps without a timezone are UTC."""
+    dt = datetime.fromisoformat(value)
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+
+def hours_ago(hours: float) -> str:
+    """The timestamp `hours` ago, in the app db's format."""
+    try:
+        return to_db_timestamp(current_utc_datetime() - timedelta(hours=hours))
+    except OverflowError:
+        return to_db_timestamp(datetime.min)
+
+
+def resolve_window(
+    lookback: float, start: datetime | None = None, end: datetime | None = None
+) -> Window:
+    """[start, end), where start defaults to `lookback` hours ago, and end defaults to no end."""
+    return (
+        to_db_timestamp(start) if start is not None else hours_ago(lookback),
+        to_db_timestamp(end) if end is not None else END_OF_TIME,
+    )
+
+
+## logs
+
+LOGS_LOOKBACK_HOURS = 24.0
+
+# level -> its severity, as in Python's logging (NOTICE is Pioreactor's). Logs of min_level and above are shown.
+LOG_LEVEL_NUMS: dict[str, int] = {
+    "DEBUG": 10,
+    "INFO": 20,
+    "NOTICE": 25,
+    "WARNING": 30,
+    "ERROR": 40,
+    "CRITICAL": 50,
+}
+
+
+def level_num_sql(level: str = "level") -> str:
+    """The severity of a log's level, NULL for unknown levels. logs.level_num is generated from this."""
+    cases = " ".join(f"WHEN '{name}' THEN {num}" for name, num in LOG_LEVEL_NUMS.items())
+    return f"(CASE upper({level}) {cases} END)"
+
+
+def get_min_level_num(min_level: str) -> int:
+    return LOG_LEVEL_NUMS.get(min_level.upper(), LOG_LEVEL_NUMS["INFO"])
+
+
+def level_filter_sql(has_level_num: bool, table: str = "l") -> str:
+    """
+    `level_num >= ?`. Until migrations.py adds the logs.level_num column (and its index), the same is computed
+    from level.
+    """
+    if has_level_num:
+        return f"{table}.level_num >= ?"
+    else:
+        return f"{level_num_sql(f'{table}.level')} >= ?"
+
+
+def logs_have_level_num() -> bool:
+    return "level_num" in get_table_columns("logs")
+
+
+def logs_sql(for_unit: bool, has_level_num: bool = True, archived: bool = False) -> str:
+    """
+    The 50 most recent logs of an experiment (and of $experiment), in the last day and since the experiment
+    started. Parameters are those of logs_args. If archived, the log archive (see log_archive.py) is read too.
+    """
+    unit_filter = "AND l.pioreactor_unit=?" if for_unit else ""
+
+    def experiment_logs(table: str) -> str:
+        return f"""
+        SELECT l.timestamp, level, l.pioreactor_unit, message, task
+        FROM {table} AS l
+        WHERE (l.experiment=? OR l.experiment='$experiment')
+            {unit_filter}
+            AND {level_filter_sql(has_level_num)}
+            AND l.timestamp >= MAX(?, (SELECT created_at FROM experiments where experiment=?))
+        ORDER BY l.timestamp DESC LIMIT 50"""
+
+    if not archived:
+        return f"{experiment_logs('logs')};"
+    return f"""
+        SELECT * FROM ({experiment_logs("logs")})
+        UNION ALL
+        SELECT * FROM ({experiment_logs("logs_archive.logs")})
+        ORDER BY timestamp DESC LIMIT 50;"""
+
+
+def logs_args(
+    experiment: str, min_level: str, pioreactor_unit: str | None = None, archived: bool = False
+) -> tuple[t.Any, ...]:
+    unit_args = (pioreactor_unit,) if pioreactor_unit is not None else ()
+    n_tables = 2 if archived else 1
+    return (
+        experiment,
+        *unit_args,
+        get_min_level_num(min_level),
+        hours_ago(LOGS_LOOKBACK_HOURS),
+        experiment,
+    ) * n_tables
+
+
+# the newest log of an experiment and of $experiment, each O(log n) with the (experiment) index. Parameters
+# are (experiment,).
+LOGS_VALIDATOR_SQL = """
+    SELECT max(
+        (SELECT coalesce(max(ROWID), 0) FROM logs WHERE experiment=?),
+        (SELECT coalesce(max(ROWID), 0) FROM logs WHERE experiment='$experiment')
+    ) as cursor;"""
+
+# most logs in one page, see logs_page_sql.
+MAX_LOGS_PAGE_SIZE = 1000
+
+# before the first page
+LAST_LOG = (END_OF_TIME, 2**63 - 1)
+
+
+def logs_page_sql(
+    for_unit: bool, n_units: int = 0, has_level_num: bool = True, archived: bool = False
+) -> str:
+    """
+    A page of an experiment's logs (and of $experiment's), newest first, before a keyset cursor on
+    (timestamp, ROWID), which is unique, so logs are neither skipped nor repeated between pages. Parameters
+    are those of logs_page_args.
+
+    Each experiment is read in index order and stops at the page size, so a page costs the same however far
+    back it is. With n_units, units are only a filter (unary +), so the (experiment, timestamp) index keeps
+    the order. If archived, the log archive (see log_archive.py) is read too, like another experiment.
+    """
+    if for_unit:
+        unit_filter = "AND l.pioreactor_unit=?"
+    elif n_units:
+        unit_filter = f"AND +l.pioreactor_unit IN ({', '.join('?' * n_units)})"
+    else:
+        unit_filter = ""
+
+    def experiment_logs(table: str) -> str:
+        return f"""
+        SELECT l.timestamp, level, l.pioreactor_unit, message, task, l.ROWID as rowid
+        FROM {table} AS l
+        WHERE l.experiment=?
+            {unit_filter}
+            AND {level_filter_sql(has_level_num)}
+            AND l.timestamp >= MAX(?, (SELECT created_at FROM experiments where experiment=?))
+            AND l.timestamp <= ? AND (l.timestamp, l.ROWID) < (?, ?)
+        ORDER BY l.timestamp DESC, l.ROWID DESC
+        LIMIT ?"""
+
+    tables = ("logs", "logs_archive.logs") if archived else ("logs",)
+    # for the experiment, then for $experiment.
+    subqueries = [f"SELECT * FROM ({experiment_logs(table)})" for table in tables] * 2
+    return f"""
+        {" UNION ALL ".join(subqueries)}
+        ORDER BY timestamp DESC, rowid DESC
+        LIMIT ?;"""
+
+
+def logs_page_args(
+    experiment: str,
+    min_level: str,
+    lookback: float,
+    before: tuple[str, int],
+    page_size: int,
+    pioreactor_unit: str | None = None,
+    units: tuple[str, ...] = (),
+    archived: bool = False,
+) -> tuple[t.Any, ...]:
+    unit_args = (pioreactor_unit,) if pioreactor_unit is not None else units
+    cutoff = hours_ago(lookback)
+    n_tables = 2 if archived else 1
+
+    def experiment_args(logs_experiment: str) -> tuple[t.Any, ...]:
+        return (
+            logs_experiment,
+            *unit_args,
+            get_min_level_num(min_level),
+            cutoff,
+            experiment,
+            before[0],
+            *before,
+            page_size,
+        )
+
+    return (
+        *experiment_args(experiment) * n_tables,
+        *experiment_args("$experiment") * n_tables,
+        page_size,
+    )
+
+
+def new_logs_sql(has_level_num: bool = True, n_units: int = 0) -> str:
+    """
+    Logs of an experiment (and of $experiment) added after a cursor. Parameters are (after rowid, cursor,
+    experiment, *units, min level num).
+    """
+    unit_filter = f"AND pioreactor_unit IN ({', '.join('?' * n_units)})" if n_units else ""
+    return f"""
+        SELECT timestamp, level, pioreactor_unit, message, task
+        FROM logs
+        WHERE ROWID > ? AND ROWID <= ?
+            AND (experiment=? OR experiment='$experiment')
+            {unit_filter}
+            AND {level_filter_sql(has_level_num, table="logs")}
+        ORDER BY ROWID;"""
+
+
+## media rates
+
+MEDIA_RATES_LOOKBACK_HOURS = 3
+
+# parameters are (cutoff, experiment)
+MEDIA_RATES_SQL = f"""
+    SELECT
+        d.pioreactor_unit,
+        SUM(CASE WHEN event='add_media' THEN volume_change_ml ELSE 0 END) / {MEDIA_RATES_LOOKBACK_HOURS} AS mediaRate,
+        SUM(CASE WHEN event='add_alt_media' THEN volume_change_ml ELSE 0 END) / {MEDIA_RATES_LOOKBACK_HOURS} AS altMediaRate
+    FROM dosing_events AS d
+    WHERE
+        d.timestamp >= ? AND
+        event IN ('add_alt_media', 'add_media') AND
+        source_of_event LIKE 'dosing_automation%' AND
+        experiment = ?
+    GROUP BY d.pioreactor_unit;"""
+
+
+def media_rates_args(experiment: str) -> tuple[t.Any, ...]:
+    return (hours_ago(MEDIA_RATES_LOOKBACK_HOURS), experiment)
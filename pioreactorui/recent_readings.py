@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# recent_readings.py
+"""
+Ring buffers of the last few hours of readings of the built-in time series, fed by MQTT.
+
+Recent windows are the most polled (the dashboard's charts), and reading them from memory means those polls
+don't compete with mqtt_to_db's writes for the app db. Older windows are still read from the app db.
+
+The buffers only cover the time since the MQTT client (re)connected, so a window is served from them only
+if it starts after that. Set [ui] recent_readings_hours=0 to disable them.
+"""
+from __future__ import annotations
+
+import threading
+import typing as t
+from array import array
+from time import time
+
+from msgspec import DecodeError
+from msgspec import Struct
+from msgspec import ValidationError
+from msgspec.json import decode as loads
+from paho.mqtt.client import MQTTMessage
+from pioreactor.config import config
+from pioreactor.structs import GrowthRate
+from pioreactor.structs import ODFiltered
+from pioreactor.structs import ODReading
+from pioreactor.structs import Temperature
+from pioreactor.utils.timing import to_iso_format
+
+from . import add_connect_callback
+from . import add_subscription
+from . import client
+
+DEFAULT_HOURS = 2.0
+
+# bounds the memory of a series, whatever its rate. Ex: an OD reading every 5s is 1440 readings in 2 hours.
+MAX_POINTS_PER_SERIES = 10_000
+
+# how often buffers of all series are pruned of readings older than the buffered hours.
+PRUNE_EVERY_SECONDS = 60.0
+
+
+class BufferedSource(Struct, frozen=True):  # type: ignore
+    # MQTT topics after pioreactor/<unit>/<experiment>/, same as mqtt_to_db's.
+    topics: tuple[str, ...]
+    payload_type: type
+    value: t.Callable[[t.Any], float]
+    by_channel: bool = False
+
+
+BUFFERED_SOURCES: dict[str, BufferedSource] = {
+    "od_readings": BufferedSource(
+        ("od_reading/od1", "od_reading/od2"), ODReading, lambda r: r.od, by_channel=True
+    ),
+    "od_readings_filtered": BufferedSource(
+        ("growth_rate_calculating/od_filtered",), ODFiltered, lambda r: r.od_filtered
+    ),
+    "growth_rates": BufferedSource(
+        ("growth_rate_calculating/growth_rate",), GrowthRate, lambda r: r.growth_rate
+    ),
+    "temperature_readings": BufferedSource(
+        ("temperature_automation/temperature",), Temperature, lambda r: r.temperature
+    ),
+}
+
+# a point is (timestamp, seconds since epoch, value), same as time_series.Point
+Point = tuple[str, float, float]
+
+
+class RingBuffer:
+    """The last `capacity` readings of a series, in timestamp order."""
+
+    def __init__(self, capacity: int = MAX_POINTS_PER_SERIES) -> None:
+        self.capacity = capacity
+        self.epochs = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.timestamps: list[str] = [""] * capacity
+        self.start = 0
+        self.size = 0
+        # epoch of the last reading evicted to make room, the buffer doesn't cover up to it.
+        self.evicted_until = float("-inf")
+
+    def _index(self, i: int) -> int:
+        return (self.start + i) % self.capacity
+
+    def append(self, timestamp: str, epoch: float, value: float) -> bool:
+        """Returns False, and drops the reading, if it's older than the latest one."""
+        if self.size and timestamp < self.timestamps[self._index(self.size - 1)]:
+            return False
+
+        if self.size == self.capacity:
+            self.evicted_until = self.epochs[self.start]
+            self.start = self._index(1)
+            self.size -= 1
+
+        i = self._index(self.size)
+        self.timestamps[i], self.epochs[i], self.values[i] = timestamp, epoch, value
+        self.size += 1
+        return True
+
+    def drop_before(self, epoch: float) -> None:
+        while self.size and self.epochs[self.start] < epoch:
+            self.start = self._index(1)
+            self.size -= 1
+
+    def _bisect(self, timestamp: str) -> int:
+        # the first i with timestamps[i] >= timestamp
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamps[self._index(mid)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def window(self, start: str, end: str, decimals: int) -> list[Point]:
+        """Readings in [start, end). Timestamps are compared as text, like the app db's queries do."""
+        points = []
+        for i in range(self._bisect(start), self._bisect(end)):
+            j = self._index(i)
+            points.append((self.timestamps[j], self.epochs[j], round(self.values[j], decimals)))
+        return points
+
+
+class RecentReadings:
+    def __init__(self, hours: float = DEFAULT_HOURS) -> None:
+        self.hours = hours
+        self._lock = threading.Lock()
+        # (data_source, experiment) -> series -> buffer
+        self._buffers: dict[tuple[str, str], dict[str, RingBuffer]] = {}
+        self._connected_at: float | None = None
+        self._pruned_at = 0.0
+
+    def reset(self, now: float | None = None) -> None:
+        """Drops all readings. The buffers cover the time from now on."""
+        with self._lock:
+            self._buffers.clear()
+            self._connected_at = now if now is not None else time()
+
+    def add(
+        self,
+        data_source: str,
+        experiment: str,
+        series: str,
+        timestamp: str,
+        epoch: float,
+        value: float,
+        now: float | None = None,
+    ) -> None:
+        now = now if now is not None else time()
+        with self._lock:
+            buffers = self._buffers.setdefault((data_source, experiment), {})
+            buffers.setdefault(series, RingBuffer()).append(timestamp, epoch, value)
+
+            if now - self._pruned_at >= PRUNE_EVERY_SECONDS:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        for key, buffers in list(self._buffers.items()):
+            for series, buffer in list(buffers.items()):
+                buffer.drop_before(now - self.hours * 60 * 60)
+                if not buffer.size:
+                    del buffers[series]
+            if not buffers:
+                del self._buffers[key]
+        self._pruned_at = now
+
+    def covered_since(self, data_source: str, experiment: str, now: float | None = None) -> float:
+        """Windows that start after this epoch are entirely in the buffers. inf if nothing is covered."""
+        now = now if now is not None else time()
+        with self._lock:
+            # readings published while disconnected are missed.
+            if self._connected_at is None or self.hours <= 0 or not client.is_connected():
+                return float("inf")
+            evicted_until = max(
+                (
+                    b.evicted_until
+                    for b in self._buffers.get((data_source, experiment), {}).values()
+                ),
+                default=float("-inf"),
+            )
+            return max(self._connected_at, now - self.hours * 60 * 60, evicted_until)
+
+    def window(
+        self, data_source: str, experiment: str, start: str, end: str, decimals: int
+    ) -> dict[str, list[Point]]:
+        """series -> readings in [start, end), for series with readings in the window."""
+        with self._lock:
+            buffers = self._buffers.get((data_source, experiment), {})
+            windows = {
+                series: buffer.window(start, end, decimals) for series, buffer in buffers.items()
+            }
+        return {series: points for series, points in windows.items() if points}
+
+
+recent_readings = RecentReadings(
+    config.getfloat("ui", "recent_readings_hours", fallback=DEFAULT_HOURS)
+)
+
+
+def start_buffering_recent_readings() -> None:
+    if recent_readings.hours <= 0:
+        return
+
+    for data_source, source in BUFFERED_SOURCES.items():
+
+        def add(_client, userdata, message: MQTTMessage, data_source=data_source, source=source):
+            try:
+                reading = loads(message.payload, type=source.payload_type)
+            except (DecodeError, ValidationError):
+                # mqtt_to_db reports these.
+                return
+
+            # pioreactor/<unit>/<experiment>/...
+            _, unit, experiment, *_ = message.topic.split("/")
+            series = f"{unit}-{int(reading.channel)}" if source.by_channel else unit
+            recent_readings.add(
+                data_source,
+                experiment,
+                series,
+                # same as mqtt_to_db stores it
+                to_iso_format(reading.timestamp),
+                reading.timestamp.timestamp(),
+                source.value(reading),
+            )
+
+        for topic in source.topics:
+            add_subscription(f"pioreactor/+/+/{topic}", add)
+
+    add_connect_callback(recent_readings.reset)
+    if client.is_connected():
+        recent_readings.reset()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# rollups.py
+"""
+Per-minute and per-hour rollups (mean, min, max, count) of the time series tables, so charts with long
+lookbacks don't aggregate raw rows.
+
+Rollups are maintained incrementally by a periodic huey task: each run aggregates the rows inserted since
+the previous run (tracked by ROWID, see time_series_rollup_watermarks) and merges them into the existing buckets.
+
+The time series tables have no AUTOINCREMENT, so once their newest rows are deleted (ex: with an experiment),
+new rows reuse those ROWIDs. A trigger on each table lowers its watermark when that happens.
+"""
+from __future__ import annotations
+
+import sqlite3
+
+from .utils import plain_cursor
+
+# data_source -> (column, is the series per channel)
+ROLLUP_SOURCES: dict[str, tuple[str, bool]] = {
+    "od_readings": ("od_reading", True),
+    "od_readings_filtered": ("normalized_od_reading", False),
+    "growth_rates": ("rate", False),
+    "temperature_readings": ("temperature_c", False),
+}
+
+# tier -> (bucket width in seconds, strftime format of the bucket's start)
+ROLLUP_TIERS: dict[str, tuple[int, str]] = {
+    "minute": (60, "%Y-%m-%dT%H:%M:00.000Z"),
+    "hour": (3600, "%Y-%m-%dT%H:00:00.000Z"),
+}
+
+# max number of raw rows aggregated per transaction, so we don't hold the write lock for long.
+BATCH_SIZE = 100_000
+
+
+CREATE_ROLLUP_TABLES = """
+CREATE TABLE IF NOT EXISTS time_series_rollups (
+    data_source      TEXT NOT NULL,
+    tier             TEXT NOT NULL,
+    experiment       TEXT NOT NULL,
+    bucket           TEXT NOT NULL,
+    series           TEXT NOT NULL,
+    pioreactor_unit  TEXT NOT NULL,
+    y_sum            REAL NOT NULL,
+    y_min            REAL NOT NULL,
+    y_max            REAL NOT NULL,
+    y_count          INTEGER NOT NULL,
+    PRIMARY KEY (data_source, tier, experiment, bucket, series)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS time_series_rollup_watermarks (
+    data_source      TEXT PRIMARY KEY,
+    last_rowid       INTEGER NOT NULL
+);
+"""
+
+
+def table_exists(con: sqlite3.Connection, table: str) -> bool:
+    cur = plain_cursor(con)
+    cur.execute("SELECT count(1) FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cur.fetchone()[0] > 0
+
+
+# after deleting the newest rows of a table, its watermark is at most its new newest ROWID.
+CREATE_ROLLUP_WATERMARK_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS {data_source}_rollup_watermark_delete AFTER DELETE ON {data_source}
+WHEN old.ROWID > (SELECT coalesce(max(ROWID), 0) FROM {data_source})
+BEGIN
+    UPDATE time_series_rollup_watermarks
+    SET last_rowid = min(last_rowid, (SELECT coalesce(max(ROWID), 0) FROM {data_source}))
+    WHERE data_source='{data_source}';
+END;
+"""
+
+
+def create_rollup_tables(con: sqlite3.Connection) -> None:
+    con.executescript(CREATE_ROLLUP_TABLES)
+    for data_source in ROLLUP_SOURCES:
+        if table_exists(con, data_source):
+            con.executescript(CREATE_ROLLUP_WATERMARK_TRIGGER.format(data_source=data_source))
+
+
+def update_rollups_for_data_source(
+    con: sqlite3.Connection, data_source: str, column: str, series_by_channel: bool
+) -> int:
+    """Aggregates rows of data_source inserted since the last run. Returns the number of raw rows rolled up."""
+    series_expression = (
+        "pioreactor_unit || '-' || channel" if series_by_channel else "pioreactor_unit"
+    )
+    cur = plain_cursor(con)
+
+    cur.execute(
+        "SELECT coalesce(max(last_rowid), 0) FROM time_series_rollup_watermarks WHERE data_source=?",
+        (data_source,),
+    )
+    last_rowid = cur.fetchone()[0]
+    cur.execute(f"SELECT coalesce(max(ROWID), 0) FROM {data_source}")
+    max_rowid = cur.fetchone()[0]
+    # ex: the newest rows were deleted before the watermark's trigger existed.
+    last_rowid = min(last_rowid, max_rowid)
+
+    n_rows = 0
+    while last_rowid < max_rowid:
+        upper_rowid = min(last_rowid + BATCH_SIZE, max_rowid)
+
+        try:
+            for tier, (_, bucket_format) in ROLLUP_TIERS.items():
+                cur.execute(
+                    f"""
+                    INSERT INTO time_series_rollups (data_source, tier, experiment, bucket, series, pioreactor_unit, y_sum, y_min, y_max, y_count)
+                    SELECT
+                        ?,
+                        ?,
+                        experiment,
+                        strftime(?, timestamp) as bucket,
+                        {series_expression} as series,
+                        pioreactor_unit,
+                        sum({column}),
+                        min({column}),
+                        max({column}),
+                        count({column})
+                    FROM {data_source}
+                    WHERE ROWID > ? AND ROWID <= ? AND {column} IS NOT NULL
+                    GROUP BY experiment, bucket, series
+                    ON CONFLICT (data_source, tier, experiment, bucket, series) DO UPDATE SET
+                        y_sum = y_sum + excluded.y_sum,
+                        y_min = min(y_min, excluded.y_min),
+                        y_max = max(y_max, excluded.y_max),
+                        y_count = y_count + excluded.y_count
+                    """,
+                    (data_source, tier, bucket_format, last_rowid, upper_rowid),
+                )
+            cur.execute(
+                """
+                INSERT INTO time_series_rollup_watermarks (data_source, last_rowid) VALUES (?, ?)
+                ON CONFLICT (data_source) DO UPDATE SET last_rowid=excluded.last_rowid
+                """,
+                (data_source, upper_rowid),
+            )
+            con.commit()
+        except Exception as e:
+            con.rollback()
+            raise e
+
+        n_rows += upper_rowid - last_rowid
+        last_rowid = upper_rowid
+
+    return n_rows
+
+
+def update_rollups(con: sqlite3.Connection) -> int:
+    create_rollup_tables(con)
+
+    n_rows = 0
+    for data_source, (column, series_by_channel) in ROLLUP_SOURCES.items():
+        if not table_exists(con, data_source):
+            continue
+        n_rows += update_rollups_for_data_source(con, data_source, column, series_by_channel)
+
+    return n_rows
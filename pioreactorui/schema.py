@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# schema.py
+"""
+The tables and columns of the app db, read once and again only when the schema changes.
+
+Plugins add their own tables (and charts of them), which the fallback time series endpoint serves. Their
+names come from URLs and chart descriptors, so they are checked against the schema here before they are
+formatted into SQL.
+"""
+from __future__ import annotations
+
+import threading
+
+from msgspec import Struct
+
+from . import query_app_db
+
+# columns that a table needs to be served as a time series.
+TIME_SERIES_COLUMNS = {"experiment", "timestamp", "pioreactor_unit"}
+
+
+class TimeSeriesTable(Struct, frozen=True):  # type: ignore
+    data_source: str
+    column: str
+    series_by_channel: bool
+
+
+class SchemaRegistry:
+    """
+    Tables' columns, keyed by the app db's schema_version, which SQLite increments on every schema change
+    (ex: a plugin creating its table, or a migration). Checking it is a read of the db's header.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._schema_version: int | None = None
+        self._tables: dict[str, frozenset[str]] = {}
+
+    def tables(self) -> dict[str, frozenset[str]]:
+        r = query_app_db("PRAGMA schema_version", one=True)
+        assert isinstance(r, dict)
+        schema_version = r["schema_version"]
+
+        with self._lock:
+            if schema_version != self._schema_version:
+                self._tables = self._load()
+                self._schema_version = schema_version
+            return self._tables
+
+    @staticmethod
+    def _load() -> dict[str, frozenset[str]]:
+        rows = query_app_db(
+            """
+            SELECT m.name as table_name, p.name as column_name
+            FROM sqlite_master AS m JOIN pragma_table_xinfo(m.name) AS p
+            -- table_xinfo also has generated columns (hidden 2 and 3), but not virtual tables' hidden columns.
+            WHERE m.type IN ('table', 'view') AND m.name NOT LIKE 'sqlite_%' AND p.hidden != 1
+            """
+        )
+        assert isinstance(rows, list)
+        columns: dict[str, set[str]] = {}
+        for row in rows:
+            columns.setdefault(row["table_name"], set()).add(row["column_name"])
+        return {table: frozenset(names) for table, names in columns.items()}
+
+
+schema_registry = SchemaRegistry()
+
+
+def get_table_columns(table: str) -> frozenset[str]:
+    """The columns of table, empty if there's no such table."""
+    return schema_registry.tables().get(table, frozenset())
+
+
+def get_time_series_table(data_source: str, column: str) -> TimeSeriesTable:
+    """Raises ValueError if data_source isn't a table with the columns of a time series, and column."""
+    columns = get_table_columns(data_source)
+    if not columns:
+        raise ValueError(f"No table {data_source}.")
+    elif column not in columns:
+        raise ValueError(f"Table {data_source} has no column {column}.")
+    elif not TIME_SERIES_COLUMNS <= columns:
+        raise ValueError(
+            f"Table {data_source} isn't a time series, it needs {', '.join(sorted(TIME_SERIES_COLUMNS))}."
+        )
+    return TimeSeriesTable(data_source, column, series_by_channel="channel" in columns)
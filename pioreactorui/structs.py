@@ -87,3 +87,13 @@ class ArgsOptionsEnvs(Struct):
     options: dict[str, t.Any] = {}
     env: dict[str, str] = {}
     args: list[str] = []
+
+
+#### Logs
+
+
+class NewLog(Struct):  # type: ignore
+    pioreactor_unit: str
+    message: str
+    source: t.Optional[str] = None  # default is "user"
+    timestamp: t.Optional[str] = None  # ISO 8601, default is when it's published
@@ -4,6 +4,7 @@ from __future__ import annotations
 import logging
 import os
 import signal
+import sqlite3
 from logging import handlers
 from shlex import join
 from subprocess import check_call as run_and_check_call
@@ -13,6 +14,7 @@ from subprocess import run
 from subprocess import STDOUT
 from typing import Any
 
+from huey import crontab
 from pioreactor.config import config
 from pioreactor.mureq import HTTPException
 from pioreactor.pubsub import delete_from
@@ -20,7 +22,13 @@ from pioreactor.pubsub import get_from
 from pioreactor.pubsub import patch_into
 from pioreactor.pubsub import post_into
 from pioreactor.utils.networking import resolve_to_address
+from pioreactor.whoami import am_I_leader
 
+from . import app_db_context
+from . import charts
+from . import log_archive
+from . import migrations
+from . import rollups
 from .config import cache
 from .config import CACHE_DIR
 from .config import env
@@ -366,3 +374,71 @@ def multicast_delete_across_cluster(
     tasks = delete_worker.map(((worker, endpoint, json) for worker in workers))
 
     return {worker: response for (worker, response) in tasks.get(blocking=True)}
+
+
+@huey.periodic_task(crontab(minute="*"))
+@huey.lock_task("rollups-lock")
+def update_time_series_rollups() -> bool:
+    # only the leader stores time series
+    if not am_I_leader():
+        return False
+
+    con = sqlite3.connect(config.get("storage", "database"), timeout=10.0)
+    try:
+        n_rows = rollups.update_rollups(con)
+    finally:
+        con.close()
+
+    if n_rows > 0:
+        logger.debug(f"Rolled up {n_rows} time series rows.")
+    return True
+
+
+@huey.periodic_task(crontab(minute="30"))
+@huey.lock_task("archive-logs-lock")
+def archive_logs() -> bool:
+    # only the leader stores logs
+    if not am_I_leader():
+        return False
+
+    con = sqlite3.connect(config.get("storage", "database"), timeout=10.0)
+    try:
+        n_rows = log_archive.archive_logs(con)
+    finally:
+        con.close()
+
+    if n_rows > 0:
+        logger.info(f"Archived {n_rows} logs to {log_archive.get_archive_path()}.")
+    return True
+
+
+@huey.task()
+@huey.lock_task("migrations-lock")
+def migrate_app_db() -> bool:
+    # creating indexes on a large database can take a while, hence this runs here and not in the web server.
+    con = sqlite3.connect(config.get("storage", "database"), timeout=10.0)
+    try:
+        result = migrations.migrate(con)
+    finally:
+        con.close()
+
+    logger.info(f"Migrated app database: {result}")
+    return True
+
+
+@huey.periodic_task(crontab(minute="*"))
+@huey.lock_task("materialize-charts-lock")
+def materialize_charts() -> bool:
+    # only the leader stores time series
+    if not am_I_leader():
+        return False
+
+    con = sqlite3.connect(config.get("storage", "database"), timeout=10.0)
+    try:
+        with app_db_context(con):
+            n = charts.materialize_charts()
+    finally:
+        con.close()
+
+    logger.debug(f"Materialized {n} chart time series.")
+    return True
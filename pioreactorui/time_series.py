@@ -0,0 +1,821 @@
+# -*- coding: utf-8 -*-
+# time_series.py
+from __future__ import annotations
+
+import sqlite3
+import typing as t
+from base64 import urlsafe_b64decode
+from base64 import urlsafe_b64encode
+from datetime import datetime
+from functools import lru_cache
+from itertools import groupby
+from itertools import islice
+from math import ceil
+from math import nan
+from operator import itemgetter
+from struct import pack
+from time import time
+
+from msgspec import DecodeError
+from msgspec.json import decode as loads
+from msgspec.json import encode as dumps
+
+from . import iter_app_db
+from . import query_app_db
+from .downsampling import lttb
+from .downsampling import lttb_iter
+from .queries import parse_timestamp
+from .queries import resolve_window
+from .queries import Window
+from .recent_readings import BUFFERED_SOURCES
+from .recent_readings import recent_readings
+from .rollups import BATCH_SIZE as ROLLUP_BATCH_SIZE
+from .rollups import ROLLUP_SOURCES
+from .rollups import ROLLUP_TIERS
+
+# default number of points per series, if the client doesn't ask for a specific amount.
+DEFAULT_TARGET_POINTS = 720
+
+# windows shorter than this are always served from the raw rows.
+ROLLUP_MIN_SPAN_HOURS = 24.0
+
+# number of points encoded per chunk of a streamed response.
+STREAM_CHUNK_POINTS = 500
+
+# most rows returned in one page, see query_time_series_page.
+MAX_PAGE_SIZE = 10_000
+
+# built-in data_source -> (column, decimals, is the series per channel)
+BUILTIN_TIME_SERIES: dict[str, tuple[str, int, bool]] = {
+    "growth_rates": ("rate", 5, False),
+    "temperature_readings": ("temperature_c", 2, False),
+    "od_readings_filtered": ("normalized_od_reading", 7, False),
+    "od_readings": ("od_reading", 7, True),
+}
+
+
+def resolve_target_points(
+    n_points: int, target_points: int | None = None, filter_mod_n: float | None = None
+) -> int:
+    """
+    How many points to keep for a series with n_points.
+
+    `filter_mod_N` is what older clients send: it used to keep ~1/N of the rows, so we translate it
+    to an equivalent target.
+    """
+    if target_points is not None:
+        return max(target_points, 0)
+    elif filter_mod_n is not None and filter_mod_n > 0:
+        return ceil(n_points / filter_mod_n)
+    else:
+        return DEFAULT_TARGET_POINTS
+
+
+def get_cursor(data_source: str) -> int:
+    """The highest ROWID in data_source. O(1), as it's the end of the table's b-tree."""
+    r = query_app_db(f"SELECT max(ROWID) as cursor FROM {data_source}", one=True)
+    assert isinstance(r, dict)
+    return r["cursor"] or 0
+
+
+def get_rollup_watermark(data_source: str) -> int | None:
+    """The last ROWID of data_source that has been rolled up, or None if there are no rollups yet."""
+    try:
+        r = query_app_db(
+            "SELECT last_rowid FROM time_series_rollup_watermarks WHERE data_source=?",
+            (data_source,),
+            one=True,
+        )
+    except sqlite3.OperationalError:
+        # rollup tables haven't been created yet.
+        return None
+    if r is None:
+        return None
+    assert isinstance(r, dict)
+    return r["last_rowid"]
+
+
+def get_validator(data_source: str, lookback: float, target_points: int | None = None) -> str:
+    """
+    A cheap validator (for ETags) of a time series response. It changes when a row is added to data_source,
+    when rollups are updated, or when the window has moved by about a point's width.
+    """
+    cursor = get_cursor(data_source)
+    watermark = get_rollup_watermark(data_source) if data_source in ROLLUP_SOURCES else None
+    width_seconds = max(lookback * 60 * 60 / (target_points or DEFAULT_TARGET_POINTS), 60.0)
+    return f"{data_source}-{cursor}-{watermark}-{int(time() // width_seconds)}"
+
+
+def get_span_hours(experiment: str, window: Window) -> float:
+    """How much data a window can actually cover, since it can't go before the experiment started, or past now."""
+    start, end = window
+    r = query_app_db(
+        """
+        SELECT (
+            julianday(min(?, strftime('%Y-%m-%dT%H:%M:%f', 'now'))) -
+            julianday(max(?, coalesce((SELECT created_at FROM experiments WHERE experiment=?), ?)))
+        ) * 24.0 as span_hours
+        """,
+        (end, start, experiment, start),
+        one=True,
+    )
+    assert isinstance(r, dict)
+    return r["span_hours"] or 0.0
+
+
+def choose_rollup_tier(span_hours: float, target_points: int) -> str | None:
+    """The coarsest rollup tier that still gives at least target_points over the span, or None for raw rows."""
+    if span_hours <= ROLLUP_MIN_SPAN_HOURS or target_points <= 0:
+        return None
+
+    resolution_seconds = span_hours * 60 * 60 / target_points
+    tier = None
+    for name, (width_seconds, _) in sorted(ROLLUP_TIERS.items(), key=lambda item: item[1][0]):
+        if width_seconds <= resolution_seconds:
+            tier = name
+    return tier
+
+
+def series_filter_sql(n_units: int, n_channels: int, channel: str = "channel") -> str:
+    """
+    Conditions (each starting with AND) keeping only the rows of n_units units and n_channels channels,
+    or none if both are 0.
+    Parameters are (*units, *channels).
+    """
+    conditions = []
+    if n_units:
+        conditions.append(f"AND pioreactor_unit IN ({', '.join('?' * n_units)})")
+    if n_channels:
+        conditions.append(f"AND {channel} IN ({', '.join('?' * n_channels)})")
+    return " ".join(conditions)
+
+
+def _raw_rows_where(column: str, incremental: bool, n_units: int, n_channels: int) -> str:
+    rowid_filter = "ROWID > ? AND ROWID <= ?" if incremental else "+ROWID <= ?"
+    return f"""
+        WHERE experiment=? AND
+            {column} IS NOT NULL AND
+            timestamp >= ? AND timestamp < ?
+            {series_filter_sql(n_units, n_channels)} AND
+            {rowid_filter}
+        """
+
+
+def _unit_expression(series_by_channel: bool) -> str:
+    return "pioreactor_unit || '-' || channel" if series_by_channel else "pioreactor_unit"
+
+
+def _raw_rows_args(
+    experiment: str,
+    window: Window,
+    since: int | None,
+    cursor: int,
+    units: tuple[str, ...] = (),
+    channels: tuple[int, ...] = (),
+) -> tuple[t.Any, ...]:
+    if since is not None:
+        return (experiment, *window, *units, *channels, since, cursor)
+    else:
+        return (experiment, *window, *units, *channels, cursor)
+
+
+@lru_cache(maxsize=256)
+def raw_rows_sql(
+    data_source: str,
+    column: str,
+    decimals: int,
+    series_by_channel: bool,
+    incremental: bool,
+    n_units: int = 0,
+    n_channels: int = 0,
+) -> str:
+    """
+    Parameters are (experiment, start, end, *units, *channels, since, cursor) if incremental, else
+    (experiment, start, end, *units, *channels, cursor).
+
+    An incremental query seeks on ROWID. Otherwise, the cursor is only a filter (unary +), so that the
+    (experiment, timestamp) index is used for the window instead. The unit and channel filters are
+    checked on that index's columns, so rows of other units are skipped without reading the table.
+    """
+    return f"""
+        SELECT
+            {_unit_expression(series_by_channel)} as unit,
+            timestamp as x,
+            (julianday(timestamp) - 2440587.5) * 86400.0 as epoch,
+            round({column}, {decimals}) as y
+        FROM {data_source}
+        {_raw_rows_where(column, incremental, n_units, n_channels)}
+        ORDER BY unit, timestamp
+        """
+
+
+@lru_cache(maxsize=256)
+def raw_counts_sql(
+    data_source: str,
+    column: str,
+    series_by_channel: bool,
+    incremental: bool,
+    n_units: int = 0,
+    n_channels: int = 0,
+) -> str:
+    """The number of rows per series of raw_rows_sql. Same parameters."""
+    return f"""
+        SELECT
+            {_unit_expression(series_by_channel)} as unit,
+            count(1) as n
+        FROM {data_source}
+        {_raw_rows_where(column, incremental, n_units, n_channels)}
+        GROUP BY unit
+        """
+
+
+@lru_cache(maxsize=256)
+def latest_rows_sql(data_source: str, series_by_channel: bool) -> str:
+    """
+    The latest timestamp of each series, among rows at or after a timestamp, up to a cursor. Parameters are
+    (experiment, start, cursor). A short range seek when start is recent.
+    """
+    return f"""
+        SELECT
+            {_unit_expression(series_by_channel)} as unit,
+            max(timestamp) as latest
+        FROM {data_source}
+        WHERE experiment=? AND timestamp >= ? AND +ROWID <= ?
+        GROUP BY unit
+        """
+
+
+def _query_raw_rows(
+    data_source: str,
+    column: str,
+    experiment: str,
+    window: Window,
+    decimals: int,
+    series_by_channel: bool,
+    since: int | None,
+    cursor: int,
+    units: tuple[str, ...] = (),
+    channels: tuple[int, ...] = (),
+) -> list[dict[str, t.Any]]:
+    rows = query_app_db(
+        raw_rows_sql(
+            data_source,
+            column,
+            decimals,
+            series_by_channel,
+            since is not None,
+            len(units),
+            len(channels),
+        ),
+        _raw_rows_args(experiment, window, since, cursor, units, channels),
+    )
+    assert isinstance(rows, list)
+    return rows
+
+
+# the channel of a rollup's series, "<unit>-<channel>"
+ROLLUP_CHANNEL = "CAST(substr(series, length(pioreactor_unit) + 2) AS INTEGER)"
+
+
+@lru_cache(maxsize=256)
+def rollup_rows_sql(decimals: int, n_units: int = 0, n_channels: int = 0) -> str:
+    """Parameters are (data_source, tier, experiment, start, end, *units, *channels)."""
+    return f"""
+        SELECT
+            series as unit,
+            bucket as x,
+            (julianday(bucket) - 2440587.5) * 86400.0 as epoch,
+            round(y_sum / y_count, {decimals}) as y
+        FROM time_series_rollups
+        WHERE data_source=? AND tier=? AND experiment=? AND
+            bucket >= ? AND bucket < ?
+            {series_filter_sql(n_units, n_channels, channel=ROLLUP_CHANNEL)}
+        ORDER BY series, bucket
+        """
+
+
+def _query_rollup_rows(
+    data_source: str,
+    tier: str,
+    experiment: str,
+    window: Window,
+    decimals: int,
+    units: tuple[str, ...] = (),
+    channels: tuple[int, ...] = (),
+) -> list[dict[str, t.Any]]:
+    rows = query_app_db(
+        rollup_rows_sql(decimals, len(units), len(channels)),
+        (data_source, tier, experiment, *window, *units, *channels),
+    )
+    assert isinstance(rows, list)
+    return rows
+
+
+# a point is (timestamp, seconds since epoch, value)
+Point = tuple[str, float, float]
+
+
+def _group_rows(rows: list[dict[str, t.Any]]) -> dict[str, list[dict[str, t.Any]]]:
+    grouped: dict[str, list[dict[str, t.Any]]] = {}
+    for row in rows:
+        grouped.setdefault(row["unit"], []).append(row)
+    return grouped
+
+
+def _downsample_series(
+    grouped: dict[str, list[Point]], target_points: int | None, filter_mod_n: float | None
+) -> dict[str, list[t.Any]]:
+    series = sorted(grouped)
+    data: list[list[Point]] = []
+    for unit in series:
+        points = grouped[unit]
+        keep = lttb(
+            [epoch for (_, epoch, _) in points],
+            [y for (_, _, y) in points],
+            resolve_target_points(len(points), target_points, filter_mod_n),
+        )
+        data.append([points[i] for i in keep])
+
+    return {"series": series, "data": data}
+
+
+def _downsample_rows(
+    rows: list[dict[str, t.Any]], target_points: int | None, filter_mod_n: float | None
+) -> dict[str, list[t.Any]]:
+    grouped: dict[str, list[Point]] = {}
+    for row in rows:
+        grouped.setdefault(row["unit"], []).append((row["x"], row["epoch"], row["y"]))
+    return _downsample_series(grouped, target_points, filter_mod_n)
+
+
+def to_json(result: dict[str, t.Any]) -> dict[str, t.Any]:
+    """The JSON shape of a time series: {"series": [...], "data": [[{"x": timestamp, "y": value}, ...], ...], ...}"""
+    return result | {
+        "data": [[{"x": x, "y": y} for (x, _, y) in points] for points in result["data"]]
+    }
+
+
+def to_columnar(result: dict[str, t.Any]) -> dict[str, t.Any]:
+    """
+    The compact shape of a time series, for msgpack:
+
+      {"series": [...], "x": [[epoch ms, ...], ...], "y": [<float32 little-endian bytes>, ...], ...}
+
+    In a browser, each y is read with `new Float32Array(y.buffer, y.byteOffset, y.byteLength / 4)`. Missing
+    values (null in JSON) are NaN.
+    """
+    columnar = {k: v for k, v in result.items() if k != "data"}
+    columnar["x"] = [[round(epoch * 1000) for (_, epoch, _) in points] for points in result["data"]]
+    columnar["y"] = [
+        pack(f"<{len(points)}f", *(nan if y is None else y for (_, _, y) in points))
+        for points in result["data"]
+    ]
+    return columnar
+
+
+def is_recent_window(
+    data_source: str, column: str, experiment: str, window: Window, series_by_channel: bool
+) -> bool:
+    """If the window is entirely in the buffers of recent readings, see recent_readings.py."""
+    if data_source not in BUFFERED_SOURCES:
+        return False
+
+    builtin_column, _, builtin_series_by_channel = BUILTIN_TIME_SERIES[data_source]
+    if (column, series_by_channel) != (builtin_column, builtin_series_by_channel):
+        return False
+
+    covered_since = recent_readings.covered_since(data_source, experiment)
+    if covered_since == float("inf"):
+        return False
+
+    # a window can't have readings before the experiment started.
+    r = query_app_db(
+        "SELECT created_at FROM experiments WHERE experiment=?", (experiment,), one=True
+    )
+    created_at = ""
+    if r is not None:
+        assert isinstance(r, dict)
+        created_at = r["created_at"] or ""
+    start = max(window[0], created_at)
+    return parse_timestamp(start).timestamp() > covered_since
+
+
+def is_in_app_db(
+    data_source: str,
+    experiment: str,
+    grouped: dict[str, list[Point]],
+    series_by_channel: bool,
+    cursor: int,
+) -> bool:
+    """
+    If the app db, up to cursor, has every series' latest buffered reading. mqtt_to_db inserts a series'
+    readings in the order they're published, so then it has all of the buffered readings.
+    """
+    latest_buffered = {series: points[-1][0] for series, points in grouped.items() if points}
+    if not latest_buffered:
+        return True
+
+    rows = query_app_db(
+        latest_rows_sql(data_source, series_by_channel),
+        (experiment, min(latest_buffered.values()), cursor),
+    )
+    assert isinstance(rows, list)
+    latest_in_db = {row["unit"]: row["latest"] for row in rows}
+    return all(
+        latest_in_db.get(series, "") >= timestamp for series, timestamp in latest_buffered.items()
+    )
+
+
+def _filter_series(
+    grouped: dict[str, list[Point]],
+    series_by_channel: bool,
+    units: tuple[str, ...],
+    channels: tuple[int, ...],
+) -> dict[str, list[Point]]:
+    """The series of units and channels, for series keyed like the raw rows' unit ("<unit>" or "<unit>-<channel>")."""
+    if not units and not channels:
+        return grouped
+
+    def keep(series: str) -> bool:
+        unit, _, channel = series.rpartition("-") if series_by_channel else (series, "", "")
+        return (not units or unit in units) and (not channels or int(channel) in channels)
+
+    return {series: points for series, points in grouped.items() if keep(series)}
+
+
+def _choose_source(
+    data_source: str,
+    column: str,
+    experiment: str,
+    window: Window,
+    target_points: int | None,
+    since: int | None,
+    downsample: bool = True,
+) -> tuple[str | None, int]:
+    """Returns (the rollup tier to read, or None for the raw rows, cursor)."""
+    cursor = get_cursor(data_source)
+
+    if since is None and downsample and ROLLUP_SOURCES.get(data_source, (None,))[0] == column:
+        tier = choose_rollup_tier(
+            get_span_hours(experiment, window), target_points or DEFAULT_TARGET_POINTS
+        )
+        watermark = get_rollup_watermark(data_source) if tier else None
+
+        if tier and watermark is not None and cursor - watermark <= ROLLUP_BATCH_SIZE:
+            return tier, watermark
+
+    return None, cursor
+
+
+def query_time_series(
+    data_source: str,
+    column: str,
+    experiment: str,
+    lookback: float,
+    target_points: int | None = None,
+    filter_mod_n: float | None = None,
+    decimals: int = 7,
+    series_by_channel: bool = False,
+    since: int | None = None,
+    downsample: bool = True,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    units: tuple[str, ...] = (),
+    channels: tuple[int, ...] = (),
+) -> dict[str, t.Any]:
+    """
+    Returns {"series": [...], "data": [[(timestamp, epoch, value), ...], ...], "cursor": int}, with each
+    series downsampled with LTTB. Use to_json or to_columnar to serialize it. data_source and column must
+    already be scrubbed.
+
+    The cursor is the highest ROWID of data_source that the response covers. Passing it back as `since`
+    returns only rows inserted after it, which is a seek on the ROWID instead of a scan of the window.
+
+    Long windows of the built-in time series are read from the per-minute or per-hour rollups (see rollups.py),
+    when they are up to date. Then the cursor is the rollups' watermark, and each point is a bucket's mean.
+
+    The window is the last `lookback` hours, or [start, end) if start is given.
+    With downsample=False, every raw row in the window is returned. If units or channels are given, only
+    their series are returned (channels require series_by_channel).
+
+    Recent windows are read from the buffers of readings received over MQTT, when they cover the window (see
+    recent_readings.py), and the app db has caught up with them, see is_in_app_db.
+    """
+    if not downsample:
+        target_points, filter_mod_n = None, 1
+
+    window = resolve_window(lookback, start, end)
+    tier, cursor = _choose_source(
+        data_source, column, experiment, window, target_points, since, downsample
+    )
+
+    if tier is not None:
+        rows = _query_rollup_rows(data_source, tier, experiment, window, decimals, units, channels)
+        # filter_mod_N is relative to raw rows, so it doesn't apply to buckets.
+        return _downsample_rows(rows, target_points, None) | {"cursor": cursor}
+
+    if since is None and is_recent_window(
+        data_source, column, experiment, window, series_by_channel
+    ):
+        grouped = _filter_series(
+            recent_readings.window(data_source, experiment, *window, decimals),
+            series_by_channel,
+            units,
+            channels,
+        )
+        # else the buffers are ahead of the cursor, and `since` would return their readings again.
+        if is_in_app_db(data_source, experiment, grouped, series_by_channel, cursor):
+            return _downsample_series(grouped, target_points, filter_mod_n) | {"cursor": cursor}
+
+    rows = _query_raw_rows(
+        data_source,
+        column,
+        experiment,
+        window,
+        decimals,
+        series_by_channel,
+        since,
+        cursor,
+        units,
+        channels,
+    )
+    return _downsample_rows(rows, target_points, filter_mod_n) | {"cursor": cursor}
+
+
+def _chunks(iterable: t.Iterable[Point], size: int) -> t.Iterator[list[Point]]:
+    it = iter(iterable)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def stream_time_series(
+    data_source: str,
+    column: str,
+    experiment: str,
+    lookback: float,
+    target_points: int | None = None,
+    filter_mod_n: float | None = None,
+    decimals: int = 7,
+    series_by_channel: bool = False,
+    since: int | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    units: tuple[str, ...] = (),
+    channels: tuple[int, ...] = (),
+) -> t.Iterator[bytes]:
+    """
+    The same JSON as to_json(query_time_series(...)), encoded in chunks. Raw rows are read from the cursor in
+    batches and downsampled one series at a time with lttb_iter, so memory doesn't grow with the lookback.
+
+    The queries are planned and the series counted before returning, so errors are raised here rather
+    than in the middle of the response. Consume the iterator within the app context.
+    """
+    window = resolve_window(lookback, start, end)
+    tier, cursor = _choose_source(data_source, column, experiment, window, target_points, since)
+
+    if tier is not None:
+        # there are few buckets, no need to stream them.
+        rows = _query_rollup_rows(data_source, tier, experiment, window, decimals, units, channels)
+        return iter(
+            [dumps(to_json(_downsample_rows(rows, target_points, None) | {"cursor": cursor}))]
+        )
+
+    incremental, n_units, n_channels = since is not None, len(units), len(channels)
+    args = _raw_rows_args(experiment, window, since, cursor, units, channels)
+    counts_rows = query_app_db(
+        raw_counts_sql(data_source, column, series_by_channel, incremental, n_units, n_channels),
+        args,
+    )
+    assert isinstance(counts_rows, list)
+    counts = {row["unit"]: row["n"] for row in counts_rows}
+    raw_rows = iter_app_db(
+        raw_rows_sql(
+            data_source, column, decimals, series_by_channel, incremental, n_units, n_channels
+        ),
+        args,
+    )
+
+    def generate() -> t.Iterator[bytes]:
+        series = sorted(counts)
+        yield b'{"series":' + dumps(series) + b',"cursor":' + dumps(cursor) + b',"data":['
+
+        groups = groupby(raw_rows, key=itemgetter("unit"))
+        group = next(groups, None)
+        for i, unit in enumerate(series):
+            yield b"[" if i == 0 else b",["
+
+            # rows past the lookback since counting are no longer returned, so a series can be empty.
+            if group is not None and group[0] == unit:
+                points = ((row["x"], row["epoch"], row["y"]) for row in group[1])
+                kept = lttb_iter(
+                    points,
+                    counts[unit],
+                    resolve_target_points(counts[unit], target_points, filter_mod_n),
+                    xy=lambda p: (p[1], p[2]),
+                )
+                for j, chunk in enumerate(_chunks(kept, STREAM_CHUNK_POINTS)):
+                    encoded = dumps([{"x": x, "y": y} for (x, _, y) in chunk])[1:-1]
+                    yield encoded if j == 0 else b"," + encoded
+                group = next(groups, None)
+
+            yield b"]"
+        yield b"]}"
+
+    return generate()
+
+
+@lru_cache(maxsize=256)
+def page_rows_sql(
+    data_source: str,
+    column: str,
+    decimals: int,
+    series_by_channel: bool,
+    n_units: int = 0,
+    n_channels: int = 0,
+) -> str:
+    """
+    Keyset pagination on (timestamp, ROWID), which is unique, so rows are neither skipped nor repeated
+    even if many have the same timestamp. Parameters are
+    (experiment, start, end, *units, *channels, after timestamp, after rowid, page size).
+    """
+    return f"""
+        SELECT
+            {_unit_expression(series_by_channel)} as unit,
+            timestamp as x,
+            (julianday(timestamp) - 2440587.5) * 86400.0 as epoch,
+            round({column}, {decimals}) as y,
+            ROWID as rowid
+        FROM {data_source}
+        WHERE experiment=? AND
+            {column} IS NOT NULL AND
+            timestamp >= ? AND timestamp < ?
+            {series_filter_sql(n_units, n_channels)} AND
+            (timestamp, ROWID) > (?, ?)
+        ORDER BY timestamp, ROWID
+        LIMIT ?
+        """
+
+
+def encode_page_token(timestamp: str, rowid: int) -> str:
+    return urlsafe_b64encode(dumps((timestamp, rowid))).decode()
+
+
+def decode_page_token(token: str) -> tuple[str, int]:
+    try:
+        timestamp, rowid = loads(urlsafe_b64decode(token.encode()), type=tuple[str, int])
+    except (DecodeError, ValueError) as e:
+        raise ValueError(f"Invalid page token {token}") from e
+    # msgspec validated the types, mypy doesn't know.
+    return t.cast(str, timestamp), t.cast(int, rowid)
+
+
+def query_time_series_page(
+    data_source: str,
+    column: str,
+    experiment: str,
+    lookback: float,
+    page_size: int = MAX_PAGE_SIZE,
+    after: str | None = None,
+    decimals: int = 7,
+    series_by_channel: bool = False,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    units: tuple[str, ...] = (),
+    channels: tuple[int, ...] = (),
+) -> dict[str, t.Any]:
+    """
+    A page of the raw rows (no downsampling) in the window, in the shape of query_time_series but with
+    "next" instead of "cursor". Pass "next" back as `after` for the following page, it's None on the last page.
+    """
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+    window_start, window_end = resolve_window(lookback, start, end)
+    after_timestamp, after_rowid = decode_page_token(after) if after else ("", 0)
+
+    rows = query_app_db(
+        page_rows_sql(data_source, column, decimals, series_by_channel, len(units), len(channels)),
+        # the explicit bound on timestamp lets the index seek to the page.
+        (
+            experiment,
+            max(window_start, after_timestamp),
+            window_end,
+            *units,
+            *channels,
+            after_timestamp,
+            after_rowid,
+            page_size,
+        ),
+    )
+    assert isinstance(rows, list)
+
+    grouped = _group_rows(rows)
+    series = sorted(grouped)
+    return {
+        "series": series,
+        "data": [[(p["x"], p["epoch"], p["y"]) for p in grouped[unit]] for unit in series],
+        "next": (
+            encode_page_token(rows[-1]["x"], rows[-1]["rowid"]) if len(rows) == page_size else None
+        ),
+    }
+
+
+# most experiments overlaid in one response.
+MAX_OVERLAY_EXPERIMENTS = 100
+
+
+@lru_cache(maxsize=256)
+def overlay_rows_sql(
+    data_source: str,
+    column: str,
+    decimals: int,
+    series_by_channel: bool,
+    n_experiments: int,
+    bounded: bool,
+    n_units: int = 0,
+    n_channels: int = 0,
+) -> str:
+    """
+    Rows of many experiments, with x in hours since their experiment's created_at. Parameters are
+    (*experiments, hours, *units, *channels) if bounded (only the first `hours` of each experiment), else
+    (*experiments, *units, *channels).
+
+    For each experiment, its window is a range seek on the (experiment, timestamp) index.
+    """
+    hours_filter = (
+        "AND d.timestamp < strftime('%Y-%m-%dT%H:%M:%f', julianday(e.created_at) + ? / 24.0)"
+        if bounded
+        else ""
+    )
+    return f"""
+        SELECT
+            d.experiment as experiment,
+            {_unit_expression(series_by_channel)} as unit,
+            round((julianday(d.timestamp) - julianday(e.created_at)) * 24.0, 6) as x,
+            round(d.{column}, {decimals}) as y
+        -- CROSS JOIN keeps experiments as the outer loop.
+        FROM experiments AS e
+        CROSS JOIN {data_source} AS d ON d.experiment = e.experiment
+        WHERE e.experiment IN ({", ".join("?" * n_experiments)}) AND
+            d.{column} IS NOT NULL AND
+            d.timestamp >= e.created_at
+            {hours_filter}
+            {series_filter_sql(n_units, n_channels)}
+        ORDER BY d.experiment, unit, d.timestamp
+        """
+
+
+def query_overlay(
+    data_source: str,
+    column: str,
+    experiments: tuple[str, ...],
+    hours: float | None = None,
+    target_points: int | None = None,
+    decimals: int = 7,
+    series_by_channel: bool = False,
+    units: tuple[str, ...] = (),
+    channels: tuple[int, ...] = (),
+) -> dict[str, t.Any]:
+    """
+    The series of many experiments, aligned to the time since each experiment started, for comparing runs.
+    Returns {"experiments": [...], "series": [...], "data": [[(hours since start, value), ...], ...]}, where
+    experiments[i] and series[i] (the unit) name data[i].
+
+    Each series is downsampled with LTTB to the same number of points per hour: target_points over the
+    longest series, fewer over shorter ones.
+    """
+    if not 0 < len(experiments) <= MAX_OVERLAY_EXPERIMENTS:
+        raise ValueError(f"Between 1 and {MAX_OVERLAY_EXPERIMENTS} experiments can be overlaid.")
+
+    rows = query_app_db(
+        overlay_rows_sql(
+            data_source,
+            column,
+            decimals,
+            series_by_channel,
+            len(experiments),
+            hours is not None,
+            len(units),
+            len(channels),
+        ),
+        (*experiments, *((hours,) if hours is not None else ()), *units, *channels),
+    )
+    assert isinstance(rows, list)
+
+    grouped: dict[tuple[str, str], list[tuple[float, float]]] = {}
+    for row in rows:
+        grouped.setdefault((row["experiment"], row["unit"]), []).append((row["x"], row["y"]))
+
+    longest = max((points[-1][0] for points in grouped.values()), default=0.0)
+    target_points = target_points or DEFAULT_TARGET_POINTS
+    keys = sorted(grouped)
+    data = []
+    for key in keys:
+        points = grouped[key]
+        n_points = ceil(target_points * points[-1][0] / longest) if longest > 0 else target_points
+        keep = lttb([x for (x, _) in points], [y for (_, y) in points], max(n_points, 2))
+        data.append([points[i] for i in keep])
+
+    return {
+        "experiments": [experiment for (experiment, _) in keys],
+        "series": [unit for (_, unit) in keys],
+        "data": data,
+    }
@@ -3,9 +3,15 @@
 from __future__ import annotations
 
 import re
+import sqlite3
+import typing as t
+from itertools import islice
 
 from flask import jsonify
+from flask import request
+from flask import Response
 from flask.typing import ResponseReturnValue
+from msgspec.json import encode as dumps
 from pioreactor.whoami import get_unit_name
 
 
@@ -22,6 +28,23 @@ def create_task_response(task) -> ResponseReturnValue:
     )
 
 
+def is_cached_by_client(etag: str) -> bool:
+    return request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag: str) -> Response:
+    response = Response(status=304, headers={"Cache-Control": "no-cache"})
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def set_etag(response: Response, etag: str) -> Response:
+    # no-cache: clients can keep the response, but must revalidate it (with If-None-Match) before using it.
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
 def scrub_to_valid(value: str) -> str:
     if value is None:
         raise ValueError()
@@ -36,3 +59,22 @@ def is_valid_unix_filename(filename: str) -> bool:
         and "/" not in filename
         and "\0" not in filename
     )
+
+
+def plain_cursor(con: sqlite3.Connection) -> sqlite3.Cursor:
+    # the app's connections return dicts, this returns tuples.
+    cur = con.cursor()
+    cur.row_factory = None
+    return cur
+
+
+def json_array_chunks(items: t.Iterable[t.Any], batch_size: int = 500) -> t.Iterator[bytes]:
+    """Encodes items as a JSON array, batch_size items per chunk, for streamed responses."""
+    it = iter(items)
+    yield b"["
+    first = True
+    while batch := list(islice(it, batch_size)):
+        encoded = dumps(batch)[1:-1]
+        yield encoded if first else b"," + encoded
+        first = False
+    yield b"]"
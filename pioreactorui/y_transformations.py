@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# y_transformations.py
+"""
+Server side evaluation of charts' y_transformation, ex: "(y) => 24 * y", so clients get final values.
+
+A y_transformation is a JavaScript arrow function. We accept the arithmetic subset of it that charts use:
+numbers, y, + - * / % **, parentheses, and Math functions and constants (Math.log, Math.pow, Math.PI, ...).
+The expression is checked against that subset, compiled once to a Python function, and applied to each
+value of a series.
+"""
+from __future__ import annotations
+
+import ast
+import math
+import re
+import typing as t
+from functools import lru_cache
+
+# ex: "(y) => 24 * y", "y => y + 1", "(y) => { return 24 * y }"
+ARROW_FUNCTION_PATTERN = re.compile(
+    r"^\s*\(?\s*([A-Za-z_]\w*)\s*\)?\s*=>\s*(?:\{\s*return\s+(.+?);?\s*\}|(.+?))\s*$", re.DOTALL
+)
+
+MATH_FUNCTIONS: dict[str, t.Callable[..., float]] = {
+    "abs": abs,
+    "ceil": math.ceil,
+    "exp": math.exp,
+    "floor": math.floor,
+    "log": math.log,
+    "log10": math.log10,
+    "log2": math.log2,
+    "max": max,
+    "min": min,
+    "pow": math.pow,
+    "round": lambda x: math.floor(x + 0.5),  # JavaScript rounds halves up
+    "sqrt": math.sqrt,
+}
+
+MATH_CONSTANTS: dict[str, float] = {
+    "E": math.e,
+    "LN2": math.log(2),
+    "LN10": math.log(10),
+    "PI": math.pi,
+}
+
+BINARY_OPERATORS: dict[type, t.Callable[[float, float], float]] = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+    ast.Mod: math.fmod,  # JavaScript's % keeps the sign of the dividend
+    ast.Pow: math.pow,
+}
+
+UNARY_OPERATORS: dict[type, t.Callable[[float], float]] = {
+    ast.USub: lambda a: -a,
+    ast.UAdd: lambda a: +a,
+}
+
+Transformation = t.Callable[[float], float]
+
+# y_transformations are short, this bounds the work of parsing untrusted ones.
+MAX_SOURCE_LENGTH = 500
+
+
+def _compile_node(node: ast.AST, variable: str) -> Transformation:
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        value = float(node.value)
+        return lambda y: value
+
+    elif isinstance(node, ast.Name) and node.id == variable:
+        return lambda y: y
+
+    elif isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        op = BINARY_OPERATORS[type(node.op)]
+        left, right = _compile_node(node.left, variable), _compile_node(node.right, variable)
+        return lambda y: op(left(y), right(y))
+
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        unary_op = UNARY_OPERATORS[type(node.op)]
+        operand = _compile_node(node.operand, variable)
+        return lambda y: unary_op(operand(y))
+
+    elif _is_math_attribute(node) and node.attr in MATH_CONSTANTS:  # type: ignore
+        constant = MATH_CONSTANTS[node.attr]  # type: ignore
+        return lambda y: constant
+
+    elif (
+        isinstance(node, ast.Call)
+        and _is_math_attribute(node.func)
+        and node.func.attr in MATH_FUNCTIONS  # type: ignore
+        and not node.keywords
+    ):
+        function = MATH_FUNCTIONS[node.func.attr]  # type: ignore
+        args = [_compile_node(arg, variable) for arg in node.args]
+        return lambda y: function(*(arg(y) for arg in args))
+
+    raise ValueError(f"Unsupported expression in y_transformation: {ast.unparse(node)}")
+
+
+def _is_math_attribute(node: ast.AST) -> bool:
+    return (
+        isinstance(node, ast.Attribute)
+        and isinstance(node.value, ast.Name)
+        and node.value.id == "Math"
+    )
+
+
+@lru_cache(maxsize=128)
+def compile_y_transformation(source: str) -> Transformation:
+    """Compiles a y_transformation, ex: "(y) => 24 * y". Raises ValueError if it's not in the supported subset."""
+    if len(source) > MAX_SOURCE_LENGTH:
+        raise ValueError(f"y_transformation is longer than {MAX_SOURCE_LENGTH} characters.")
+
+    match = ARROW_FUNCTION_PATTERN.match(source)
+    if match is None:
+        raise ValueError(f"y_transformation isn't an arrow function: {source}")
+
+    variable, body = match.group(1), match.group(2) or match.group(3)
+    try:
+        expression = ast.parse(body.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Unable to parse y_transformation: {source}") from e
+
+    return _compile_node(expression.body, variable)
+
+
+def _apply(transformation: Transformation, y: float, decimals: int) -> float | None:
+    try:
+        value = transformation(y)
+    except (ArithmeticError, ValueError, TypeError):
+        # ex: log of 0. Like the NaN and Infinity of JavaScript, which charts don't draw.
+        return None
+    return round(value, decimals) if math.isfinite(value) else None
+
+
+def transform_result(
+    result: dict[str, t.Any], transformation: Transformation, decimals: int
+) -> dict[str, t.Any]:
+    """A query_time_series result, with transformation applied to its values."""
+    return result | {
+        "data": [
+            [(x, epoch, _apply(transformation, y, decimals)) for (x, epoch, y) in points]
+            for points in result["data"]
+        ]
+    }
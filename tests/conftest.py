@@ -15,6 +15,8 @@ from pioreactor.mureq import Response
 
 from pioreactorui import _make_dicts
 from pioreactorui import create_app
+from pioreactorui.chart_cache import chart_cache
+from pioreactorui.config import cache
 
 
 @pytest.fixture()
@@ -42,6 +44,10 @@ def app():
 
             db.commit()
 
+        # each test has its own database, so cached charts from another test are stale.
+        chart_cache.clear()
+        cache.evict("materialized_time_series")
+
         yield app
 
 
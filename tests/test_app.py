@@ -2,11 +2,21 @@
 from __future__ import annotations
 
 import os
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from unittest.mock import patch
 
 import pytest
+from pioreactor.utils.timing import current_utc_datetime
+from pioreactor.utils.timing import to_iso_format
 
 from .conftest import capture_requests
+from pioreactorui.chart_cache import chart_cache
+from pioreactorui.charts import get_active_experiments
+from pioreactorui.charts import materialize_charts
 from pioreactorui.config import huey
+from pioreactorui.recent_readings import recent_readings
 
 IN_GITHUB_ACTIONS = os.getenv("GITHUB_ACTIONS") == "true"
 
@@ -161,6 +171,27 @@ def test_get_logs_for_unit_and_experiment(client):
     assert log["task"] == "mixing_task"
 
 
+def test_logs_window_is_computed_in_python(client):
+    # the windows are cutoffs computed from current_utc_datetime, so they can be moved to the example data.
+    now = datetime(2023, 10, 1, 20, 0, tzinfo=timezone.utc)
+    with patch("pioreactorui.queries.current_utc_datetime", return_value=now):
+        response = client.get("/api/experiments/exp1/logs")
+        assert [log["message"] for log in response.get_json()] == [
+            "OD reading taken",
+            "Started mixing",
+        ]
+
+        response = client.get("/api/workers/unit1/experiments/exp1/logs")
+        assert [log["message"] for log in response.get_json()] == ["Started mixing"]
+
+        response = client.get("/api/workers/unit1/experiments/exp1/logs?min_level=WARNING")
+        assert response.get_json() == []
+
+    with patch("pioreactorui.queries.current_utc_datetime", return_value=now + timedelta(hours=24)):
+        response = client.get("/api/workers/unit1/experiments/exp1/logs")
+        assert response.get_json() == []
+
+
 @pytest.mark.xfail(reason="need to mock datetime")
 def test_get_growth_rates(client):
     response = client.get("/api/experiments/exp1/time_series/growth_rates")
@@ -172,6 +203,679 @@ def test_get_growth_rates(client):
     assert 0.025 in rates
 
 
+def test_get_growth_rates_since_cursor(client):
+    response = client.get("/api/experiments/exp1/time_series/growth_rates?lookback=100000")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["series"] == ["unit1", "unit2"]
+    assert data["cursor"] > 0
+
+    # nothing new since the last cursor
+    response = client.get(
+        f"/api/experiments/exp1/time_series/growth_rates?lookback=100000&since={data['cursor']}"
+    )
+    assert response.status_code == 200
+    incremental = response.get_json()
+    assert incremental["series"] == []
+    assert incremental["cursor"] == data["cursor"]
+
+
+def test_get_od_readings_streamed_is_same_as_buffered(client):
+    buffered = client.get("/api/experiments/exp1/time_series/od_readings?lookback=100000&stream=0")
+    streamed = client.get("/api/experiments/exp1/time_series/od_readings?lookback=100000&stream=1")
+    assert streamed.status_code == 200
+    # chunked, so the length isn't known up front
+    assert buffered.headers.get("Content-Length") is not None
+    assert streamed.headers.get("Content-Length") is None
+    assert streamed.get_json() == buffered.get_json()
+
+
+def test_get_growth_rates_in_absolute_window_and_pages(client):
+    url = "/api/experiments/exp1/time_series/growth_rates?start=2023-10-01T13:04:00Z&end=2023-10-02"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert [[p["x"] for p in d] for d in response.get_json()["data"]] == [
+        ["2023-10-01T13:05:00Z"],
+        ["2023-10-01T13:05:00Z"],
+    ]
+
+    url = "/api/experiments/exp1/time_series/growth_rates?start=2023-10-01&page_size=3"
+    first = client.get(url).get_json()
+    assert sum(len(d) for d in first["data"]) == 3
+    assert first["next"] is not None
+
+    second = client.get(f"{url}&after={first['next']}").get_json()
+    assert sum(len(d) for d in second["data"]) == 1
+    assert second["next"] is None
+
+
+def test_get_growth_rates_as_columnar_msgpack(client):
+    from struct import unpack
+
+    from msgspec.msgpack import decode
+
+    response = client.get(
+        "/api/experiments/exp1/time_series/growth_rates?lookback=100000",
+        headers={"Accept": "application/x-msgpack"},
+    )
+    assert response.status_code == 200
+    assert response.content_type == "application/x-msgpack"
+
+    data = decode(response.data)
+    assert data["series"] == ["unit1", "unit2"]
+    # 2023-10-01T13:00:00Z and 2023-10-01T13:05:00Z, as epoch ms
+    assert data["x"][0] == [1696165200000, 1696165500000]
+    assert unpack("<2f", data["y"][0]) == pytest.approx((0.01, 0.02))
+
+    # json is still the default
+    response = client.get("/api/experiments/exp1/time_series/growth_rates?lookback=100000")
+    assert response.content_type == "application/json"
+    assert response.get_json()["data"][0][0] == {"x": "2023-10-01T13:00:00Z", "y": 0.01}
+
+
+def test_time_series_rollups_are_incremental(app):
+    from flask import g
+    from pioreactorui.rollups import update_rollups
+
+    db = g._app_database
+    assert update_rollups(db) > 0
+    assert update_rollups(db) == 0  # nothing new
+
+    bucket = db.execute(
+        """
+        SELECT bucket, y_sum / y_count as mean, y_min, y_max, y_count
+        FROM time_series_rollups
+        WHERE data_source='growth_rates' AND tier='hour' AND series='unit1'
+        """
+    ).fetchall()
+    assert len(bucket) == 1
+    assert bucket[0]["bucket"] == "2023-10-01T13:00:00.000Z"
+    assert bucket[0]["mean"] == pytest.approx(0.015)
+    assert bucket[0]["y_min"] == 0.01
+    assert bucket[0]["y_max"] == 0.02
+    assert bucket[0]["y_count"] == 2
+
+    # new rows are merged into the existing bucket
+    db.execute(
+        "INSERT INTO growth_rates (experiment, pioreactor_unit, timestamp, rate) VALUES ('exp1', 'unit1', '2023-10-01T13:10:00Z', 0.03)"
+    )
+    db.commit()
+    assert update_rollups(db) == 1
+
+    bucket = db.execute(
+        """
+        SELECT y_sum / y_count as mean, y_max, y_count
+        FROM time_series_rollups
+        WHERE data_source='growth_rates' AND tier='hour' AND series='unit1'
+        """
+    ).fetchall()
+    assert bucket[0]["mean"] == pytest.approx(0.02)
+    assert bucket[0]["y_max"] == 0.03
+    assert bucket[0]["y_count"] == 3
+
+
+def test_time_series_rollups_after_the_newest_rows_are_deleted(app):
+    from flask import g
+    from pioreactorui.rollups import update_rollups
+
+    db = g._app_database
+    assert update_rollups(db) > 0
+
+    # ex: an experiment is deleted, with its readings, which were the newest
+    db.execute("DELETE FROM growth_rates WHERE experiment='exp1'")
+    db.execute("DELETE FROM time_series_rollups WHERE experiment='exp1'")
+    db.commit()
+
+    # so new rows reuse their ROWIDs
+    db.executemany(
+        "INSERT INTO growth_rates (experiment, pioreactor_unit, timestamp, rate) VALUES ('exp2', 'unit3', ?, 0.1)",
+        [("2023-10-02T16:00:00Z",), ("2023-10-02T16:05:00Z",)],
+    )
+    db.commit()
+    assert update_rollups(db) == 2
+
+    bucket = db.execute(
+        """
+        SELECT y_count FROM time_series_rollups
+        WHERE data_source='growth_rates' AND tier='hour' AND experiment='exp2'
+        """
+    ).fetchall()
+    assert [row["y_count"] for row in bucket] == [2]
+
+
+def test_migrations_create_indexes_and_record_plans(app):
+    from flask import g
+    from pioreactorui import migrations
+
+    db = g._app_database
+    result = migrations.migrate(db)
+    assert "od_readings_experiment_timestamp_ix" in result["created_indexes"]
+    assert migrations.get_index_columns(db, "od_readings_experiment_timestamp_ix") == (
+        "experiment",
+        "timestamp",
+        "pioreactor_unit",
+        "channel",
+        "od_reading",
+    )
+
+    # idempotent
+    assert migrations.migrate(db)["created_indexes"] == []
+
+    plans = db.execute("SELECT name, plan, has_full_scan FROM query_plans").fetchall()
+    plans_by_name = {p["name"]: p for p in plans}
+    assert plans_by_name["time_series_od_readings"]["has_full_scan"] == 0
+    assert "od_readings_experiment_timestamp_ix" in plans_by_name["time_series_od_readings"]["plan"]
+
+
+def test_migrations_dont_warn_about_scans_of_lookup_and_small_tables(app):
+    from flask import g
+    from pioreactorui import migrations
+
+    db = g._app_database
+    # on a small db, the logs queries scan logs, and the overlay queries scan experiments
+    assert migrations.migrate(db)["full_scans"] == []
+
+    plans = db.execute("SELECT name, has_full_scan FROM query_plans").fetchall()
+    plans_by_name = {p["name"]: p for p in plans}
+    assert plans_by_name["time_series_od_readings_overlay"]["has_full_scan"] == 0
+
+    assert migrations.get_scanned_tables(
+        "SELECT * FROM logs AS l JOIN experiments e ON e.experiment = l.experiment",
+        ["SCAN l", "SCAN e"],
+    ) == ["logs"]
+
+
+def test_time_series_and_logs_are_not_modified_until_new_rows(client, app):
+    from flask import g
+
+    etags = {}
+    for url in ["/api/experiments/exp1/time_series/growth_rates", "/api/experiments/exp1/logs"]:
+        response = client.get(url)
+        assert response.status_code == 200
+        etags[url] = response.headers["ETag"]
+
+        response = client.get(url, headers={"If-None-Match": etags[url]})
+        assert response.status_code == 304
+        assert response.data == b""
+
+    g._app_database.execute(
+        "INSERT INTO growth_rates (experiment, pioreactor_unit, timestamp, rate) VALUES ('exp1', 'unit1', '2023-10-01T13:10:00.000Z', 0.5)"
+    )
+    g._app_database.commit()
+    url = "/api/experiments/exp1/time_series/growth_rates"
+    response = client.get(url, headers={"If-None-Match": etags[url]})
+    assert response.status_code == 200
+
+    # logs of other experiments don't change exp1's logs
+    url = "/api/experiments/exp1/logs"
+    for experiment, status_code in [("exp2", 304), ("$experiment", 200)]:
+        g._app_database.execute(
+            "INSERT INTO logs (experiment, pioreactor_unit, timestamp, message, source, level, task) VALUES (?, 'unit1', '2023-10-01T13:10:00.000Z', 'hi', 'app', 'INFO', 'task')",
+            (experiment,),
+        )
+        g._app_database.commit()
+        assert client.get(url, headers={"If-None-Match": etags[url]}).status_code == status_code
+
+
+def test_get_many_charts_in_one_request(client):
+    # the built-in charts are in contrib/charts of this repo
+    with patch.dict("pioreactorui.charts.env", {"WWW": "."}):
+        response = client.get(
+            "/api/experiments/exp1/charts?chart_key=implied_growth_rate,fraction_of_volume_that_is_alternative_media"
+        )
+        assert response.status_code == 200
+        charts = response.get_json()["charts"]
+        assert set(charts) == {
+            "implied_growth_rate",
+            "fraction_of_volume_that_is_alternative_media",
+        }
+        assert charts["implied_growth_rate"]["series"] == ["unit1", "unit2"]
+
+        # default is the charts enabled in [ui.overview.charts]
+        response = client.get("/api/experiments/exp1/charts")
+        assert response.status_code == 200
+        assert "implied_daily_growth_rate" not in response.get_json()["charts"]
+
+        assert client.get("/api/experiments/exp1/charts?chart_key=not_a_chart").status_code == 404
+
+
+def test_charts_default_time_series_are_materialized(client):
+    from flask import g
+
+    with patch.dict("pioreactorui.charts.env", {"WWW": "."}):
+        assert "exp1" in get_active_experiments()
+        assert materialize_charts() > 0
+
+        url = "/api/experiments/exp1/time_series/growth_rates?lookback=100000"
+        materialized = client.get(url)
+        assert materialized.get_json()["series"] == ["unit1", "unit2"]
+
+        g._app_database.execute(
+            "INSERT INTO growth_rates (experiment, pioreactor_unit, timestamp, rate) VALUES ('exp1', 'unit3', '2023-10-01T13:10:00.000Z', 0.5)"
+        )
+        g._app_database.commit()
+
+        # served as materialized until the next run, also with the UI's filter_mod_N
+        assert client.get(url).get_json() == materialized.get_json()
+        assert client.get(url + "&filter_mod_N=37").get_json() == materialized.get_json()
+        assert client.get("/api/experiments/exp1/charts").status_code == 200
+
+        # the chart is downsampled, so its raw time series isn't materialized
+        response = client.get(url + "&filter_mod_N=1")
+        assert response.get_json()["series"] == ["unit1", "unit2", "unit3"]
+
+        # other parameters are queried
+        response = client.get(url + "&target_points=100")
+        assert response.get_json()["series"] == ["unit1", "unit2", "unit3"]
+
+        assert materialize_charts() > 0
+        assert client.get(url).get_json()["series"] == ["unit1", "unit2", "unit3"]
+
+        # nothing new
+        assert materialize_charts() == 0
+
+
+def test_stream_new_rows_as_server_sent_events(client):
+    from pioreactorui.live_updates import BUSY_RECONNECT_MILLISECONDS
+    from pioreactorui.live_updates import Slots
+
+    # one round of new rows, then the stream is closed
+    with patch("pioreactorui.live_updates.MAX_STREAM_SECONDS", 0.0):
+        response = client.get("/api/experiments/exp1/stream")
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+        # starts from now
+        assert b"event:" not in response.data
+
+        response = client.get(
+            "/api/experiments/exp1/stream", headers={"Last-Event-ID": "0-0-0-0-0"}
+        )
+        events = [
+            dict(line.split(": ", 1) for line in block.split("\n"))
+            for block in response.data.decode().strip().split("\n\n")
+            if block.startswith("id:")
+        ]
+        assert [e["event"] for e in events] == ["od_readings", "growth_rates", "logs"]
+        assert events[-1]["id"] == "6-0-4-0-3"
+
+        # resume after the last event
+        response = client.get(
+            "/api/experiments/exp1/stream", headers={"Last-Event-ID": events[-1]["id"]}
+        )
+        assert b"event:" not in response.data
+
+        assert client.get("/api/experiments/exp1/stream?last_event_id=1-2").status_code == 400
+
+        # all slots taken: EventSource is told to come back later
+        with patch("pioreactorui.live_updates.stream_slots", Slots(0)):
+            response = client.get(
+                "/api/experiments/exp1/stream", headers={"Last-Event-ID": "0-0-0-0-0"}
+            )
+            assert response.status_code == 200
+            assert response.data == b"retry: %d\n\n" % BUSY_RECONNECT_MILLISECONDS
+
+
+def test_tail_logs_waits_for_new_logs(client):
+    from flask import g
+    from pioreactorui.live_updates import logs_notifier
+    from pioreactorui.live_updates import Slots
+
+    response = client.get("/api/experiments/exp1/logs/tail?after=0&timeout=0")
+    assert response.status_code == 200
+    tail = response.get_json()
+    assert [log["message"] for log in tail["logs"]] == ["Started mixing", "OD reading taken"]
+
+    response = client.get("/api/workers/unit1/experiments/exp1/logs/tail?after=0&timeout=0")
+    assert [log["message"] for log in response.get_json()["logs"]] == ["Started mixing"]
+
+    # nothing new
+    response = client.get(f"/api/experiments/exp1/logs/tail?after={tail['after']}&timeout=0")
+    assert response.get_json() == {"logs": [], "after": tail["after"]}
+
+    def insert_log(experiment, version, timeout):
+        # like mqtt_to_db, after the log's MQTT message woke the tail.
+        g._app_database.execute(
+            "INSERT INTO logs (experiment, pioreactor_unit, timestamp, message, source, level, task) VALUES ('exp1', 'unit2', '2023-10-01T12:20:00Z', 'Stopped mixing', 'mixer', 'WARNING', 'stirring')"
+        )
+        g._app_database.commit()
+        return version + 1
+
+    with patch.object(logs_notifier, "wait", side_effect=insert_log) as wait:
+        response = client.get(
+            f"/api/experiments/exp1/logs/tail?after={tail['after']}&units=unit2&min_level=WARNING"
+        )
+        assert wait.call_count == 1
+    assert [log["message"] for log in response.get_json()["logs"]] == ["Stopped mixing"]
+    assert response.get_json()["after"] == tail["after"] + 1
+
+    assert client.get("/api/experiments/exp1/logs/tail?after=last").status_code == 400
+
+    with patch("pioreactorui.api.tail_slots", Slots(0)):
+        response = client.get("/api/experiments/exp1/logs/tail?after=0&timeout=0")
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+
+
+def test_publish_new_logs_in_one_request(client):
+    from msgspec.json import decode
+
+    logs = [
+        {"pioreactor_unit": "unit1", "message": f"note {i}", "timestamp": "2023-10-01T12:00:00Z"}
+        for i in range(3)
+    ]
+    logs[1]["source"] = "notebook"
+
+    with patch("pioreactorui.api.client.publish") as publish:
+        response = client.post("/api/experiments/exp1/logs/batch", json=logs)
+        assert response.status_code == 202
+        assert [c.args[0] for c in publish.call_args_list] == [
+            "pioreactor/unit1/exp1/logs/ui/info"
+        ] * 3
+        payloads = [decode(c.args[1]) for c in publish.call_args_list]
+        assert [p["message"] for p in payloads] == ["note 0", "note 1", "note 2"]
+        assert [p["task"] for p in payloads] == ["user", "notebook", "user"]
+        assert publish.return_value.wait_for_publish.call_count == 0
+
+        publish.reset_mock()
+        response = client.post("/api/experiments/exp1/logs/batch?wait=1", json=logs)
+        assert response.status_code == 202
+        assert [c.kwargs["qos"] for c in publish.call_args_list] == [0, 0, 1]
+        assert publish.return_value.wait_for_publish.call_count == 1
+
+        publish.return_value.is_published.return_value = False
+        response = client.post("/api/experiments/exp1/logs/batch?wait=1", json=logs)
+        assert response.status_code == 504
+
+        publish.reset_mock()
+        response = client.post("/api/experiments/exp1/logs/batch", json=[{"message": "no unit"}])
+        assert response.status_code == 400
+        assert client.post("/api/experiments/exp1/logs/batch", json=logs[0]).status_code == 400
+        # only the errors were published
+        assert all("/exp1/" not in c.args[0] for c in publish.call_args_list)
+
+
+def test_time_series_and_charts_with_y_transformation(client):
+    response = client.get(
+        "/api/experiments/exp1/time_series/growth_rates",
+        query_string={"lookback": 100000, "y_transformation": "(y) => 24 * y"},
+    )
+    assert response.status_code == 200
+    assert [p["y"] for p in response.get_json()["data"][0]] == [0.24, 0.48]
+
+    response = client.get(
+        "/api/experiments/exp1/time_series/growth_rates",
+        query_string={"y_transformation": "(y) => fetch('/')"},
+    )
+    assert response.status_code == 400
+
+    with patch.dict("pioreactorui.charts.env", {"WWW": "."}):
+        response = client.get(
+            "/api/experiments/exp1/charts?chart_key=implied_daily_growth_rate&transform=1"
+        )
+        chart = response.get_json()["charts"]["implied_daily_growth_rate"]
+        assert chart["transformed"]
+        assert [p["y"] for p in chart["data"][0]] == [0.24, 0.48]
+
+
+def test_time_series_filtered_by_units_and_channels(client):
+    url = "/api/experiments/exp1/time_series/od_readings?lookback=100000"
+    assert client.get(url).get_json()["series"] == ["unit1-1", "unit2-1"]
+
+    response = client.get(url + "&units=unit2")
+    assert response.status_code == 200
+    assert response.get_json()["series"] == ["unit2-1"]
+
+    assert client.get(url + "&units=unit1,unit2&channels=2").get_json()["series"] == []
+    assert client.get(url + "&units=unit1&channels=1&page_size=10").get_json()["series"] == [
+        "unit1-1"
+    ]
+
+    # growth rates have no channels
+    response = client.get("/api/experiments/exp1/time_series/growth_rates?channels=1")
+    assert response.status_code == 400
+
+
+def test_fallback_time_series_of_plugin_tables(client):
+    from flask import g
+
+    url = "/api/experiments/exp1/time_series/plugin_readings/value?lookback=100000"
+    assert client.get(url).status_code == 400
+    assert (
+        client.get("/api/experiments/exp1/time_series/growth_rates/not_a_column").status_code == 400
+    )
+
+    # a plugin creates its table while the server is running
+    g._app_database.execute(
+        "CREATE TABLE plugin_readings (experiment TEXT, pioreactor_unit TEXT, timestamp TEXT, value REAL)"
+    )
+    g._app_database.execute(
+        "INSERT INTO plugin_readings VALUES ('exp1', 'unit1', '2023-10-01T13:00:00.000Z', 1.0)"
+    )
+    g._app_database.commit()
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.get_json()["series"] == ["unit1"]
+
+
+def test_overlay_experiments_aligned_to_their_start(client):
+    from flask import g
+
+    g._app_database.execute(
+        "INSERT INTO growth_rates (experiment, pioreactor_unit, timestamp, rate) VALUES ('exp2', 'unit3', '2023-10-02T16:00:00.000Z', 0.1)"
+    )
+    g._app_database.commit()
+
+    response = client.get("/api/overlays/time_series/growth_rates?experiments=exp1,exp2")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["experiments"] == ["exp1", "exp1", "exp2"]
+    assert data["series"] == ["unit1", "unit2", "unit3"]
+    assert data["data"][0][0] == {"x": 1.0, "y": 0.01}
+    assert data["data"][2] == [{"x": 1.0, "y": 0.1}]
+
+    # only the first hour of each experiment
+    response = client.get("/api/overlays/time_series/growth_rates?experiments=exp1,exp2&hours=1")
+    assert response.get_json()["series"] == []
+
+    assert client.get("/api/overlays/time_series/growth_rates").status_code == 400
+    assert client.get("/api/overlays/time_series/not_a_table?experiments=exp1").status_code == 404
+
+
+def test_logs_are_paginated_with_cursors(client):
+    from flask import g
+
+    g._app_database.executemany(
+        "INSERT INTO logs (experiment, pioreactor_unit, timestamp, message, source, level, task) VALUES (?, ?, ?, ?, 'app', ?, 'task')",
+        [
+            ("exp1", "unit1", "2023-10-01T12:20:00Z", "same timestamp 1", "INFO"),
+            ("exp1", "unit1", "2023-10-01T12:20:00Z", "same timestamp 2", "INFO"),
+            ("$experiment", "leader", "2023-10-01T12:30:00Z", "for all experiments", "INFO"),
+            ("exp1", "unit2", "2023-10-01T12:40:00Z", "debug", "DEBUG"),
+        ],
+    )
+    g._app_database.commit()
+
+    url = "/api/experiments/exp1/logs?lookback=100000&page_size=2"
+    messages = []
+    next_page = None
+    while True:
+        response = client.get(url + (f"&before={next_page}" if next_page else ""))
+        assert response.status_code == 200
+        page = response.get_json()
+        messages.extend(log["message"] for log in page["logs"])
+        next_page = page["next"]
+        if next_page is None:
+            break
+
+    assert messages == [
+        "for all experiments",
+        "same timestamp 2",
+        "same timestamp 1",
+        "OD reading taken",
+        "Started mixing",
+    ]
+
+    response = client.get(url + "&units=unit2&min_level=DEBUG")
+    assert [log["message"] for log in response.get_json()["logs"]] == ["debug", "OD reading taken"]
+
+    response = client.get("/api/workers/unit1/experiments/exp1/logs?lookback=100000&page_size=50")
+    assert [log["message"] for log in response.get_json()["logs"]] == [
+        "same timestamp 2",
+        "same timestamp 1",
+        "Started mixing",
+    ]
+
+    # the default window is the last day
+    assert client.get("/api/experiments/exp1/logs?page_size=50").get_json()["logs"] == []
+    assert client.get("/api/experiments/exp1/logs?before=not_a_token").status_code == 400
+
+
+def test_archived_logs_are_read_by_logs_endpoints_and_search(client, tmp_path):
+    from flask import g
+    from pioreactorui.log_archive import archive_logs
+    from pioreactorui.migrations import migrate_log_search
+
+    url = "/api/experiments/exp1/logs?lookback=100000&page_size=1"
+    expected = client.get(url).get_json()
+    assert [log["message"] for log in expected["logs"]] == ["OD reading taken"]
+
+    assert migrate_log_search(g._app_database) == 3
+    search_url = "/api/logs/search?q=mixing"
+    expected_search = client.get(search_url).get_json()
+    assert [log["message"] for log in expected_search["logs"]] == ["Started mixing"]
+
+    with patch("pioreactorui.log_archive.get_retention_days", return_value=30.0), patch(
+        "pioreactorui.log_archive.get_archive_path", return_value=str(tmp_path / "archive.sqlite")
+    ):
+        with patch("pioreactorui.queries.current_utc_datetime", return_value=datetime(2024, 1, 1)):
+            assert archive_logs(g._app_database) == 2
+            g._app_database.execute("DETACH DATABASE logs_archive")
+
+            assert client.get(url).get_json() == expected
+            response = client.get(url + f"&before={expected['next']}")
+            assert [log["message"] for log in response.get_json()["logs"]] == ["Started mixing"]
+
+            # the archive isn't read for windows after it
+            assert client.get("/api/experiments/exp1/logs?page_size=50").get_json()["logs"] == []
+
+        assert client.get(search_url).get_json() == expected_search
+
+        # a day after the logs, so the default window reaches the archive
+        with patch("pioreactorui.queries.current_utc_datetime", return_value=datetime(2023, 10, 2)):
+            response = client.get("/api/experiments/exp1/logs")
+            assert [log["message"] for log in response.get_json()] == [
+                "OD reading taken",
+                "Started mixing",
+            ]
+            response = client.get("/api/workers/unit1/experiments/exp1/logs")
+            assert [log["message"] for log in response.get_json()] == ["Started mixing"]
+
+
+def test_search_logs(client):
+    from flask import g
+    from pioreactorui.migrations import migrate_log_search
+
+    assert client.get("/api/logs/search?q=mixing").status_code == 503
+
+    assert migrate_log_search(g._app_database) == 3
+    g._app_database.execute(
+        "INSERT INTO logs (experiment, pioreactor_unit, timestamp, message, source, level, task) VALUES ('exp1', 'unit2', '2023-10-01T12:20:00Z', 'Stopped mixing', 'mixer', 'WARNING', 'stirring')"
+    )
+    g._app_database.commit()
+
+    response = client.get("/api/logs/search?q=mixing&sort=recent")
+    assert response.status_code == 200
+    assert [log["message"] for log in response.get_json()["logs"]] == [
+        "Stopped mixing",
+        "Started mixing",
+    ]
+
+    response = client.get("/api/logs/search?q=mix*&experiment=exp1&units=unit2&min_level=WARNING")
+    assert [log["message"] for log in response.get_json()["logs"]] == ["Stopped mixing"]
+
+    # task is searched too
+    response = client.get("/api/logs/search?q=stirring&page_size=1")
+    assert response.get_json()["next_page"] == 1
+    response = client.get("/api/logs/search?q=stirring&page_size=1&page=1")
+    assert len(response.get_json()["logs"]) == 1
+
+    response = client.get("/api/logs/search?q=stirring&start=2023-10-01T12:15:00Z")
+    assert [log["message"] for log in response.get_json()["logs"]] == ["Stopped mixing"]
+
+    assert client.get("/api/logs/search?q=").status_code == 400
+
+
+def test_logs_are_filtered_by_level_before_and_after_the_level_column(client):
+    from flask import g
+    from pioreactorui.migrations import ensure_log_level_column
+
+    g._app_database.executemany(
+        "INSERT INTO logs (experiment, pioreactor_unit, timestamp, message, source, level, task) VALUES ('exp1', 'unit1', ?, ?, 'app', ?, 'task')",
+        [
+            ("2023-10-01T12:20:00Z", "warning", "WARNING"),
+            ("2023-10-01T12:21:00Z", "critical", "CRITICAL"),
+            ("2023-10-01T12:22:00Z", "notice", "notice"),
+        ],
+    )
+    g._app_database.commit()
+
+    url = "/api/experiments/exp1/logs?lookback=100000&page_size=50&min_level="
+    expected = {
+        "WARNING": ["critical", "warning"],
+        "NOTICE": ["notice", "critical", "warning"],
+        "ERROR": ["critical"],
+    }
+    for migrated in (False, True):
+        if migrated:
+            assert ensure_log_level_column(g._app_database)
+            assert not ensure_log_level_column(g._app_database)
+        for min_level, messages in expected.items():
+            response = client.get(url + min_level)
+            assert [log["message"] for log in response.get_json()["logs"]] == messages
+
+
+def test_recent_growth_rates_are_served_from_mqtt_readings(client, app):
+    from flask import g
+
+    now = current_utc_datetime()
+    with patch("pioreactorui.recent_readings.client.is_connected", return_value=True):
+        recent_readings.reset(now=now.timestamp() - 60)
+        for seconds in (30, 20, 10):
+            timestamp = now - timedelta(seconds=seconds)
+            recent_readings.add(
+                "growth_rates",
+                "exp1",
+                "unit1",
+                to_iso_format(timestamp),
+                timestamp.timestamp(),
+                0.5,
+            )
+
+        # only in the buffers, not yet in the app db: served from the app db, so `since` doesn't repeat them.
+        url = "/api/experiments/exp1/time_series/growth_rates?lookback=0.01"
+        response = client.get(url)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["series"] == []
+
+        # the app db has caught up with the buffers
+        g._app_database.execute(
+            "INSERT INTO growth_rates (experiment, pioreactor_unit, timestamp, rate) VALUES ('exp1', 'unit1', ?, 0.5)",
+            (to_iso_format(timestamp),),
+        )
+        g._app_database.commit()
+        chart_cache.invalidate("exp1", "growth_rates")
+
+        data = client.get(url).get_json()
+        assert data["series"] == ["unit1"]
+        assert len(data["data"][0]) == 3
+
+        data = client.get(f"{url}&since={data['cursor']}").get_json()
+        assert data["series"] == []
+
+    recent_readings.reset()
+
+
 def test_create_experiment(client):
     # Create a new experiment
     response = client.post(
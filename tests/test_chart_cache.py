@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import threading
+from time import sleep
+from unittest.mock import patch
+
+from pioreactorui.chart_cache import cached_query_time_series
+from pioreactorui.chart_cache import ChartCache
+
+
+def test_chart_cache_serves_until_invalidated():
+    cursor = 1
+    cache = ChartCache(get_cursor=lambda data_source: cursor)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"n": len(calls), "cursor": cursor}
+
+    assert cache.get_or_compute("exp1", "growth_rates", ("a",), compute)["n"] == 1
+    cursor = 2
+    # no reading of exp1 was published, ex: the new row is exp2's
+    assert cache.get_or_compute("exp1", "growth_rates", ("a",), compute)["n"] == 1
+
+    # other experiments and data sources are unaffected
+    cache.invalidate("exp2", "growth_rates")
+    cache.invalidate("exp1", "od_readings")
+    assert cache.get_or_compute("exp1", "growth_rates", ("a",), compute)["n"] == 1
+
+    cache.invalidate("exp1", "growth_rates")
+    assert cache.get_or_compute("exp1", "growth_rates", ("a",), compute)["n"] == 2
+    assert cache.get_or_compute("exp1", "growth_rates", ("a",), compute)["n"] == 2
+
+
+def test_chart_cache_serves_until_the_published_reading_is_inserted():
+    cursor = 1
+    cache = ChartCache(get_cursor=lambda data_source: cursor)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"n": len(calls), "cursor": cursor}
+
+    cache.get_or_compute("exp1", "growth_rates", ("a",), compute)
+    # the reading isn't in the database yet, so the result is still the database's
+    cache.invalidate("exp1", "growth_rates")
+    assert cache.get_or_compute("exp1", "growth_rates", ("a",), compute)["n"] == 1
+
+    cursor = 2
+    assert cache.get_or_compute("exp1", "growth_rates", ("a",), compute)["n"] == 2
+
+    # many readings, as from several units, don't make results stale by themselves
+    for _ in range(10):
+        cache.invalidate("exp1", "growth_rates")
+    assert cache.get_or_compute("exp1", "growth_rates", ("a",), compute)["n"] == 2
+
+
+def test_chart_cache_computes_concurrent_misses_once():
+    cache = ChartCache(get_cursor=lambda data_source: 1)
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"n": len(calls), "cursor": 1}
+
+    results = []
+
+    def viewer():
+        results.append(cache.get_or_compute("exp1", "growth_rates", ("a",), compute))
+
+    threads = [threading.Thread(target=viewer) for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    # the lock is kept while anyone holds or waits for it
+    while cache._key_locks[("a",)].n_waiters < 5:
+        sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{"n": 1, "cursor": 1}] * 5
+    assert cache._key_locks == {}
+
+
+def test_chart_cache_evicts_least_recently_used():
+    cache = ChartCache(max_entries=2, get_cursor=lambda data_source: 1)
+    cache.get_or_compute("exp1", "growth_rates", ("a",), lambda: {"k": "a", "cursor": 1})
+    cache.get_or_compute("exp1", "growth_rates", ("b",), lambda: {"k": "b", "cursor": 1})
+    cache.get_or_compute("exp1", "growth_rates", ("a",), lambda: {"k": "a2", "cursor": 1})
+    cache.get_or_compute("exp1", "growth_rates", ("c",), lambda: {"k": "c", "cursor": 1})
+
+    assert (
+        cache.get_or_compute("exp1", "growth_rates", ("a",), lambda: {"k": "a3", "cursor": 1})["k"]
+        == "a"
+    )
+    assert (
+        cache.get_or_compute("exp1", "growth_rates", ("b",), lambda: {"k": "b2", "cursor": 1})["k"]
+        == "b2"
+    )
+
+
+def test_incremental_requests_are_not_cached():
+    cache = ChartCache()
+    with patch("pioreactorui.chart_cache.chart_cache", cache), patch(
+        "pioreactorui.chart_cache.is_cacheable", return_value=True
+    ), patch("pioreactorui.chart_cache.query_time_series", return_value={"cursor": 1}):
+        cached_query_time_series("growth_rates", "rate", "exp1", 24.0, since=1)
+        assert len(cache._entries) == 0
+
+        cached_query_time_series("growth_rates", "rate", "exp1", 24.0)
+        assert len(cache._entries) == 1
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import gzip
+import pickle
+
+from flask import Flask
+from flask import jsonify
+from flask import Response
+
+from pioreactorui.compression import compress_response
+from pioreactorui.compression import precompress
+
+BODY = [{"x": f"2024-01-01T00:00:{i:02}Z", "y": 0.5} for i in range(60)]
+
+
+def make_app() -> Flask:
+    app = Flask(__name__)
+    app.after_request(compress_response)
+
+    @app.route("/large")
+    def large():
+        return jsonify(BODY)
+
+    @app.route("/small")
+    def small():
+        return jsonify([1, 2, 3])
+
+    @app.route("/stream")
+    def stream():
+        return Response((b"data: 1\n\n" for _ in range(200)), mimetype="text/event-stream")
+
+    return app
+
+
+def test_large_bodies_are_compressed_if_accepted():
+    client = make_app().test_client()
+
+    uncompressed = client.get("/large")
+    assert "Content-Encoding" not in uncompressed.headers
+
+    response = client.get("/large", headers={"Accept-Encoding": "gzip, deflate"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    assert gzip.decompress(response.data) == uncompressed.data
+
+    for url in ["/small", "/stream"]:
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+
+
+def test_precompressed_bodies_are_kept_with_the_response():
+    app = make_app()
+    calls = []
+
+    @app.route("/memoized")
+    def memoized():
+        # like @cache.memoize, which pickles the response of the view under it.
+        response = precompress(lambda: jsonify(BODY))()
+        calls.append(response)
+        return pickle.loads(pickle.dumps(response))
+
+    response = app.test_client().get("/memoized", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.data == calls[0].precompressed["gzip"]
+    assert gzip.decompress(response.data) == calls[0].get_data()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from pioreactorui.downsampling import lttb
+from pioreactorui.downsampling import lttb_iter
+
+
+def test_lttb_keeps_everything_if_under_threshold():
+    xs = [0.0, 1.0, 2.0]
+    ys = [1.0, 2.0, 3.0]
+    assert lttb(xs, ys, 10) == [0, 1, 2]
+
+
+def test_lttb_keeps_endpoints_and_threshold():
+    xs = [float(i) for i in range(1000)]
+    ys = [float(i % 7) for i in range(1000)]
+    keep = lttb(xs, ys, 50)
+    assert len(keep) == 50
+    assert keep[0] == 0
+    assert keep[-1] == 999
+    assert keep == sorted(keep)
+
+
+def test_lttb_keeps_peaks():
+    xs = [float(i) for i in range(1000)]
+    ys = [0.0] * 1000
+    ys[517] = 10.0  # ex: a spike
+    ys[733] = -10.0  # ex: a dosing dip
+    keep = lttb(xs, ys, 20)
+    assert 517 in keep
+    assert 733 in keep
+
+
+def test_lttb_iter_is_same_as_lttb():
+    xs = [float(i) for i in range(1000)]
+    ys = [float((i * 37) % 101) for i in range(1000)]
+    points = list(zip(xs, ys))
+    for threshold in (0, 1, 2, 3, 50, 999, 1000, 2000):
+        kept = list(lttb_iter(iter(points), len(points), threshold, xy=lambda p: p))
+        assert kept == [points[i] for i in lttb(xs, ys, threshold)]
+
+
+def test_lttb_iter_keeps_last_point_if_stream_ends_early():
+    points = [(float(i), float(i % 3)) for i in range(100)]
+    kept = list(lttb_iter(iter(points), 200, 20, xy=lambda p: p))
+    assert kept[0] == points[0]
+    assert kept[-1] == points[-1]
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import sqlite3
+from datetime import datetime
+from datetime import timezone
+from unittest.mock import patch
+
+from pioreactorui.log_archive import archive_logs
+from pioreactorui.log_archive import create_log_archive
+from pioreactorui.log_archive import create_log_archive_search
+from pioreactorui.log_archive import get_table_columns
+from pioreactorui.log_search import backfill_log_search
+from pioreactorui.log_search import create_log_search
+from pioreactorui.migrations import ensure_log_level_column
+
+NOW = datetime(2024, 6, 1, tzinfo=timezone.utc)
+
+
+def n_matches(con: sqlite3.Connection, query: str, schema: str = "main") -> int:
+    return con.execute(
+        f"SELECT count(1) FROM {schema}.logs_fts AS f WHERE f.logs_fts MATCH ?", (query,)
+    ).fetchone()[0]
+
+
+def test_old_logs_and_logs_of_finished_experiments_are_archived(tmp_path):
+    con = sqlite3.connect(tmp_path / "app.sqlite")
+    con.executescript(
+        """
+        CREATE TABLE logs (experiment TEXT NOT NULL, pioreactor_unit TEXT NOT NULL, timestamp TEXT NOT NULL, message TEXT NOT NULL, source TEXT NOT NULL, level TEXT, task TEXT);
+        CREATE TABLE experiment_worker_assignments (pioreactor_unit TEXT NOT NULL UNIQUE, experiment TEXT NOT NULL, assigned_at TEXT NOT NULL);
+        INSERT INTO experiment_worker_assignments VALUES ('unit1', 'active', '2024-01-01T00:00:00Z');
+        """
+    )
+    con.executemany(
+        "INSERT INTO logs VALUES (?, 'unit1', ?, ?, 'app', 'INFO', 'task')",
+        [
+            ("active", "2024-04-01T00:00:00Z", "old"),
+            ("active", "2024-05-30T00:00:00Z", "recent"),
+            ("finished", "2024-05-30T00:00:00Z", "finished"),
+            ("$experiment", "2024-04-01T00:00:00Z", "old, for all experiments"),
+            ("$experiment", "2024-05-30T00:00:00Z", "recent, for all experiments"),
+            ("finished", "2024-04-01T00:00:00Z", "the newest log, so it's kept"),
+        ],
+    )
+    con.commit()
+    create_log_search(con)
+    backfill_log_search(con)
+    assert n_matches(con, "old") == 2
+
+    archive_path = str(tmp_path / "logs_archive.sqlite")
+    with patch("pioreactorui.log_archive.get_retention_days", return_value=30.0), patch(
+        "pioreactorui.log_archive.get_archive_path", return_value=archive_path
+    ), patch("pioreactorui.log_archive.BATCH_SIZE", 1), patch(
+        "pioreactorui.queries.current_utc_datetime", return_value=NOW
+    ):
+        assert archive_logs(con) == 3
+        assert archive_logs(con) == 0
+
+    remaining = con.execute("SELECT message FROM logs ORDER BY ROWID").fetchall()
+    assert [row[0] for row in remaining] == [
+        "recent",
+        "recent, for all experiments",
+        "the newest log, so it's kept",
+    ]
+
+    archived = con.execute(
+        "SELECT log_id, message FROM logs_archive.logs ORDER BY log_id"
+    ).fetchall()
+    assert archived == [(1, "old"), (3, "finished"), (4, "old, for all experiments")]
+
+    state = con.execute("SELECT * FROM logs_archive_state ORDER BY experiment").fetchall()
+    assert state == [
+        ("$experiment", "2024-04-01T00:00:00Z"),
+        ("active", "2024-04-01T00:00:00Z"),
+        ("finished", "2024-05-30T00:00:00Z"),
+    ]
+
+    # archived logs moved to the archive's search index
+    assert n_matches(con, "old") == 0
+    assert n_matches(con, "old", "logs_archive") == 2
+
+    # and logs archived before it existed are indexed when it's created
+    con.executescript(
+        "DROP TABLE logs_archive.logs_fts; DROP TRIGGER logs_archive.logs_fts_insert;"
+    )
+    create_log_archive_search(con)
+    create_log_archive_search(con)
+    assert n_matches(con, "old", "logs_archive") == 2
+
+    # the archive's logs have level_num like the app db's
+    assert "level_num" not in get_table_columns(con, "logs_archive", "logs")
+    assert ensure_log_level_column(con)
+    create_log_archive(con)
+    assert "level_num" in get_table_columns(con, "logs_archive", "logs")
+
+
+def test_nothing_is_archived_by_default(tmp_path):
+    con = sqlite3.connect(tmp_path / "app.sqlite")
+    with patch("pioreactorui.log_archive.get_retention_days", return_value=0.0):
+        assert archive_logs(con) == 0
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import sqlite3
+
+import pytest
+
+from pioreactorui.log_search import backfill_log_search
+from pioreactorui.log_search import create_log_search
+from pioreactorui.log_search import to_fts_query
+
+
+def search(con: sqlite3.Connection, query: str) -> list[str]:
+    rows = con.execute(
+        """
+        SELECT l.message FROM logs_fts CROSS JOIN logs AS l ON l.ROWID = logs_fts.rowid
+        WHERE logs_fts MATCH ? ORDER BY l.ROWID
+        """,
+        (to_fts_query(query),),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def test_logs_are_indexed_before_and_after_the_index_is_created():
+    con = sqlite3.connect(":memory:")
+    con.execute("CREATE TABLE logs (experiment TEXT, message TEXT, task TEXT)")
+    con.execute("INSERT INTO logs VALUES ('exp1', 'Pump failed to start', 'dosing_automation')")
+    con.commit()
+
+    create_log_search(con)
+    # idempotent
+    create_log_search(con)
+
+    con.execute("INSERT INTO logs VALUES ('exp1', 'Pumping media', 'dosing_automation')")
+    con.commit()
+    assert search(con, "pump*") == ["Pumping media"]
+
+    assert backfill_log_search(con) == 1
+    assert backfill_log_search(con) == 0
+    assert search(con, "pump*") == ["Pump failed to start", "Pumping media"]
+    assert search(con, "pump failed") == ["Pump failed to start"]
+
+    con.execute("DELETE FROM logs WHERE message='Pump failed to start'")
+    con.execute("UPDATE logs SET message='Stirring' WHERE message='Pumping media'")
+    con.commit()
+    assert search(con, "pump*") == []
+    assert search(con, "stirring") == ["Stirring"]
+
+
+def test_searches_are_quoted():
+    assert to_fts_query('od "reading" NEAR* ') == '"od" """reading""" "NEAR"*'
+    with pytest.raises(ValueError):
+        to_fts_query(" * ")
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import sqlite3
+
+from pioreactorui.migrations import ensure_indexes
+from pioreactorui.migrations import ensure_log_level_column
+from pioreactorui.migrations import get_index_columns
+
+
+def test_logs_are_indexed_without_the_level_column(tmp_path):
+    database = tmp_path / "app.sqlite"
+    con = sqlite3.connect(database)
+    con.execute(
+        "CREATE TABLE logs (experiment TEXT, pioreactor_unit TEXT, timestamp TEXT, message TEXT, source TEXT, level TEXT, task TEXT)"
+    )
+    con.commit()
+    con.close()
+
+    # the ALTER TABLE fails, ex: a read-only app db
+    read_only = sqlite3.connect(f"file:{database}?mode=ro", uri=True)
+    assert not ensure_log_level_column(read_only)
+    read_only.close()
+
+    con = sqlite3.connect(database)
+    created = ensure_indexes(con)
+    assert "logs_experiment_timestamp_ix" in created
+    assert "logs_experiment_level_timestamp_ix" not in created
+    assert get_index_columns(con, "logs_experiment_level_timestamp_ix") == ()
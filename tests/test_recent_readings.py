@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from unittest.mock import patch
+
+from pioreactorui.recent_readings import RecentReadings
+from pioreactorui.recent_readings import RingBuffer
+
+
+def test_ring_buffer_keeps_the_latest_readings_in_order():
+    buffer = RingBuffer(capacity=3)
+    for i in range(5):
+        assert buffer.append(f"2024-01-01T00:00:0{i}Z", float(i), i + 0.123456)
+
+    # older than the latest reading
+    assert not buffer.append("2024-01-01T00:00:00Z", 0.0, 0.0)
+
+    assert buffer.evicted_until == 1.0
+    assert buffer.window("", "9999", 2) == [
+        ("2024-01-01T00:00:02Z", 2.0, 2.12),
+        ("2024-01-01T00:00:03Z", 3.0, 3.12),
+        ("2024-01-01T00:00:04Z", 4.0, 4.12),
+    ]
+    # [start, end)
+    assert [x for (x, _, _) in buffer.window("2024-01-01T00:00:03", "2024-01-01T00:00:04", 2)] == [
+        "2024-01-01T00:00:03Z"
+    ]
+
+    buffer.drop_before(4.0)
+    assert buffer.window("", "9999", 2) == [("2024-01-01T00:00:04Z", 4.0, 4.12)]
+
+
+def test_recent_readings_cover_the_time_since_connecting():
+    recent_readings = RecentReadings(hours=1.0)
+
+    with patch("pioreactorui.recent_readings.client.is_connected", return_value=True):
+        # never connected
+        assert recent_readings.covered_since("growth_rates", "exp1") == float("inf")
+
+        recent_readings.reset(now=1000.0)
+        assert recent_readings.covered_since("growth_rates", "exp1", now=1500.0) == 1000.0
+        assert recent_readings.covered_since("growth_rates", "exp1", now=5000.0) == 5000.0 - 3600
+
+        for experiment, value in [("exp1", 0.1), ("exp2", 0.2)]:
+            recent_readings.add(
+                "growth_rates",
+                experiment,
+                "unit1",
+                "2024-01-01T00:00:00Z",
+                1100.0,
+                value,
+                now=1100.0,
+            )
+        assert recent_readings.window("growth_rates", "exp1", "", "9999", 5) == {
+            "unit1": [("2024-01-01T00:00:00Z", 1100.0, 0.1)]
+        }
+        assert recent_readings.window("growth_rates", "exp3", "", "9999", 5) == {}
+
+    with patch("pioreactorui.recent_readings.client.is_connected", return_value=False):
+        assert recent_readings.covered_since("growth_rates", "exp1", now=1500.0) == float("inf")
+
+
+def test_recent_readings_are_pruned_after_the_buffered_hours():
+    recent_readings = RecentReadings(hours=1.0)
+    recent_readings.reset(now=0.0)
+
+    recent_readings.add("growth_rates", "exp1", "unit1", "2024-01-01T00:00:00Z", 0.0, 0.1, now=0.0)
+    recent_readings.add(
+        "growth_rates", "exp1", "unit1", "2024-01-01T01:00:01Z", 3601.0, 0.2, now=3601.0
+    )
+    assert recent_readings.window("growth_rates", "exp1", "", "9999", 5) == {
+        "unit1": [("2024-01-01T01:00:01Z", 3601.0, 0.2)]
+    }
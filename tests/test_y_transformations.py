@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import pytest
+
+from pioreactorui.y_transformations import compile_y_transformation
+from pioreactorui.y_transformations import transform_result
+
+
+@pytest.mark.parametrize(
+    "source,y,expected",
+    [
+        ("(y) => y", 2.0, 2.0),
+        ("(y) => 24 * y", 2.0, 48.0),
+        ("y => y / 1000 + 1", 500.0, 1.5),
+        ("(y) => { return Math.log(y) / Math.LN10; }", 100.0, 2.0),
+        ("(od) => Math.pow(od, 2) - 1", 3.0, 8.0),
+        ("(y) => -7 % 3", 0.0, -1.0),  # like JavaScript, not Python
+        ("(y) => Math.max(y, 0) * Math.PI", -1.0, 0.0),
+    ],
+)
+def test_compile_y_transformation(source, y, expected):
+    assert compile_y_transformation(source)(y) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "24 * y",
+        "(y) => y.toFixed(2)",
+        "(y) => __import__('os').system('ls')",
+        "(y) => Math.random()",
+        "(y) => z",
+        "(y) => [y][0]",
+        "(y) => y ? 1 : 0",
+    ],
+)
+def test_compile_y_transformation_rejects_everything_else(source):
+    with pytest.raises(ValueError):
+        compile_y_transformation(source)
+
+
+def test_transform_result_has_null_for_undefined_values():
+    result = {"series": ["unit1"], "data": [[("t0", 0.0, 1.0), ("t1", 1.0, 0.0)]], "cursor": 2}
+    transformed = transform_result(result, compile_y_transformation("(y) => Math.log(y) + 1/3"), 3)
+    assert transformed == {
+        "series": ["unit1"],
+        "data": [[("t0", 0.0, 0.333), ("t1", 1.0, None)]],
+        "cursor": 2,
+    }